@@ -1,6 +1,9 @@
 
 from django.contrib import admin
-from .models import Stock, MarketIndex, HistoricalData, Portfolio, Holding, Order, Watchlist, UserProfile
+from .models import (
+    Stock, MarketIndex, HistoricalData, Portfolio, Holding, Order, Watchlist, UserProfile,
+    ScreenerRun, ScreenerResult, PortfolioSnapshot, ReportRun
+)
 
 @admin.register(Stock)
 class StockAdmin(admin.ModelAdmin):
@@ -30,6 +33,11 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ['portfolio', 'stock', 'order_type', 'quantity', 'price', 'status', 'timestamp']
     list_filter = ['portfolio__user', 'order_type', 'status']
 
+@admin.register(PortfolioSnapshot)
+class PortfolioSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['portfolio', 'kind', 'timestamp', 'value', 'realized_pnl', 'unrealized_pnl']
+    list_filter = ['kind']
+
 @admin.register(Watchlist)
 class WatchlistAdmin(admin.ModelAdmin):
     list_display = ['user', 'name', 'created_at']
@@ -38,3 +46,18 @@ class WatchlistAdmin(admin.ModelAdmin):
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'initial_capital', 'risk_profile']
+
+@admin.register(ScreenerRun)
+class ScreenerRunAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'symbols', 'shards', 'created_at', 'completed_at']
+    list_filter = ['status']
+
+@admin.register(ScreenerResult)
+class ScreenerResultAdmin(admin.ModelAdmin):
+    list_display = ['run', 'stock', 'rank', 'score', 'momentum_3m', 'trend', 'volatility']
+    list_filter = ['run']
+
+@admin.register(ReportRun)
+class ReportRunAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'format', 'user', 'users', 'total', 'created_at', 'completed_at']
+    list_filter = ['status', 'format']
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TradingApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'trading_api'
+    
+    def ready(self):
+        from . import receivers  # noqa: F401
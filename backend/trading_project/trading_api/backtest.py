@@ -0,0 +1,367 @@
+
+"""
+Vectorized backtesting engine.
+
+Bars are loaded once into columnar NumPy arrays and every strategy is written
+as whole-array operations that produce a target position series (1 = long,
+0 = flat). Positions are decided on the close of a bar and held from the next
+bar onwards, so no strategy can look ahead.
+
+A position normally earns the underlying's close-to-close returns. Strategies
+that trade something derived from it (option premium) register a returns
+model that supplies their per-bar returns instead.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from .barstore import bar_store
+from . import options
+from .indicators import rsi, sma
+
+TRADING_DAYS = 252
+
+PERIODS = {
+    '1M': timedelta(days=30),
+    '3M': timedelta(days=91),
+    '6M': timedelta(days=182),
+    '1Y': timedelta(days=365),
+    '3Y': timedelta(days=3 * 365),
+    '5Y': timedelta(days=5 * 365),
+}
+
+STRATEGIES = {}
+RETURN_MODELS = {}
+
+
+def load_bars(stock, start=None, end=None):
+    """
+    Load a stock's daily bars from the bar store as memory-mapped columns
+    """
+    bar_store.sync(stock)
+    return bar_store.query(stock.symbol, start, end, '1d')
+
+
+def load_period(stock, timeframe='1Y', start=None, end=None):
+    """
+    Load the bars for a backtest window.
+
+    Without an explicit ``start`` the window is ``timeframe`` long and ends on
+    the most recent stored bar.
+    """
+    bars = load_bars(stock, end=end)
+    if len(bars) == 0:
+        return bars
+    if start is None:
+        last_date = bars.dates[-1].astype('datetime64[us]').item()
+        start = last_date - PERIODS[timeframe]
+    return bars.slice(start=start)
+
+
+def strategy(name, **defaults):
+    """
+    Register a position function under the id used by the Backtesting page
+    """
+    def register(func):
+        STRATEGIES[name] = (func, defaults)
+        return func
+    return register
+
+
+def returns_model(name):
+    """
+    Register the per-bar returns a strategy's position earns; it is called
+    with the bars and the strategy's parameters
+    """
+    def register(func):
+        RETURN_MODELS[name] = func
+        return func
+    return register
+
+
+# Vectorized building blocks
+
+def rolling_max(values, period):
+    return pd.Series(values).rolling(period, min_periods=period).max().to_numpy()
+
+
+def rolling_min(values, period):
+    return pd.Series(values).rolling(period, min_periods=period).min().to_numpy()
+
+
+def shift(values, periods=1):
+    """
+    Shift an array forward in time, padding the start with NaN
+    """
+    out = np.full(len(values), np.nan)
+    if periods < len(values):
+        out[periods:] = values[:len(values) - periods]
+    return out
+
+
+def rolling_volatility(close, period):
+    """
+    Annualized standard deviation of the last ``period`` log returns
+    """
+    log_returns = np.diff(np.log(close), prepend=np.nan)
+    return pd.Series(log_returns).rolling(period, min_periods=period).std().to_numpy() * np.sqrt(TRADING_DAYS)
+
+
+def latch(entries, exits):
+    """
+    Turn entry/exit event arrays into a held position without a Python loop.
+
+    Each bar carries forward the most recent event; exits win ties.
+    """
+    events = np.where(exits, 0.0, np.where(entries, 1.0, np.nan))
+    index = np.where(np.isnan(events), 0, np.arange(len(events)))
+    np.maximum.accumulate(index, out=index)
+    position = events[index]
+    return np.nan_to_num(position, nan=0.0)
+
+
+# Strategies listed on the Backtesting page
+
+@strategy('moving-avg', fast=20, slow=50)
+def moving_average_crossover(bars, fast, slow):
+    fast_ma = sma(bars.close, int(fast))
+    slow_ma = sma(bars.close, int(slow))
+    return np.nan_to_num((fast_ma > slow_ma).astype(np.float64))
+
+
+@strategy('rsi-based', period=14, lower=30, upper=70)
+def rsi_reversal(bars, period, lower, upper):
+    values = rsi(bars.close, int(period))
+    return latch(values < lower, values > upper)
+
+
+@strategy('breakout', window=20, exit_window=10, volume_factor=1.5)
+def breakout(bars, window, exit_window, volume_factor):
+    resistance = shift(rolling_max(bars.high, int(window)))
+    support = shift(rolling_min(bars.low, int(exit_window)))
+    average_volume = shift(sma(bars.volume.astype(np.float64), int(window)))
+    entries = (bars.close > resistance) & (bars.volume > volume_factor * average_volume)
+    exits = bars.close < support
+    return latch(entries, exits)
+
+
+@strategy('volume-profile', window=50, band=1.0)
+def volume_profile(bars, window, band):
+    """
+    Trade acceptance above the rolling value area.
+
+    The point of control is approximated by the rolling VWAP and the value area
+    by a volume-weighted standard deviation band around it.
+    """
+    window = int(window)
+    typical = (bars.high + bars.low + bars.close) / 3.0
+    volume = bars.volume.astype(np.float64)
+    volume_sum = pd.Series(volume).rolling(window, min_periods=window).sum().to_numpy()
+    pv_sum = pd.Series(typical * volume).rolling(window, min_periods=window).sum().to_numpy()
+    p2v_sum = pd.Series(typical * typical * volume).rolling(window, min_periods=window).sum().to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        poc = pv_sum / volume_sum
+        deviation = np.sqrt(np.maximum(p2v_sum / volume_sum - poc * poc, 0.0))
+    value_area_high = poc + band * deviation
+    entries = (bars.close > value_area_high) & (volume > volume_sum / window)
+    exits = bars.close < poc
+    return latch(entries, exits)
+
+
+@strategy('ichimoku', tenkan=9, kijun=26, senkou=52)
+def ichimoku(bars, tenkan, kijun, senkou):
+    tenkan, kijun, senkou = int(tenkan), int(kijun), int(senkou)
+    conversion = (rolling_max(bars.high, tenkan) + rolling_min(bars.low, tenkan)) / 2.0
+    base = (rolling_max(bars.high, kijun) + rolling_min(bars.low, kijun)) / 2.0
+    span_a = shift((conversion + base) / 2.0, kijun)
+    span_b = shift((rolling_max(bars.high, senkou) + rolling_min(bars.low, senkou)) / 2.0, kijun)
+    cloud_top = np.fmax(span_a, span_b)
+    return np.nan_to_num(((bars.close > cloud_top) & (conversion > base)).astype(np.float64))
+
+
+@strategy('option-premium', days=30, roll=5, otm=0.05, vol_window=20, vol_premium=1.2)
+def option_premium(bars, days, roll, otm, vol_window, vol_premium):
+    """
+    Stay short a cash-secured put once volatility can be estimated; the
+    returns model below does the pricing
+    """
+    return np.isfinite(rolling_volatility(bars.close, int(vol_window))).astype(np.float64)
+
+
+@returns_model('option-premium')
+def option_premium_returns(bars, days, roll, otm, vol_window, vol_premium):
+    """
+    Mark-to-market of a short put as a fraction of its collateral (the strike).
+
+    A put ``otm`` below the close with ``days`` bars to expiry is sold and
+    bought back ``roll`` bars before expiry, when the next one is sold. Puts
+    are priced with Black-Scholes at trailing realized volatility times
+    ``vol_premium`` (implied usually trades above realized).
+    """
+    close = bars.close
+    volatility = rolling_volatility(close, int(vol_window)) * vol_premium
+    returns = np.zeros(len(close))
+    available = np.flatnonzero(np.isfinite(volatility))
+    if len(available) == 0:
+        return returns
+    start, days = available[0], int(days)
+    hold = max(days - int(roll), 1)
+
+    # Each bar is marked against the contract that was open at the previous close
+    index = np.arange(start + 1, len(close))
+    entry = start + (index - 1 - start) // hold * hold
+    strike = close[entry] * (1.0 - otm)
+    remaining = entry + days - index
+    before = options.price(close[index - 1], strike, (remaining + 1) / TRADING_DAYS, volatility[index - 1], False)
+    after = options.price(close[index], strike, remaining / TRADING_DAYS, volatility[index], False)
+    returns[index] = (before - after) / strike
+    return returns
+
+
+# Simulation and metrics
+
+def bar_returns(bars, strategy_name, params):
+    """
+    Per-bar returns from the strategy's returns model; None means the
+    underlying's close-to-close returns
+    """
+    model = RETURN_MODELS.get(strategy_name)
+    return model(bars, **params) if model is not None else None
+
+
+def simulate(close, position, initial_capital=100000.0, commission=0.0, asset_returns=None):
+    """
+    Compound per-bar returns for a target position series.
+
+    ``commission`` is a fraction of traded notional charged on every change in
+    position; ``asset_returns`` defaults to close-to-close returns. Returns the
+    per-bar strategy returns and the equity curve.
+    """
+    held = shift(position)
+    held[0] = 0.0
+    if asset_returns is None:
+        asset_returns = np.zeros(len(close))
+        asset_returns[1:] = close[1:] / close[:-1] - 1.0
+    turnover = np.abs(np.diff(held, prepend=0.0))
+    returns = held * asset_returns - commission * turnover
+    equity = initial_capital * np.cumprod(1.0 + returns)
+    return returns, equity
+
+
+def extract_trades(position, equity, close):
+    """
+    Locate round trips as (entry index, exit index) pairs.
+
+    Signals fill at the close of the bar on which they fire; a position that is
+    still open on the last bar is closed there.
+    """
+    flat_at_end = position.copy()
+    if len(flat_at_end):
+        flat_at_end[-1] = 0.0
+    changes = np.diff(flat_at_end, prepend=0.0)
+    entries = np.flatnonzero(changes > 0)
+    exits = np.flatnonzero(changes < 0)
+    pnl = equity[exits] - equity[entries]
+    quantity = np.floor(equity[entries] / close[entries])
+    return entries, exits, pnl, quantity
+
+
+def compute_metrics(returns, equity, pnl, initial_capital, bars_per_year=TRADING_DAYS):
+    """
+    Summary statistics shown on the Backtesting page
+    """
+    if len(equity) == 0:
+        return {
+            'totalReturn': 0.0, 'annualizedReturn': 0.0, 'sharpeRatio': 0.0,
+            'maxDrawdown': 0.0, 'winRate': 0.0, 'profitFactor': None,
+            'averageWin': 0.0, 'averageLoss': 0.0, 'totalTrades': 0,
+            'profitableTrades': 0, 'losingTrades': 0,
+        }
+
+    growth = equity[-1] / initial_capital
+    years = len(equity) / bars_per_year
+    annualized = growth ** (1.0 / years) - 1.0 if years > 0 and growth > 0 else -1.0
+    std = returns.std()
+    sharpe = returns.mean() / std * np.sqrt(bars_per_year) if std > 0 else 0.0
+    peaks = np.maximum.accumulate(equity)
+    max_drawdown = ((peaks - equity) / peaks).max()
+
+    wins = pnl[pnl > 0]
+    losses = pnl[pnl < 0]
+    gross_loss = -losses.sum()
+    return {
+        'totalReturn': round(float(growth - 1.0) * 100, 2),
+        'annualizedReturn': round(float(annualized) * 100, 2),
+        'sharpeRatio': round(float(sharpe), 2),
+        'maxDrawdown': round(float(max_drawdown) * 100, 2),
+        'winRate': round(len(wins) / len(pnl) * 100, 2) if len(pnl) else 0.0,
+        'profitFactor': round(float(wins.sum() / gross_loss), 2) if gross_loss > 0 else None,
+        'averageWin': round(float(wins.mean()), 2) if len(wins) else 0.0,
+        'averageLoss': round(float(losses.mean()), 2) if len(losses) else 0.0,
+        'totalTrades': int(len(pnl)),
+        'profitableTrades': int(len(wins)),
+        'losingTrades': int(len(losses)),
+    }
+
+
+def resolve_params(strategy_name, params=None):
+    """
+    Merge user supplied parameters over the strategy defaults
+    """
+    if strategy_name not in STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy_name}'")
+    func, defaults = STRATEGIES[strategy_name]
+    unknown = set(params or {}) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown parameters for {strategy_name}: {', '.join(sorted(unknown))}")
+    return func, {**defaults, **(params or {})}
+
+
+def evaluate(bars, strategy_name, params=None, initial_capital=100000.0, commission=0.0):
+    """
+    Run a strategy and return only its metrics; used by parameter sweeps
+    """
+    func, params = resolve_params(strategy_name, params)
+    position = func(bars, **params)
+    returns, equity = simulate(bars.close, position, initial_capital, commission,
+                               bar_returns(bars, strategy_name, params))
+    _, _, pnl, _ = extract_trades(position, equity, bars.close)
+    return compute_metrics(returns, equity, pnl, initial_capital)
+
+
+def run_backtest(bars, strategy_name, params=None, initial_capital=100000.0,
+                 commission=0.0, symbol=''):
+    """
+    Run a strategy and return metrics, equity curve and trade list
+    """
+    func, params = resolve_params(strategy_name, params)
+    position = func(bars, **params)
+    returns, equity = simulate(bars.close, position, initial_capital, commission,
+                               bar_returns(bars, strategy_name, params))
+    entries, exits, pnl, quantity = extract_trades(position, equity, bars.close)
+
+    benchmark = initial_capital * bars.close / bars.close[0] if len(bars) else bars.close
+    dates = np.datetime_as_string(bars.dates, unit='D')
+    performance = [
+        {'date': date, 'value': round(value, 2), 'benchmark': round(bench, 2)}
+        for date, value, bench in zip(dates.tolist(), equity.tolist(), benchmark.tolist())
+    ]
+
+    trades = []
+    for entry, exit, trade_pnl, qty in zip(entries.tolist(), exits.tolist(), pnl.tolist(), quantity.tolist()):
+        trade_pnl = round(trade_pnl, 2)
+        trades.append({'date': dates[entry], 'symbol': symbol, 'type': 'BUY',
+                       'price': round(float(bars.close[entry]), 2), 'quantity': int(qty), 'pnl': trade_pnl})
+        trades.append({'date': dates[exit], 'symbol': symbol, 'type': 'SELL',
+                       'price': round(float(bars.close[exit]), 2), 'quantity': int(qty), 'pnl': trade_pnl})
+
+    return {
+        'strategy': strategy_name,
+        'symbol': symbol,
+        'params': params,
+        'performanceData': performance,
+        'trades': trades,
+        'metrics': compute_metrics(returns, equity, pnl, initial_capital),
+    }
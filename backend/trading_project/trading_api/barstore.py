@@ -0,0 +1,420 @@
+
+"""
+Columnar, memory-mapped OHLCV bar store.
+
+Each symbol keeps one flat file per column (int64 nanosecond timestamps,
+float64 prices and int64 volume) that is appended to in place and memory-mapped
+on read, so a date-range slice is two binary searches and no copying.
+``HistoricalData`` stays the source of truth; the store catches up from it with
+a single indexed query and can always be rebuilt from it.
+"""
+
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import timezone
+
+import numpy as np
+from django.conf import settings
+
+from .models import HistoricalData
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+COLUMNS = (
+    ('dates', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.int64),
+)
+
+RAW = 'raw'
+
+# Bucket widths in seconds for the candle intervals the API can serve
+INTERVALS = {
+    '1m': 60,
+    '5m': 5 * 60,
+    '15m': 15 * 60,
+    '30m': 30 * 60,
+    '1h': 60 * 60,
+    '1d': 24 * 60 * 60,
+    '1w': 7 * 24 * 60 * 60,
+}
+
+# Weekly candles start on Monday; the Unix epoch fell on a Thursday
+WEEK_ORIGIN_NS = -3 * INTERVALS['1d'] * 10**9
+
+
+class Bars:
+    """
+    Columnar OHLCV arrays for a single symbol, oldest bar first
+    """
+    __slots__ = ('dates', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, dates, open, high, low, close, volume):
+        self.dates = dates
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def __len__(self):
+        return len(self.close)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype='datetime64[ns]'), *(np.empty(0, dtype=dtype) for _, dtype in COLUMNS[1:]))
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('Bars only support slicing')
+        return Bars(*(getattr(self, name)[index] for name in self.__slots__))
+
+    def tail(self, count):
+        return self[max(len(self) - count, 0):]
+
+    def slice(self, start=None, end=None):
+        """
+        Return the bars whose date falls within [start, end]
+        """
+        lo = 0 if start is None else np.searchsorted(self.dates, to_datetime64(start), 'left')
+        hi = len(self) if end is None else np.searchsorted(self.dates, to_datetime64(end), 'right')
+        return Bars(*(getattr(self, name)[lo:hi] for name in self.__slots__))
+
+
+def to_datetime64(value):
+    """
+    Convert a (possibly timezone-aware) datetime to naive UTC datetime64[ns]
+    """
+    if getattr(value, 'tzinfo', None) is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, 'ns')
+
+
+def to_datetime(value):
+    """
+    Convert a datetime64 back into an aware UTC datetime
+    """
+    return value.astype('datetime64[us]').item().replace(tzinfo=timezone.utc)
+
+
+def bucket_params(interval):
+    width = INTERVALS[interval] * 10**9
+    origin = WEEK_ORIGIN_NS if interval == '1w' else 0
+    return width, origin
+
+
+def floor_to_interval(value, interval):
+    """
+    Round a datetime (or datetime64) down to the start of its candle
+    """
+    width, origin = bucket_params(interval)
+    ns = to_datetime64(value).astype(np.int64)
+    return np.datetime64(int((ns - origin) // width * width + origin), 'ns')
+
+
+def resample(bars, interval):
+    """
+    Aggregate bars into ``interval`` candles with one vectorized pass.
+
+    Bars must be sorted; each run of bars falling into the same bucket becomes
+    one candle stamped with the bucket's start time.
+    """
+    if len(bars) == 0:
+        return Bars.empty()
+    width, origin = bucket_params(interval)
+    buckets = (np.asarray(bars.dates).astype('datetime64[ns]').astype(np.int64) - origin) // width
+    starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+    ends = np.append(starts[1:], len(buckets)) - 1
+    return Bars(
+        (buckets[starts] * width + origin).astype('datetime64[ns]'),
+        np.asarray(bars.open)[starts],
+        np.maximum.reduceat(np.asarray(bars.high), starts),
+        np.minimum.reduceat(np.asarray(bars.low), starts),
+        np.asarray(bars.close)[ends],
+        np.add.reduceat(np.asarray(bars.volume), starts),
+    )
+
+
+def column_values(bars, name, dtype):
+    values = np.asarray(getattr(bars, name))
+    if name == 'dates':
+        values = values.astype('datetime64[ns]').view(np.int64)
+    return np.ascontiguousarray(values, dtype=dtype)
+
+
+class BarStore:
+    """
+    Per-symbol column files for raw bars plus incrementally maintained rollups.
+
+    Every append to the raw bars recomputes only the trailing buckets of each
+    rollup level (e.g. 5m -> 1h -> 1d), each from the level below it, so long
+    range chart queries read a coarse level and never touch raw bars.
+    """
+
+    def __init__(self, root, rollups=()):
+        self.root = str(root)
+        self.rollups = sorted(rollups, key=INTERVALS.__getitem__)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def path(self, symbol, interval=RAW):
+        return os.path.join(self.root, symbol, interval)
+
+    @contextmanager
+    def lock(self, symbol):
+        """
+        Serialize writers for a symbol across threads and processes
+        """
+        with self._locks_guard:
+            thread_lock = self._locks.setdefault(symbol, threading.Lock())
+        with thread_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.join(self.root, symbol), exist_ok=True)
+            with open(os.path.join(self.root, symbol, '.lock'), 'a') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def length(self, symbol, interval=RAW):
+        """
+        Number of complete bars; a reader never sees a half-appended row
+        """
+        directory = self.path(symbol, interval)
+        try:
+            return min(os.path.getsize(os.path.join(directory, name)) // 8 for name, _ in COLUMNS)
+        except FileNotFoundError:
+            return 0
+
+    def read(self, symbol, start=None, end=None, interval=RAW):
+        """
+        Memory-map a symbol's columns and slice them to [start, end]
+        """
+        length = self.length(symbol, interval)
+        if length == 0:
+            return Bars.empty()
+        directory = self.path(symbol, interval)
+        columns = [
+            np.memmap(os.path.join(directory, name), dtype=dtype, mode='r', shape=(length,))
+            for name, dtype in COLUMNS
+        ]
+        columns[0] = columns[0].view('datetime64[ns]')
+        return Bars(*columns).slice(start, end)
+
+    def last_timestamp(self, symbol, interval=RAW):
+        """
+        Timestamp of the newest stored bar as datetime64[ns], or None
+        """
+        length = self.length(symbol, interval)
+        if length == 0:
+            return None
+        with open(os.path.join(self.path(symbol, interval), 'dates'), 'rb') as handle:
+            handle.seek((length - 1) * 8)
+            return np.frombuffer(handle.read(8), dtype=np.int64).view('datetime64[ns]')[0]
+
+    def append(self, symbol, bars, interval=RAW):
+        """
+        Add bars to a symbol.
+
+        Bars newer than everything stored are appended in place; anything that
+        overlaps or precedes stored data triggers a merge where the incoming
+        bar wins for a duplicate timestamp.
+        """
+        if len(bars) == 0:
+            return 0
+        with self.lock(symbol):
+            last = self.last_timestamp(symbol, interval)
+            order = np.argsort(bars.dates, kind='stable')
+            dates = np.asarray(bars.dates)[order]
+            order = order[np.append(dates[1:] != dates[:-1], True)]
+            incoming = Bars(*(np.asarray(getattr(bars, name))[order] for name in Bars.__slots__))
+            if last is None or incoming.dates[0] > last:
+                self._append_columns(symbol, interval, incoming)
+            else:
+                self._merge(symbol, interval, incoming)
+            if interval == RAW:
+                self._update_rollups(symbol, incoming.dates[0])
+        return len(bars)
+
+    def replace(self, symbol, bars, interval=RAW):
+        """
+        Atomically swap a symbol's columns for ``bars``
+        """
+        with self.lock(symbol):
+            self._write(symbol, interval, bars)
+            if interval == RAW:
+                self._update_rollups(symbol, None)
+
+    def query(self, symbol, start=None, end=None, interval=None):
+        """
+        Candles for [start, end] at ``interval``.
+
+        Reads the coarsest stored level whose width divides ``interval`` and
+        aggregates the rest on the fly; ``start`` is widened to a bucket
+        boundary so the first candle is complete.
+        """
+        if interval is None:
+            return self.read(symbol, start, end)
+        source = RAW
+        for level in self.rollups:
+            if INTERVALS[interval] % INTERVALS[level] == 0 and self.length(symbol, level):
+                source = level
+        if start is not None:
+            start = floor_to_interval(start, interval)
+        bars = self.read(symbol, start, end, interval=source)
+        return bars if source == interval else resample(bars, interval)
+
+    def delete(self, symbol, interval=None):
+        with self.lock(symbol):
+            target = os.path.join(self.root, symbol) if interval is None else self.path(symbol, interval)
+            shutil.rmtree(target, ignore_errors=True)
+
+    def _update_rollups(self, symbol, since):
+        """
+        Recompute each rollup level from the bucket containing ``since``
+        (or entirely when ``since`` is None)
+        """
+        source = RAW
+        for level in self.rollups:
+            if since is not None and self.length(symbol, level):
+                since = floor_to_interval(since, level)
+                rolled = resample(self.read(symbol, start=since, interval=source), level)
+                existing = self.read(symbol, interval=level).dates
+                self._append_columns(symbol, level, rolled, at=np.searchsorted(existing, since, 'left'))
+            else:
+                self._write(symbol, level, resample(self.read(symbol, interval=source), level))
+            source = level
+
+    def _append_columns(self, symbol, interval, bars, at=None):
+        """
+        Write ``bars`` at row ``at`` (default: the end), truncating anything after it
+        """
+        directory = self.path(symbol, interval)
+        os.makedirs(directory, exist_ok=True)
+        length = self.length(symbol, interval) if at is None else int(at)
+        # Timestamps go last so a concurrent reader's length never runs ahead
+        for name, dtype in COLUMNS[1:] + COLUMNS[:1]:
+            path = os.path.join(directory, name)
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as handle:
+                # Drop any partial tail left by an interrupted append
+                handle.truncate(length * 8)
+                handle.seek(length * 8)
+                handle.write(column_values(bars, name, dtype).tobytes())
+
+    def _merge(self, symbol, interval, incoming):
+        existing = self.read(symbol, interval=interval)
+        merged = Bars(*(np.concatenate((np.asarray(getattr(existing, name)), np.asarray(getattr(incoming, name))))
+                        for name in Bars.__slots__))
+        # Stable sort keeps incoming rows after existing ones for equal timestamps
+        order = np.argsort(merged.dates, kind='stable')
+        dates = merged.dates[order]
+        keep = np.append(dates[1:] != dates[:-1], True)
+        self._write(symbol, interval, Bars(*(getattr(merged, name)[order][keep] for name in Bars.__slots__)))
+
+    def _write(self, symbol, interval, bars):
+        directory = self.path(symbol, interval)
+        staging = directory + '.tmp'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        for name, dtype in COLUMNS:
+            column_values(bars, name, dtype).tofile(os.path.join(staging, name))
+        retired = directory + '.old'
+        shutil.rmtree(retired, ignore_errors=True)
+        if os.path.exists(directory):
+            os.replace(directory, retired)
+        os.replace(staging, directory)
+        shutil.rmtree(retired, ignore_errors=True)
+
+    def sync(self, stock):
+        """
+        Catch a symbol up with ``HistoricalData`` rows newer than its last bar
+        """
+        queryset = HistoricalData.objects.filter(stock=stock)
+        last = self.last_timestamp(stock.symbol)
+        if last is not None:
+            queryset = queryset.filter(date__gt=to_datetime(last))
+        rows = list(queryset.order_by('date').values_list(
+            'date', 'open_price', 'high_price', 'low_price', 'close_price', 'volume'
+        ))
+        if rows:
+            self.append(stock.symbol, rows_to_bars(rows))
+        return len(rows)
+
+    def sync_many(self, stocks):
+        """
+        Catch many symbols up at once: one query for symbols the store has
+        never seen and one for the rest, starting at the oldest last bar
+        """
+        stocks = list(stocks)
+        last = {stock.id: self.last_timestamp(stock.symbol) for stock in stocks}
+        symbols = {stock.id: stock.symbol for stock in stocks}
+        fresh = [stock_id for stock_id, value in last.items() if value is None]
+        known = [stock_id for stock_id, value in last.items() if value is not None]
+        querysets = []
+        if fresh:
+            querysets.append(HistoricalData.objects.filter(stock_id__in=fresh))
+        if known:
+            since = to_datetime(min(last[stock_id] for stock_id in known))
+            querysets.append(HistoricalData.objects.filter(stock_id__in=known, date__gt=since))
+
+        rows_by_stock = {}
+        for queryset in querysets:
+            for row in queryset.order_by('stock_id', 'date').values_list(
+                    'stock_id', 'date', 'open_price', 'high_price', 'low_price', 'close_price', 'volume'
+            ).iterator(chunk_size=10000):
+                rows_by_stock.setdefault(row[0], []).append(row[1:])
+
+        total = 0
+        for stock_id, rows in rows_by_stock.items():
+            bars = rows_to_bars(rows)
+            if last[stock_id] is not None:
+                bars = bars[np.searchsorted(bars.dates, last[stock_id], 'right'):]
+            if len(bars):
+                total += self.append(symbols[stock_id], bars)
+        return total
+
+    def rebuild(self, stock):
+        """
+        Rewrite a symbol from scratch out of ``HistoricalData``
+        """
+        rows = list(HistoricalData.objects.filter(stock=stock).order_by('date').values_list(
+            'date', 'open_price', 'high_price', 'low_price', 'close_price', 'volume'
+        ))
+        self.replace(stock.symbol, rows_to_bars(rows) if rows else Bars.empty())
+        return len(rows)
+
+
+def index_symbol(name):
+    """
+    Store key under which a MarketIndex's value history is kept
+    """
+    return '^' + name.upper().replace(' ', '_')
+
+
+def rows_to_bars(rows):
+    """
+    Convert (date, open, high, low, close, volume) tuples into columnar bars
+    """
+    dates, opens, highs, lows, closes, volumes = zip(*rows)
+    return Bars(
+        np.array([to_datetime64(date) for date in dates], dtype='datetime64[ns]'),
+        np.array(opens, dtype=np.float64),
+        np.array(highs, dtype=np.float64),
+        np.array(lows, dtype=np.float64),
+        np.array(closes, dtype=np.float64),
+        np.array(volumes, dtype=np.int64),
+    )
+
+
+bar_store = BarStore(settings.BAR_STORE_DIR, settings.BAR_STORE_ROLLUPS)
@@ -0,0 +1,195 @@
+
+"""
+Read-through cache for hot market data endpoints.
+
+Rendered bodies (JSON, or the negotiated columnar format) are kept in two tiers: a small in-process LRU in front
+of the shared Redis cache. Every entry is keyed by the current version of
+the namespaces it depends on (``stocks``, ``indices``, ``screener``); the
+writing path bumps a namespace when it writes to it, which orphans every
+entry built from the old data without scanning for keys. The timeout is
+only a backstop.
+
+A request costs one Redis read for the versions; a local hit then returns
+the stored bytes without touching the database or the serializers, and a
+matching ``If-None-Match`` gets an empty 304. Keys cover the path and
+format, not the user, so only views whose output is the same for every
+user are cached; authentication and permissions still run first on every
+request.
+
+A Redis outage degrades to uncached responses: lookups that fail are served
+straight from the view, and failed invalidations are logged (entries from
+before the outage can be served until the next successful bump).
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+
+from . import instrumentation
+from .renderers import is_columnar
+
+STOCKS = 'stocks'
+INDICES = 'indices'
+SCREENER = 'screener'
+
+# Errors of an unreachable or failing cache backend
+CACHE_ERRORS = (redis.RedisError, OSError)
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'local_size': 512,
+    'timeout': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+class LocalLRU:
+    """
+    Thread-safe bounded mapping that evicts the least recently used key
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def version_key(namespace):
+    return f'response-version:{namespace}'
+
+
+def bump(*namespaces):
+    """
+    Invalidate every cached response built from ``namespaces``
+    """
+    for namespace in namespaces:
+        key = version_key(namespace)
+        try:
+            cache.add(key, 0, timeout=None)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Evicted between add and incr; any new value orphans old entries
+                cache.set(key, 1, timeout=None)
+        except CACHE_ERRORS as error:
+            logger.warning(f"Could not invalidate {namespace} responses: {error}")
+
+
+def namespace_version(namespace):
+    """
+    Current version of ``namespace``, or None when the cache is unreachable
+    """
+    try:
+        return cache.get(version_key(namespace), 0)
+    except CACHE_ERRORS as error:
+        logger.warning(f"Could not read the {namespace} version: {error}")
+        return None
+
+
+class ResponseCache:
+    def __init__(self, local_size, timeout):
+        self.local = LocalLRU(local_size)
+        self.timeout = timeout
+        self.renderer = JSONRenderer()
+
+    def entry_key(self, request, namespaces, renderer):
+        versions = cache.get_many([version_key(namespace) for namespace in namespaces])
+        tags = '.'.join(f'{namespace}{versions.get(version_key(namespace), 0)}' for namespace in namespaces)
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        return f'response:{renderer.format}:{tags}:{path}'
+
+    def respond(self, request, namespaces, build):
+        """
+        Serve the cached body for this request, calling ``build`` for a DRF
+        Response on a miss. Only 200 responses are stored; with the cache
+        unreachable every request is served by ``build``.
+        """
+        renderer = request.accepted_renderer if is_columnar(request) else self.renderer
+        try:
+            key = self.entry_key(request, namespaces, renderer)
+        except CACHE_ERRORS as error:
+            logger.warning(f"Response cache unavailable: {error}")
+            instrumentation.increment('response_cache_requests_total', namespace='.'.join(namespaces),
+                                      tier='error')
+            return build()
+        tier = 'local'
+        entry = self.local.get(key)
+        if entry is None:
+            tier = 'shared'
+            try:
+                entry = cache.get(key)
+            except CACHE_ERRORS as error:
+                logger.warning(f"Response cache unavailable: {error}")
+                entry = None
+            if entry is None:
+                tier = 'miss'
+                response = build()
+                if response.status_code != 200:
+                    return response
+                body = renderer.render(response.data)
+                entry = ('"%s"' % hashlib.md5(body).hexdigest(), body, renderer.media_type)
+                try:
+                    cache.set(key, entry, self.timeout)
+                except CACHE_ERRORS as error:
+                    logger.warning(f"Response cache unavailable: {error}")
+            self.local.set(key, entry)
+        instrumentation.increment('response_cache_requests_total', namespace='.'.join(namespaces), tier=tier)
+
+        etag, body, content_type = entry
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type=content_type)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+def parse_etags(header):
+    return {tag.strip().removeprefix('W/') for tag in header.split(',') if tag.strip()}
+
+
+config = get_config()
+response_cache = ResponseCache(config['local_size'], config['timeout'])
+
+
+def cached_response(*namespaces):
+    """
+    Cache a viewset method's rendered output under ``namespaces``
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            return response_cache.respond(request, namespaces, lambda: method(self, request, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,422 @@
+
+"""
+Technical indicators with a streaming and a vectorized implementation.
+
+The streaming classes keep just enough rolling state (window sums, Wilder
+averages, EMA values) to fold in one new bar in O(1). The vectorized functions
+compute whole series for backfills and backtests and are seeded the same way,
+so a state built by ``IndicatorSet.backfill`` continues exactly where the
+batch series left off.
+"""
+
+import copy
+import math
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+
+from .barstore import bar_store, to_datetime
+
+# Bars used to warm up indicator state when nothing is cached yet
+BACKFILL_BARS = 5000
+
+STATE_TIMEOUT = 7 * 24 * 60 * 60
+
+
+# Vectorized series
+
+def sma(values, period):
+    return pd.Series(values, dtype=np.float64).rolling(period, min_periods=period).mean().to_numpy()
+
+
+def _smoothed(values, period, alpha):
+    """
+    Recursive average seeded with the simple mean of the first ``period`` values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) < period:
+        return out
+    seeded = np.concatenate(([values[:period].mean()], values[period:]))
+    out[period - 1:] = pd.Series(seeded).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    return out
+
+
+def ema(values, period):
+    return _smoothed(values, period, 2.0 / (period + 1))
+
+
+def wilder(values, period):
+    return _smoothed(values, period, 1.0 / period)
+
+
+def rsi(close, period=14):
+    """
+    Relative strength index using Wilder's smoothing
+    """
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full(len(close), np.nan)
+    if len(close) <= period:
+        return out
+    delta = np.diff(close)
+    gains = wilder(np.clip(delta, 0, None), period)
+    losses = wilder(np.clip(-delta, 0, None), period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = 100.0 - 100.0 / (1.0 + gains / losses)
+    values[losses == 0] = 100.0
+    out[1:] = values
+    out[:period] = np.nan
+    return out
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    """
+    MACD line, signal line and histogram
+    """
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = np.full(len(line), np.nan)
+    if len(line) >= slow:
+        signal_line[slow - 1:] = ema(line[slow - 1:], signal)
+    return line, signal_line, line - signal_line
+
+
+def bollinger(close, period=20, width=2.0):
+    """
+    Upper, middle and lower bands using the population standard deviation
+    """
+    rolling = pd.Series(close, dtype=np.float64).rolling(period, min_periods=period)
+    middle = rolling.mean().to_numpy()
+    deviation = rolling.std(ddof=0).to_numpy()
+    return middle + width * deviation, middle, middle - width * deviation
+
+
+def true_range(high, low, close):
+    high, low, close = (np.asarray(a, dtype=np.float64) for a in (high, low, close))
+    previous = np.concatenate(([np.nan], close[:-1]))
+    ranges = np.vstack((high - low, np.abs(high - previous), np.abs(low - previous)))
+    return np.nanmax(ranges, axis=0)
+
+
+def atr(high, low, close, period=14):
+    return wilder(true_range(high, low, close), period)
+
+
+def vwap(high, low, close, volume, dates):
+    """
+    Volume-weighted average price that resets at each UTC day
+    """
+    typical = (np.asarray(high) + np.asarray(low) + np.asarray(close)) / 3.0
+    volume = np.asarray(volume, dtype=np.float64)
+    days = np.asarray(dates).astype('datetime64[D]')
+    session_start = np.flatnonzero(np.diff(days.astype(np.int64), prepend=np.int64(-1)))
+    starts = np.zeros(len(days), dtype=np.int64)
+    starts[session_start] = session_start
+    np.maximum.accumulate(starts, out=starts)
+    pv = np.concatenate(([0.0], np.cumsum(typical * volume)))
+    v = np.concatenate(([0.0], np.cumsum(volume)))
+    index = np.arange(1, len(days) + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (pv[index] - pv[starts]) / (v[index] - v[starts])
+
+
+# Streaming indicators
+
+class SMA:
+    def __init__(self, period):
+        self.period = period
+        self.window = deque(maxlen=period)
+        self.total = 0.0
+
+    def update(self, value):
+        if len(self.window) == self.period:
+            self.total -= self.window[0]
+        self.window.append(value)
+        self.total += value
+        return self.value
+
+    @property
+    def value(self):
+        return self.total / self.period if len(self.window) == self.period else None
+
+    def seed(self, values):
+        self.window.clear()
+        self.total = 0.0
+        for value in values[-self.period:]:
+            self.update(float(value))
+
+
+class EMA:
+    def __init__(self, period, alpha=None):
+        self.period = period
+        self.alpha = alpha if alpha is not None else 2.0 / (period + 1)
+        self.value = None
+        self._warmup = []
+
+    def update(self, value):
+        if self.value is None:
+            self._warmup.append(value)
+            if len(self._warmup) == self.period:
+                self.value = sum(self._warmup) / self.period
+                self._warmup = []
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+    def seed(self, value, history=()):
+        """
+        Continue from the last batch value (or replay a short history when
+        the batch never finished warming up)
+        """
+        self.value = None
+        self._warmup = []
+        if value is not None and not math.isnan(value):
+            self.value = float(value)
+        else:
+            for item in history:
+                self.update(float(item))
+
+
+class Wilder(EMA):
+    def __init__(self, period):
+        super().__init__(period, alpha=1.0 / period)
+
+
+class RSI:
+    def __init__(self, period=14):
+        self.period = period
+        self.gains = Wilder(period)
+        self.losses = Wilder(period)
+        self.previous = None
+
+    def update(self, close):
+        if self.previous is not None:
+            delta = close - self.previous
+            self.gains.update(max(delta, 0.0))
+            self.losses.update(max(-delta, 0.0))
+        self.previous = close
+        return self.value
+
+    @property
+    def value(self):
+        if self.gains.value is None:
+            return None
+        if self.losses.value == 0:
+            return 100.0
+        return 100.0 - 100.0 / (1.0 + self.gains.value / self.losses.value)
+
+
+class MACD:
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+        self.line = None
+
+    def update(self, close):
+        fast = self.fast.update(close)
+        slow = self.slow.update(close)
+        if fast is not None and slow is not None:
+            self.line = fast - slow
+            self.signal.update(self.line)
+        return self.value
+
+    @property
+    def value(self):
+        if self.line is None:
+            return None
+        signal = self.signal.value
+        return {
+            'macd': self.line,
+            'signal': signal,
+            'histogram': self.line - signal if signal is not None else None,
+        }
+
+
+class BollingerBands:
+    def __init__(self, period=20, width=2.0):
+        self.width = width
+        self.mean = SMA(period)
+        self.squares = SMA(period)
+
+    def update(self, close):
+        self.mean.update(close)
+        self.squares.update(close * close)
+        return self.value
+
+    @property
+    def value(self):
+        middle = self.mean.value
+        if middle is None:
+            return None
+        deviation = math.sqrt(max(self.squares.value - middle * middle, 0.0))
+        return {
+            'upper': middle + self.width * deviation,
+            'middle': middle,
+            'lower': middle - self.width * deviation,
+        }
+
+
+class ATR:
+    def __init__(self, period=14):
+        self.average = Wilder(period)
+        self.previous_close = None
+
+    def update(self, high, low, close):
+        if self.previous_close is None:
+            tr = high - low
+        else:
+            tr = max(high - low, abs(high - self.previous_close), abs(low - self.previous_close))
+        self.previous_close = close
+        return self.average.update(tr)
+
+    @property
+    def value(self):
+        return self.average.value
+
+
+class VWAP:
+    def __init__(self):
+        self.session = None
+        self.pv = 0.0
+        self.volume = 0.0
+
+    def update(self, high, low, close, volume, date):
+        session = np.datetime64(date, 'D')
+        if session != self.session:
+            self.session, self.pv, self.volume = session, 0.0, 0.0
+        self.pv += (high + low + close) / 3.0 * volume
+        self.volume += volume
+        return self.value
+
+    @property
+    def value(self):
+        return self.pv / self.volume if self.volume else None
+
+
+class IndicatorSet:
+    """
+    The indicators shown on the dashboard for one symbol and interval
+    """
+    SMA_PERIODS = (20, 50, 100, 200)
+
+    def __init__(self):
+        self.last_timestamp = None
+        self.close = None
+        self.sma = {period: SMA(period) for period in self.SMA_PERIODS}
+        self.ema = EMA(20)
+        self.rsi = RSI(14)
+        self.macd = MACD(12, 26, 9)
+        self.bollinger = BollingerBands(20, 2.0)
+        self.atr = ATR(14)
+        self.vwap = VWAP()
+
+    def update(self, date, open, high, low, close, volume):
+        """
+        Fold one closed bar into every indicator
+        """
+        for indicator in self.sma.values():
+            indicator.update(close)
+        self.ema.update(close)
+        self.rsi.update(close)
+        self.macd.update(close)
+        self.bollinger.update(close)
+        self.atr.update(high, low, close)
+        self.vwap.update(high, low, close, volume, date)
+        self.close = close
+        self.last_timestamp = date
+
+    def advance(self, bars):
+        """
+        Apply the bars newer than the last one already folded in
+        """
+        if self.last_timestamp is not None:
+            bars = bars.slice(start=self.last_timestamp + np.timedelta64(1, 'ns'))
+        for row in zip(bars.dates, bars.open.tolist(), bars.high.tolist(), bars.low.tolist(),
+                       bars.close.tolist(), bars.volume.tolist()):
+            self.update(*row)
+        return self
+
+    def backfill(self, bars):
+        """
+        Build the rolling state for ``bars`` with the vectorized functions
+        """
+        if len(bars) == 0:
+            return self
+        close = np.asarray(bars.close, dtype=np.float64)
+        for period, indicator in self.sma.items():
+            indicator.seed(close)
+        self.ema.seed(ema(close, self.ema.period)[-1], close)
+
+        delta = np.diff(close)
+        self.rsi.gains.seed(wilder(np.clip(delta, 0, None), self.rsi.period)[-1] if len(delta) else None,
+                            np.clip(delta, 0, None))
+        self.rsi.losses.seed(wilder(np.clip(-delta, 0, None), self.rsi.period)[-1] if len(delta) else None,
+                             np.clip(-delta, 0, None))
+        self.rsi.previous = float(close[-1])
+
+        fast, slow = self.macd.fast.period, self.macd.slow.period
+        self.macd.fast.seed(ema(close, fast)[-1], close)
+        self.macd.slow.seed(ema(close, slow)[-1], close)
+        line, signal_line, _ = macd(close, fast, slow, self.macd.signal.period)
+        self.macd.line = None if math.isnan(line[-1]) else float(line[-1])
+        self.macd.signal.seed(signal_line[-1], line[slow - 1:] if len(line) >= slow else ())
+
+        self.bollinger.mean.seed(close)
+        self.bollinger.squares.seed(close * close)
+
+        tr = true_range(bars.high, bars.low, bars.close)
+        self.atr.average.seed(wilder(tr, self.atr.average.period)[-1], tr)
+        self.atr.previous_close = float(close[-1])
+
+        days = np.asarray(bars.dates).astype('datetime64[D]')
+        session = days == days[-1]
+        high, low, volume = (np.asarray(a, dtype=np.float64)[session] for a in (bars.high, bars.low, bars.volume))
+        self.vwap.session = days[-1]
+        self.vwap.pv = float(((high + low + close[session]) / 3.0 * volume).sum())
+        self.vwap.volume = float(volume.sum())
+
+        self.close = float(close[-1])
+        self.last_timestamp = bars.dates[-1]
+        return self
+
+    def values(self):
+        return {
+            'close': self.close,
+            'sma': {str(period): indicator.value for period, indicator in self.sma.items()},
+            'ema_20': self.ema.value,
+            'rsi_14': self.rsi.value,
+            'macd': self.macd.value,
+            'bollinger': self.bollinger.value,
+            'atr_14': self.atr.value,
+            'vwap': self.vwap.value,
+        }
+
+
+def state_key(symbol, interval):
+    return f"indicators:{symbol}:{interval}"
+
+
+def current_indicators(stock, interval='1d'):
+    """
+    Indicator values for a symbol including its latest (possibly still
+    forming) bar.
+
+    Closed bars are folded into the cached state, which is backfilled with the
+    vectorized path on a cache miss; the last bar is applied to a copy so a
+    candle that is still forming is never counted twice.
+    """
+    bar_store.sync(stock)
+    key = state_key(stock.symbol, interval)
+    state = cache.get(key)
+    if state is None or state.last_timestamp is None:
+        bars = bar_store.query(stock.symbol, interval=interval).tail(BACKFILL_BARS + 1)
+        state = IndicatorSet().backfill(bars[:-1])
+    else:
+        bars = bar_store.query(stock.symbol, start=to_datetime(state.last_timestamp), interval=interval)
+        state.advance(bars[:-1])
+    cache.set(key, state, STATE_TIMEOUT)
+
+    latest = copy.deepcopy(state).advance(bars[-1:])
+    return latest.values(), latest.last_timestamp
@@ -0,0 +1,345 @@
+
+"""
+Bulk market data ingestion.
+
+A source yields batches of quotes, bars and index values. Each batch is
+deduplicated in memory and written with a handful of set-based statements:
+one upsert for quotes (after one lookup of the stored day values when
+quotes leave some out), one symbol lookup, one upsert per 5k bars and one
+upsert for indices. Corrections to stored bars are carried into the bar
+store and committed batches are announced through ``signals`` for
+downstream consumers.
+"""
+
+import bisect
+import csv
+import glob
+import json
+import os
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from .barstore import Bars, bar_store, index_symbol, to_datetime64
+from .models import HistoricalData, MarketIndex, Stock, percent_change
+from .signals import bars_updated, indices_updated, quotes_updated
+
+CENT = Decimal('0.01')
+
+BATCH_SIZE = 5000
+
+QUOTE_FIELDS = ['current_price', 'previous_close', 'percent_change', 'open_price', 'high_price',
+                'low_price', 'volume', 'last_updated']
+BAR_FIELDS = ['open_price', 'high_price', 'low_price', 'close_price', 'volume']
+INDEX_FIELDS = ['value', 'change', 'percent_change', 'last_updated']
+# Optional quote keys and the Stock columns they set; a quote without one
+# keeps the stored value (new stocks fall back to the price, or 0 volume)
+QUOTE_KEYS = {'previous_close': 'previous_close', 'open': 'open_price', 'high': 'high_price',
+              'low': 'low_price', 'volume': 'volume'}
+
+
+def to_price(value):
+    return Decimal(str(value)).quantize(CENT, ROUND_HALF_UP)
+
+
+def to_timestamp(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+    else:
+        parsed = parse_datetime(value) or datetime.fromisoformat(value)
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+
+
+class MarketBatch:
+    """
+    Raw records from a source. Quotes and bars are dicts keyed by the field
+    names used in replay files (symbol, price/open/high/low/close, volume...)
+    """
+
+    def __init__(self, quotes=(), bars=(), indices=()):
+        self.quotes = list(quotes)
+        self.bars = list(bars)
+        self.indices = list(indices)
+
+    def __len__(self):
+        return len(self.quotes) + len(self.bars) + len(self.indices)
+
+
+class MarketDataSource:
+    def fetch(self):
+        """
+        Return the next MarketBatch, or None when the source is exhausted
+        """
+        raise NotImplementedError
+
+
+class FileReplaySource(MarketDataSource):
+    """
+    Replays recorded snapshots from JSON or CSV files, one file per fetch.
+
+    JSON files hold ``{"quotes": [...], "bars": [...], "indices": [...]}``.
+    CSV files hold one record type, told apart by their header: a ``date``
+    column means bars, ``name``/``value`` means indices, anything else quotes.
+
+    A missing path replays nothing. The last file replayed is kept in the
+    cache, so a new source for the same path (every task run builds one)
+    resumes after it instead of starting over.
+    """
+
+    def __init__(self, path, loop=False):
+        if os.path.isdir(path):
+            self.paths = sorted(glob.glob(os.path.join(path, '*.json')) + glob.glob(os.path.join(path, '*.csv')))
+        elif os.path.isfile(path):
+            self.paths = [path]
+        else:
+            self.paths = []
+        self.loop = loop
+        self.position_key = f'market-replay:{os.path.abspath(path)}'
+        last = cache.get(self.position_key)
+        self.position = bisect.bisect_right(self.paths, last) if last else 0
+
+    def fetch(self):
+        if self.position >= len(self.paths):
+            if not self.loop or not self.paths:
+                return None
+            self.position = 0
+        path = self.paths[self.position]
+        self.position += 1
+        cache.set(self.position_key, path, timeout=None)
+        if path.endswith('.json'):
+            with open(path) as handle:
+                data = json.load(handle)
+            return MarketBatch(data.get('quotes', ()), data.get('bars', ()), data.get('indices', ()))
+
+        with open(path, newline='') as handle:
+            reader = csv.DictReader(handle)
+            rows = list(reader)
+            columns = set(reader.fieldnames or ())
+        if 'date' in columns:
+            return MarketBatch(bars=rows)
+        if {'name', 'value'} <= columns:
+            return MarketBatch(indices=rows)
+        return MarketBatch(quotes=rows)
+
+
+def get_source():
+    config = settings.MARKET_DATA_SOURCE
+    return import_string(config['class'])(**config.get('options', {}))
+
+
+def last_by(records, key):
+    """
+    Keep only the last record for each key, preserving arrival order
+    """
+    return list({key(record): record for record in records}.values())
+
+
+def has(record, key):
+    return record.get(key) not in (None, '')
+
+
+def quote_to_stock(quote, now, stored=None):
+    """
+    Stock row for a quote; fields the quote does not carry come from
+    ``stored`` (the current row's values by column), so the upsert writes
+    them back unchanged
+    """
+    price = to_price(quote['price'])
+    stored = stored or {}
+
+    def value(key, convert, default):
+        if has(quote, key):
+            return convert(quote[key])
+        return stored.get(QUOTE_KEYS[key], default)
+
+    previous_close = value('previous_close', to_price, price)
+    return Stock(
+        symbol=quote['symbol'],
+        name=quote.get('name') or quote['symbol'],
+        current_price=price,
+        previous_close=previous_close,
+        percent_change=percent_change(price, previous_close),
+        open_price=value('open', to_price, price),
+        high_price=value('high', to_price, price),
+        low_price=value('low', to_price, price),
+        volume=value('volume', lambda volume: int(float(volume)), 0),
+        sector=quote.get('sector') or None,
+        last_updated=now,
+    )
+
+
+def stored_quote_fields(quotes):
+    """
+    Current column values of stocks whose quotes leave out optional fields,
+    with one query (none when every quote is complete)
+    """
+    partial = {quote['symbol'] for quote in quotes if not all(has(quote, key) for key in QUOTE_KEYS)}
+    if not partial:
+        return {}
+    columns = list(QUOTE_KEYS.values())
+    return {
+        row[0]: dict(zip(columns, row[1:]))
+        for row in Stock.objects.filter(symbol__in=partial).values_list('symbol', *columns)
+    }
+
+
+def ingest(batch, batch_size=BATCH_SIZE, replay=False):
+    """
+    Write a MarketBatch and return per-batch throughput and lag metrics;
+    ``replay`` marks the quotes as replayed history for the receivers
+    """
+    started = time.perf_counter()
+    now = timezone.now()
+    quotes = last_by(batch.quotes, lambda quote: quote['symbol'])
+    bars = last_by(batch.bars, lambda bar: (bar['symbol'], to_timestamp(bar['date'])))
+    indices = last_by(batch.indices, lambda index: index['name'])
+    duplicates = len(batch) - len(quotes) - len(bars) - len(indices)
+    unknown = set()
+    queries = []
+
+    def count(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count), transaction.atomic():
+        if quotes:
+            stored = stored_quote_fields(quotes)
+            Stock.objects.bulk_create(
+                [quote_to_stock(quote, now, stored.get(quote['symbol'])) for quote in quotes],
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['symbol'],
+                update_fields=QUOTE_FIELDS,
+            )
+
+        stock_ids = {}
+        if bars:
+            stock_ids = dict(Stock.objects.filter(symbol__in={bar['symbol'] for bar in bars})
+                             .values_list('symbol', 'id'))
+            # Bars of symbols without a Stock row are dropped, not counted
+            unknown = {bar['symbol'] for bar in bars} - stock_ids.keys()
+            bars = [bar for bar in bars if bar['symbol'] in stock_ids]
+            rows = [
+                HistoricalData(
+                    stock_id=stock_ids[bar['symbol']],
+                    date=to_timestamp(bar['date']),
+                    open_price=to_price(bar['open']),
+                    high_price=to_price(bar['high']),
+                    low_price=to_price(bar['low']),
+                    close_price=to_price(bar['close']),
+                    volume=int(float(bar.get('volume') or 0)),
+                )
+                for bar in bars
+            ]
+            HistoricalData.objects.bulk_create(
+                rows,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['stock', 'date'],
+                update_fields=BAR_FIELDS,
+            )
+
+        if indices:
+            MarketIndex.objects.bulk_create(
+                [
+                    MarketIndex(
+                        name=index['name'],
+                        value=to_price(index['value']),
+                        change=to_price(index.get('change') or 0),
+                        percent_change=to_price(index.get('percent_change') or 0),
+                        last_updated=now,
+                    )
+                    for index in indices
+                ],
+                update_conflicts=True,
+                unique_fields=['name'],
+                update_fields=INDEX_FIELDS,
+            )
+    write_seconds = time.perf_counter() - started
+
+    bar_symbols = store_bars(bars)
+    store_index_values(indices, now)
+    prices = {quote['symbol']: to_price(quote['price']) for quote in quotes}
+    # Event time and lag come from the quotes; bar dates may be history
+    source_times = [to_timestamp(quote.get('timestamp')) for quote in quotes]
+    source_times = [value for value in source_times if value is not None]
+    if prices:
+        quotes_updated.send(sender=ingest, prices=prices, timestamp=max(source_times) if source_times else now,
+                            replay=replay)
+    if bar_symbols:
+        bars_updated.send(sender=ingest, symbols=bar_symbols)
+    if indices:
+        indices_updated.send(sender=ingest, names={index['name'] for index in indices})
+
+    elapsed = time.perf_counter() - started
+    records = len(quotes) + len(bars) + len(indices)
+    return {
+        'quotes': len(quotes),
+        'bars': len(bars),
+        'indices': len(indices),
+        'unknown_symbols': len(unknown),
+        'duplicates': duplicates,
+        'write_queries': len(queries),
+        'write_seconds': round(write_seconds, 4),
+        'elapsed_seconds': round(elapsed, 4),
+        'records_per_second': round(records / elapsed, 1) if elapsed > 0 else None,
+        'lag_seconds': round((timezone.now() - max(source_times)).total_seconds(), 3) if source_times else None,
+    }
+
+
+def store_bars(bars):
+    """
+    Carry corrections into the columnar store and return the touched symbols.
+
+    Bars newer than a symbol's last stored bar need no work here: every
+    reader calls ``bar_store.sync`` first and picks them up with one query.
+    Rows at or before that bar rewrite history the store already has, so
+    only those are appended (the store merges them in place).
+    """
+    by_symbol = {}
+    for bar in bars:
+        by_symbol.setdefault(bar['symbol'], []).append(bar)
+    for symbol, rows in by_symbol.items():
+        last = bar_store.last_timestamp(symbol)
+        if last is None:
+            continue
+        dates = np.array([to_datetime64(to_timestamp(row['date'])) for row in rows], dtype='datetime64[ns]')
+        stale = dates <= last
+        if not stale.any():
+            continue
+        rows = [row for row, keep in zip(rows, stale) if keep]
+        bar_store.append(symbol, Bars(
+            dates[stale],
+            np.array([float(to_price(row['open'])) for row in rows]),
+            np.array([float(to_price(row['high'])) for row in rows]),
+            np.array([float(to_price(row['low'])) for row in rows]),
+            np.array([float(to_price(row['close'])) for row in rows]),
+            np.array([int(float(row.get('volume') or 0)) for row in rows], dtype=np.int64),
+        ))
+    return set(by_symbol)
+
+
+def store_index_values(indices, now):
+    """
+    Keep a value history per index in the bar store (beta benchmarks)
+    """
+    for index in indices:
+        value = float(to_price(index['value']))
+        timestamp = to_timestamp(index.get('timestamp')) or now
+        bar_store.append(index_symbol(index['name']), Bars(
+            np.array([to_datetime64(timestamp)], dtype='datetime64[ns]'),
+            np.array([value]), np.array([value]), np.array([value]), np.array([value]),
+            np.zeros(1, dtype=np.int64),
+        ))
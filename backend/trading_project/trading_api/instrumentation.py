@@ -0,0 +1,369 @@
+
+"""
+Opt-in request and task instrumentation.
+
+With INSTRUMENTATION['enabled'], ``InstrumentationMiddleware`` records per
+view: a latency histogram, the number and total time of DB queries, and
+the time spent rendering serializer ``.data``. The response cache counts
+its hits per tier, and Celery tasks report their durations. ``metrics``
+serves everything in the Prometheus text format to local addresses.
+
+Request metrics live in the process that served the request; Celery
+workers are separate processes, so task metrics are kept in the shared
+cache instead.
+
+Slow requests (over ``slow_request_ms``) are captured two ways:
+
+* a sampler thread records the stack of every request that is still
+  running past the threshold, every ``sample_interval_ms``, and writes the
+  samples as folded stacks (flamegraph.pl / speedscope input);
+* ``profile_rate`` of all requests run under cProfile, and the profile is
+  kept when the request turns out to be slow.
+
+Both land in ``profile_dir``, which keeps the newest ``keep_profiles``
+files. The always-on part is a few counter updates per request plus one
+wrapper call per query; the sampler only walks stacks of requests that
+are already slow.
+"""
+
+import cProfile
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse
+from rest_framework import serializers
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+TASK_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0)
+
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by view'),
+    'http_request_db_queries': ('histogram', 'DB queries per request by view'),
+    'db_query_seconds_total': ('counter', 'Time spent in DB queries by view'),
+    'serializer_seconds_total': ('counter', 'Time spent rendering serializer data by view'),
+    'slow_requests_total': ('counter', 'Requests over the slow threshold by view'),
+    'response_cache_requests_total': ('counter', 'Response cache lookups by namespace and tier'),
+    'celery_task_duration_seconds': ('histogram', 'Celery task run time by task and state'),
+}
+
+DEFAULTS = {
+    'enabled': False,
+    'slow_request_ms': 500,
+    'sample_interval_ms': 5,
+    'profile_rate': 0.0,
+    'profile_dir': 'profiles',
+    'keep_profiles': 50,
+    'metrics_ips': ['127.0.0.1', '::1'],
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'INSTRUMENTATION', {})}
+
+
+config = get_config()
+current_request = ContextVar('instrumented_request', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """
+    In-process counters and histograms keyed by metric name and labels
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def samples(self):
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = [(key, histogram.buckets, list(histogram.counts), histogram.sum)
+                          for key, histogram in self.histograms.items()]
+        return counters, histograms
+
+
+registry = Registry()
+
+
+def increment(name, amount=1, **labels):
+    if config['enabled']:
+        registry.increment(name, amount, **labels)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.samples = Counter()
+
+    def count_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += time.perf_counter() - started
+            self.queries += 1
+
+
+def timed_data(fget):
+    def data(serializer):
+        stats = current_request.get()
+        if stats is None:
+            return fget(serializer)
+        # Only the outermost .data counts; nested ones are inside its time
+        stats.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return fget(serializer)
+        finally:
+            stats.serializer_depth -= 1
+            if not stats.serializer_depth:
+                stats.serializer_time += time.perf_counter() - started
+    data.instrumented = True
+    return data
+
+
+def install_serializer_timing():
+    fget = serializers.BaseSerializer.data.fget
+    if not getattr(fget, 'instrumented', False):
+        serializers.BaseSerializer.data = property(timed_data(fget))
+
+
+def collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{Path(code.co_filename).name}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class StackSampler:
+    """
+    Background thread recording the stacks of requests that have been
+    running longer than ``threshold`` seconds
+    """
+
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='request-sampler', daemon=True)
+                self.thread.start()
+
+    def track(self, stats):
+        with self.lock:
+            self.inflight[threading.get_ident()] = stats
+
+    def untrack(self):
+        with self.lock:
+            self.inflight.pop(threading.get_ident(), None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self.lock:
+                slow = [(ident, stats) for ident, stats in self.inflight.items()
+                        if now - stats.started >= self.threshold]
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for ident, stats in slow:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stats.samples[collapse(frame)] += 1
+
+
+sampler = StackSampler(config['sample_interval_ms'] / 1000, config['slow_request_ms'] / 1000)
+
+
+def save_profile(view, elapsed, profiler, samples):
+    directory = Path(config['profile_dir'])
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = f"{datetime.now():%Y%m%dT%H%M%S%f}-{view.replace(':', '.')}-{int(elapsed * 1000)}ms"
+    if profiler is not None:
+        profiler.dump_stats(directory / f'{stem}.prof')
+    if samples:
+        (directory / f'{stem}.folded').write_text(
+            ''.join(f'{stack} {count}\n' for stack, count in samples.most_common()))
+    files = sorted(directory.glob('*.*'), key=lambda path: path.stat().st_mtime)
+    for path in files[:-config['keep_profiles']]:
+        path.unlink(missing_ok=True)
+
+
+class InstrumentationMiddleware:
+    """
+    Per-view latency, DB and serializer metrics plus slow-request capture;
+    removed from the stack unless INSTRUMENTATION['enabled']
+    """
+
+    def __init__(self, get_response):
+        if not config['enabled']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow = config['slow_request_ms'] / 1000
+        install_serializer_timing()
+        sampler.start()
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        profiler = cProfile.Profile() if random.random() < config['profile_rate'] else None
+        sampler.track(stats)
+        try:
+            with connection.execute_wrapper(stats.count_query):
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            sampler.untrack()
+            current_request.reset(token)
+        elapsed = time.perf_counter() - stats.started
+
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+        labels = {'view': view, 'method': request.method, 'status': str(response.status_code)}
+        registry.observe('http_request_duration_seconds', elapsed, LATENCY_BUCKETS, **labels)
+        registry.observe('http_request_db_queries', stats.queries, QUERY_BUCKETS, view=view)
+        registry.increment('db_query_seconds_total', stats.query_time, view=view)
+        registry.increment('serializer_seconds_total', stats.serializer_time, view=view)
+        if elapsed >= self.slow:
+            registry.increment('slow_requests_total', view=view)
+            if profiler is not None or stats.samples:
+                save_profile(view, elapsed, profiler, stats.samples)
+        return response
+
+
+def task_key(name, state, field):
+    return f'metrics:task:{name}:{state}:{field}'
+
+
+def add_shared(key, amount):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        cache.set(key, amount, timeout=None)
+
+
+TASK_STATES = ('SUCCESS', 'FAILURE')
+task_timers = {}
+
+
+def start_task(task_id):
+    if config['enabled']:
+        task_timers[task_id] = time.perf_counter()
+
+
+def finish_task(task_id, name, state):
+    """
+    Add a finished run to the shared-cache histogram (sum kept in microseconds)
+    """
+    started = task_timers.pop(task_id, None)
+    if started is None or state not in TASK_STATES:
+        return
+    seconds = time.perf_counter() - started
+    add_shared(task_key(name, state, bisect_left(TASK_BUCKETS, seconds)), 1)
+    add_shared(task_key(name, state, 'sum'), int(seconds * 1000000))
+
+
+def task_histograms():
+    from celery import current_app
+    names = [name for name in current_app.tasks if name.startswith('trading_api.')]
+    keys = [task_key(name, state, field) for name in names for state in TASK_STATES
+            for field in [*range(len(TASK_BUCKETS) + 1), 'sum']]
+    values = cache.get_many(keys)
+    for name in names:
+        for state in TASK_STATES:
+            counts = [values.get(task_key(name, state, index), 0) for index in range(len(TASK_BUCKETS) + 1)]
+            if any(counts):
+                key = ('celery_task_duration_seconds', (('state', state), ('task', name)))
+                yield key, TASK_BUCKETS, counts, values.get(task_key(name, state, 'sum'), 0) / 1000000
+
+
+def format_labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render():
+    counters, histograms = registry.samples()
+    histograms += list(task_histograms())
+    lines = {}
+    for (name, labels), value in counters:
+        lines.setdefault(name, []).append(f'{name}{format_labels(labels)} {value}')
+    for (name, labels), buckets, counts, total in histograms:
+        cumulative = 0
+        for bound, count in zip([*buckets, '+Inf'], counts):
+            cumulative += count
+            lines.setdefault(name, []).append(f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+        lines[name].append(f'{name}_sum{format_labels(labels)} {total}')
+        lines[name].append(f'{name}_count{format_labels(labels)} {cumulative}')
+    output = []
+    for name, samples in lines.items():
+        kind, description = METRICS[name]
+        output += [f'# HELP {name} {description}', f'# TYPE {name} {kind}', *samples]
+    return '\n'.join(output) + '\n'
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint; only answers local addresses
+    """
+    if not config['enabled'] or request.META.get('REMOTE_ADDR') not in config['metrics_ips']:
+        raise Http404
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,169 @@
+import json
+import platform
+import shutil
+import statistics
+import time
+from datetime import datetime
+
+import django
+import numpy as np
+from celery import current_app
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from trading_api import synthetic
+from trading_api.models import Holding, Order, ReportRun, Stock, Watchlist
+from trading_api.tasks import (
+    analyze_market_trends, generate_user_reports, process_trade_orders, snapshot_portfolios
+)
+
+
+class Command(BaseCommand):
+    help = ('Benchmark API endpoints and Celery tasks against the synthetic universe '
+            '(see generate_market_data); optionally fail on regressions against a baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30, help='Timed requests per endpoint scenario')
+        parser.add_argument('--task-repeat', type=int, default=3, help='Timed runs per task scenario')
+        parser.add_argument('--users', type=int, default=20, help='Synthetic users to rotate requests over')
+        parser.add_argument('--only', nargs='*', help='Run only these scenarios')
+        parser.add_argument('--output', help='Write the results as JSON to this path')
+        parser.add_argument('--baseline', help='Results JSON to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative p50 slowdown before it counts as a regression')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                            help='Ignore p50 slowdowns smaller than this')
+
+    def handle(self, *args, **options):
+        users = list(User.objects.filter(username__startswith=synthetic.USER_PREFIX)
+                     .order_by('id')[:options['users']])
+        stocks = list(Stock.objects.filter(symbol__startswith=synthetic.SYMBOL_PREFIX)
+                      .order_by('id').values_list('id', flat=True)[:options['users']])
+        if not users or not stocks:
+            raise CommandError('No synthetic data; run generate_market_data first')
+
+        # Sharded tasks fan out in-process instead of through the broker
+        current_app.conf.task_always_eager = True
+        clients = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            clients.append((client, user.portfolio.id))
+
+        endpoints = {
+            'historical_data_1y': lambda i: f'/api/stocks/{stocks[i % len(stocks)]}/historical_data/?timeframe=1Y',
+            'historical_data_5y': lambda i: f'/api/stocks/{stocks[i % len(stocks)]}/historical_data/?timeframe=5Y',
+            'portfolio_summary': lambda i: f'/api/portfolio/{clients[i % len(clients)][1]}/summary/',
+            'orders_list': lambda i: '/api/orders/',
+            'orders_pending': lambda i: '/api/orders/?status=PENDING',
+            'watchlists': lambda i: '/api/watchlists/',
+        }
+        tasks = {
+            'task_process_trade_orders': lambda: process_trade_orders.apply(throw=True),
+            'task_snapshot_portfolios': lambda: snapshot_portfolios.apply(throw=True),
+            'task_analyze_market_trends': lambda: analyze_market_trends.apply(throw=True),
+            'task_generate_user_reports': self.run_reports,
+        }
+        selected = set(options['only'] or [*endpoints, *tasks])
+
+        scenarios = {}
+        # The test client's host, which the deployment's ALLOWED_HOSTS need not list
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, url in endpoints.items():
+                if name in selected:
+                    def request(i, url=url):
+                        response = clients[i % len(clients)][0].get(url(i))
+                        assert response.status_code == 200, (url(i), response.status_code)
+                    scenarios[name] = self.measure(request, options['repeat'])
+        for name, run in tasks.items():
+            if name in selected:
+                scenarios[name] = self.measure(lambda i, run=run: self.rolled_back(run), options['task_repeat'])
+
+        results = {
+            'created': datetime.now().isoformat(),
+            'vendor': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'scale': self.scale(),
+            'scenarios': scenarios,
+        }
+        self.stdout.write(json.dumps(results, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            regressions = self.compare(results, baseline, options['tolerance'], options['min_delta_ms'])
+            if regressions:
+                raise CommandError('Regressions against %s:\n  %s' % (options['baseline'], '\n  '.join(regressions)))
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
+
+    def measure(self, run, repeat):
+        """
+        One warm-up call, then ``repeat`` timed calls with their query counts
+        """
+        run(0)
+        timings, queries = [], []
+        for i in range(1, repeat + 1):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                run(i)
+                timings.append(time.perf_counter() - started)
+            queries.append(len(captured.captured_queries))
+        timings = np.array(timings) * 1000
+        return {
+            'runs': repeat,
+            'p50_ms': round(float(np.percentile(timings, 50)), 3),
+            'p99_ms': round(float(np.percentile(timings, 99)), 3),
+            'mean_ms': round(float(timings.mean()), 3),
+            'queries': int(statistics.median(queries)),
+            'max_queries': max(queries),
+        }
+
+    def rolled_back(self, run):
+        """
+        Run a task and undo its writes, so every run and every benchmark
+        invocation starts from the same data
+        """
+        with transaction.atomic():
+            run()
+            transaction.set_rollback(True)
+
+    def run_reports(self):
+        result = generate_user_reports.apply(throw=True).result
+        shutil.rmtree(ReportRun.objects.get(id=result['run']).path, ignore_errors=True)
+
+    def scale(self):
+        return {
+            'symbols': Stock.objects.filter(symbol__startswith=synthetic.SYMBOL_PREFIX).count(),
+            'users': User.objects.filter(username__startswith=synthetic.USER_PREFIX).count(),
+            'holdings': Holding.objects.filter(stock__symbol__startswith=synthetic.SYMBOL_PREFIX).count(),
+            'orders': Order.objects.filter(stock__symbol__startswith=synthetic.SYMBOL_PREFIX).count(),
+            'watchlists': Watchlist.objects.filter(user__username__startswith=synthetic.USER_PREFIX).count(),
+        }
+
+    def compare(self, results, baseline, tolerance, min_delta_ms):
+        """
+        A scenario regresses when it issues more queries than the baseline,
+        or when its p50 is both ``tolerance`` and ``min_delta_ms`` slower
+        """
+        if results['vendor'] != baseline['vendor'] or results['scale'] != baseline['scale']:
+            raise CommandError('Baseline was recorded on a different database or data scale: '
+                               f"{baseline['vendor']} {baseline['scale']}")
+        regressions = []
+        for name, current in results['scenarios'].items():
+            previous = baseline['scenarios'].get(name)
+            if previous is None:
+                continue
+            if current['queries'] > previous['queries']:
+                regressions.append(f"{name}: {current['queries']} queries (was {previous['queries']})")
+            delta = current['p50_ms'] - previous['p50_ms']
+            if delta > min_delta_ms and current['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+                regressions.append(f"{name}: p50 {current['p50_ms']} ms (was {previous['p50_ms']} ms)")
+        return regressions
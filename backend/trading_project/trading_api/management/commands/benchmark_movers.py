@@ -0,0 +1,72 @@
+
+import json
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import DecimalField, ExpressionWrapper, F
+
+from trading_api.models import Stock, percent_change
+
+PREFIX = 'BM'
+SECTORS = ['Technology', 'Financials', 'Energy', 'Healthcare', 'Consumer', 'Industrials', 'Materials', None]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark movers and breadth queries against a synthetic stock universe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--symbols', type=int, default=10000, help='Universe size')
+        parser.add_argument('--repeat', type=int, default=50, help='Timed runs per query')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic stocks afterwards')
+
+    def handle(self, *args, **options):
+        self.populate(options['symbols'])
+        scan = ExpressionWrapper((F('current_price') - F('previous_close')) * 100 / F('previous_close'),
+                                 output_field=DecimalField(max_digits=10, decimal_places=2))
+        queries = {
+            'top_gainers': lambda: list(Stock.objects.order_by('-percent_change')[:10]),
+            'top_losers': lambda: list(Stock.objects.order_by('percent_change')[:10]),
+            'most_active': lambda: list(Stock.objects.order_by('-volume')[:10]),
+            'sector_gainers': lambda: list(Stock.objects.filter(sector='Energy').order_by('-percent_change')[:10]),
+            'sector_breadth': lambda: list(Stock.objects.breadth()),
+            'computed_gainers_scan': lambda: list(Stock.objects.filter(previous_close__gt=0)
+                                                  .annotate(change=scan).order_by('-change')[:10]),
+        }
+        results = {'symbols': Stock.objects.count(), 'vendor': connection.vendor}
+        for name, query in queries.items():
+            query()
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                query()
+                timings.append(time.perf_counter() - started)
+            results[name] = {
+                'median_ms': round(statistics.median(timings) * 1000, 3),
+                'max_ms': round(max(timings) * 1000, 3),
+            }
+        self.stdout.write(json.dumps(results, indent=2))
+
+        if not options['keep']:
+            Stock.objects.filter(symbol__startswith=PREFIX).delete()
+
+    def populate(self, count):
+        existing = Stock.objects.filter(symbol__startswith=PREFIX).count()
+        if existing >= count:
+            return
+        random.seed(0)
+        stocks = []
+        for i in range(existing, count):
+            previous_close = Decimal(random.randint(1000, 500000)) / 100
+            price = (previous_close * Decimal(1 + random.gauss(0, 0.02))).quantize(Decimal('0.01'))
+            stocks.append(Stock(
+                symbol=f'{PREFIX}{i}', name=f'Benchmark {i}', current_price=price,
+                previous_close=previous_close, percent_change=percent_change(price, previous_close),
+                open_price=previous_close, high_price=max(price, previous_close),
+                low_price=min(price, previous_close), volume=random.randint(0, 10 ** 7),
+                sector=random.choice(SECTORS),
+            ))
+        Stock.objects.bulk_create(stocks, batch_size=2000)
@@ -0,0 +1,76 @@
+import json
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from trading_api.models import Portfolio, Stock
+from trading_api.views import OrderViewSet
+
+USERNAME = 'benchmark-orders'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark batch order placement and cancel-all against single-order requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000, help='Orders per batch')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed batches')
+        parser.add_argument('--single', type=int, default=200, help='Orders placed one request at a time')
+
+    def handle(self, *args, **options):
+        symbols = list(Stock.objects.values_list('symbol', flat=True)[:500])
+        if not symbols:
+            self.stderr.write('No stocks to trade; run benchmark_movers --keep first')
+            return
+        user, _ = User.objects.get_or_create(username=USERNAME)
+        portfolio, _ = Portfolio.objects.get_or_create(user=user)
+        factory = APIRequestFactory()
+        random.seed(0)
+
+        def call(action, method, path, data=None):
+            request = getattr(factory, method)(path, data, format='json')
+            force_authenticate(request, user=user)
+            return OrderViewSet.as_view({method: action})(request)
+
+        def order():
+            return {'symbol': random.choice(symbols), 'order_type': random.choice(['BUY', 'SELL']),
+                    'quantity': random.randint(1, 100), 'price': f'{random.uniform(10, 500):.2f}'}
+
+        results = {'vendor': connection.vendor, 'orders_per_batch': options['orders']}
+        try:
+            placing, cancelling = [], []
+            for _ in range(options['repeat']):
+                payload = {'orders': [order() for _ in range(options['orders'])]}
+                started = time.perf_counter()
+                response = call('batch', 'post', '/api/orders/batch/', payload)
+                placing.append(time.perf_counter() - started)
+                assert response.data['created'] == options['orders'], response.data
+                started = time.perf_counter()
+                response = call('cancel_all', 'post', '/api/orders/cancel_all/', {})
+                cancelling.append(time.perf_counter() - started)
+                assert response.data['cancelled'] == options['orders'], response.data
+            results['batch'] = {
+                'median_ms': round(statistics.median(placing) * 1000, 1),
+                'orders_per_second': round(options['orders'] / statistics.median(placing)),
+            }
+            results['cancel_all'] = {
+                'median_ms': round(statistics.median(cancelling) * 1000, 1),
+                'orders_per_second': round(options['orders'] / statistics.median(cancelling)),
+            }
+
+            started = time.perf_counter()
+            for _ in range(options['single']):
+                call('create', 'post', '/api/orders/', order())
+            elapsed = time.perf_counter() - started
+            results['single'] = {
+                'median_ms': round(elapsed / options['single'] * 1000, 2),
+                'orders_per_second': round(options['single'] / elapsed),
+            }
+        finally:
+            user.delete()
+        self.stdout.write(json.dumps(results, indent=2))
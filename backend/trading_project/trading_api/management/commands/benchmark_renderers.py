@@ -0,0 +1,98 @@
+import gzip
+import json
+import statistics
+import time
+from datetime import timezone
+from decimal import Decimal
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from trading_api.barstore import Bars
+from trading_api.models import HistoricalData, Stock
+from trading_api.renderers import COLUMNAR_RENDERERS, msgpack, pyarrow
+from trading_api.serializers import HistoricalDataSerializer, bars_to_columns, bars_to_representation
+
+CENT = Decimal('0.01')
+
+
+class Command(BaseCommand):
+    help = ('Compare payload size and encode time of chart data: HistoricalDataSerializer and the row '
+            'representation against the columnar formats')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bars', type=int, nargs='*', default=[252, 1260, 10000],
+                            help='Chart lengths to encode (10000 is the historical_data limit)')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed encodes per format')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        formats = [renderer.format for renderer in COLUMNAR_RENDERERS]
+        missing = [name for name in ('msgpack', 'arrow') if name not in formats]
+        if missing:
+            raise CommandError(f'Formats unavailable: {", ".join(missing)} (pip install -r requirements.txt)')
+        stock = Stock(pk=1, symbol='BENCH', name='Benchmark')
+        results = {}
+        for count in options['bars']:
+            bars = self.bars(count, options['seed'])
+            instances = self.instances(stock, bars)
+            encoders = {
+                'serializer': lambda: JSONRenderer().render(HistoricalDataSerializer(instances, many=True).data),
+                'rows': lambda: JSONRenderer().render(bars_to_representation(stock, bars)),
+            }
+            for renderer in COLUMNAR_RENDERERS:
+                encoders[renderer.format] = lambda renderer=renderer: renderer().render(
+                    bars_to_columns(stock, bars, '1d'))
+
+            results[count] = {}
+            expected = bars_to_columns(stock, bars, '1d').document()['columns']
+            for name, encode in encoders.items():
+                body = encode()
+                if name in formats and self.decode(name, body) != expected:
+                    raise CommandError(f'{name} output for {count} bars does not decode to the chart columns')
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    encode()
+                    timings.append(time.perf_counter() - started)
+                results[count][name] = {
+                    'bytes': len(body),
+                    'gzip_bytes': len(gzip.compress(body)),
+                    'encode_ms': round(statistics.median(timings) * 1000, 3),
+                }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def decode(self, name, body):
+        """
+        The columns of a columnar body, as the document's plain lists
+        """
+        if name == 'arrow':
+            table = pyarrow.ipc.open_stream(body).read_all()
+            return {column: (values.cast(pyarrow.int64()) if pyarrow.types.is_timestamp(values.type) else values)
+                    .to_pylist() for column, values in zip(table.column_names, table.columns)}
+        return (msgpack.unpackb(body) if name == 'msgpack' else json.loads(body))['columns']
+
+    def bars(self, count, seed):
+        rng = np.random.default_rng(seed)
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.015, count)))
+        spread = close * rng.uniform(0, 0.01, count)
+        open_ = np.roll(close, 1)
+        open_[0] = close[0]
+        dates = np.datetime64('2000-01-03', 'ns') + np.arange(count) * np.timedelta64(1, 'D')
+        return Bars(dates, open_, np.maximum(open_, close) + spread, np.minimum(open_, close) - spread,
+                    close, rng.integers(10 ** 4, 10 ** 7, count))
+
+    def instances(self, stock, bars):
+        """
+        Unsaved model rows, as the serializer would get them from the table
+        """
+        return [
+            HistoricalData(id=i, stock=stock, date=date.replace(tzinfo=timezone.utc),
+                           open_price=Decimal(open_price).quantize(CENT), high_price=Decimal(high).quantize(CENT),
+                           low_price=Decimal(low).quantize(CENT), close_price=Decimal(close).quantize(CENT),
+                           volume=volume)
+            for i, (date, open_price, high, low, close, volume) in enumerate(zip(
+                bars.dates.astype('datetime64[us]').tolist(), bars.open.tolist(), bars.high.tolist(),
+                bars.low.tolist(), bars.close.tolist(), bars.volume.tolist()))
+        ]
@@ -0,0 +1,111 @@
+import json
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from trading_api.search import SymbolIndex
+
+SYLLABLES = ['ad', 'al', 'an', 'ar', 'ba', 'bi', 'ca', 'co', 'da', 'de', 'en', 'fi', 'ga', 'in', 'ka', 'ki', 'la',
+             'li', 'ma', 'mo', 'na', 'ni', 'or', 'pa', 'ra', 're', 'sa', 'si', 'ta', 'ti', 'tr', 'va', 'vi', 'ze']
+SUFFIXES = ['Industries', 'Bank', 'Energy', 'Pharma', 'Motors', 'Finance', 'Infra', 'Textiles', 'Chemicals',
+            'Power', 'Technologies', 'Holdings', 'Cement', 'Steel', 'Foods', 'Logistics']
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+SECTORS = ['Technology', 'Financials', 'Energy', 'Healthcare', 'Consumer', 'Industrials', 'Materials', None]
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the in-memory symbol search over a synthetic universe of equities, '
+            'futures and options (built in memory, nothing is written to the database)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--instruments', type=int, default=50000, help='Universe size')
+        parser.add_argument('--queries', type=int, default=2000, help='Timed queries per kind')
+        parser.add_argument('--changes', type=int, default=100,
+                            help='Instruments added, renamed and removed by the incremental update')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        rows = self.universe(options['instruments'], rng)
+        index = SymbolIndex()
+        started = time.perf_counter()
+        state = index.load(rows)
+        results = {
+            'instruments': len(rows),
+            'keys': len(state.keys),
+            'trigrams': len(state.grams),
+            'build_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+
+        equities = [row for row in rows if row[3] != 'Derivatives']
+        words = [word for row in equities for word in row[2].split()]
+        queries = {
+            'symbol_prefix': lambda: rng.choice(rows)[1][:rng.randint(1, 4)],
+            'exact_symbol': lambda: rng.choice(rows)[1],
+            'name_word': lambda: rng.choice(words)[:rng.randint(3, 8)],
+            'two_words': lambda: ' '.join(rng.choice(equities)[2].split()[:2]),
+            'typo': lambda: self.typo(rng.choice(equities)[2].split()[0], rng),
+        }
+        for name, query in queries.items():
+            texts = [query() for _ in range(options['queries'])]
+            index.search(texts[0], state=state)
+            timings = []
+            for text in texts:
+                started = time.perf_counter()
+                index.search(text, state=state)
+                timings.append(time.perf_counter() - started)
+            timings = np.array(timings) * 1000
+            results[name] = {
+                'p50_ms': round(float(np.percentile(timings, 50)), 3),
+                'p99_ms': round(float(np.percentile(timings, 99)), 3),
+                'max_ms': round(float(timings.max()), 3),
+            }
+
+        # A refresh where every quote moved and a few instruments were listed,
+        # renamed or delisted
+        changes = options['changes']
+        updated = [(stock_id, symbol, name, sector, volume * rng.uniform(0.5, 2), price, market_cap)
+                   for stock_id, symbol, name, sector, volume, price, market_cap in rows[changes:]]
+        for i in range(changes):
+            stock_id, symbol, name, sector, volume, price, market_cap = updated[i]
+            updated[i] = (stock_id, symbol, f'{name} Renamed', sector, volume, price, market_cap)
+        updated += self.universe(changes, rng, start=len(rows) + 1)
+        started = time.perf_counter()
+        index.load(updated)
+        results['incremental_refresh_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def universe(self, count, rng, start=1):
+        """
+        (id, symbol, name, sector, volume, price, market cap) rows: equities,
+        and for a fifth of them monthly futures and option strikes
+        """
+        rows = []
+        stock_id = start
+        while len(rows) < count:
+            stem = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            symbol = (stem + rng.choice(SUFFIXES)[:2]).upper()[:rng.randint(4, 10)]
+            name = f'{stem.title()} {rng.choice(SUFFIXES)}'
+            price = round(rng.uniform(10, 5000), 2)
+            cap = rng.choice([None, rng.uniform(1e8, 1e12)])
+            rows.append((stock_id, symbol, name, rng.choice(SECTORS), rng.randint(0, 10 ** 7), price, cap))
+            stock_id += 1
+            if rng.random() >= 0.2:
+                continue
+            for month in rng.sample(MONTHS, 3):
+                rows.append((stock_id, f'{symbol}25{month}FUT', f'{name} {month.title()} 2025 Future',
+                             'Derivatives', rng.randint(0, 10 ** 6), price, None))
+                stock_id += 1
+                for strike in np.round(price * np.linspace(0.8, 1.2, 5)):
+                    for kind, label in (('CE', 'Call'), ('PE', 'Put')):
+                        rows.append((stock_id, f'{symbol}25{month}{int(strike)}{kind}',
+                                     f'{name} {month.title()} 2025 {int(strike)} {label}', 'Derivatives',
+                                     rng.randint(0, 10 ** 5), round(price * 0.02, 2), None))
+                        stock_id += 1
+        return rows[:count]
+
+    def typo(self, word, rng):
+        i = rng.randrange(len(word) - 1)
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
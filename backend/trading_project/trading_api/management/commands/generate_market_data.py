@@ -0,0 +1,35 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trading_api import synthetic
+from trading_api.models import Stock
+
+
+class Command(BaseCommand):
+    help = 'Generate a reproducible synthetic universe of symbols, bars, users, holdings and orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--symbols', type=int, default=500)
+        parser.add_argument('--years', type=int, default=2, help='Years of daily bars per symbol')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--holdings', type=int, default=10, help='Holdings per user')
+        parser.add_argument('--orders', type=int, default=50, help='Orders per user')
+        parser.add_argument('--watchlist', type=int, default=20, help='Symbols per watchlist')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true', help='Remove existing synthetic data first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            synthetic.clear()
+        elif Stock.objects.filter(symbol__startswith=synthetic.SYMBOL_PREFIX).exists():
+            raise CommandError('Synthetic data already exists; pass --clear to regenerate it')
+        started = time.perf_counter()
+        counts = synthetic.generate(
+            symbols=options['symbols'], years=options['years'], users=options['users'],
+            holdings=options['holdings'], orders=options['orders'], watchlist=options['watchlist'],
+            seed=options['seed'],
+        )
+        counts['seconds'] = round(time.perf_counter() - started, 1)
+        self.stdout.write(json.dumps(counts, indent=2))
@@ -0,0 +1,126 @@
+
+import asyncio
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+
+from trading_api.streaming import TickHub, TickStream, get_config
+
+
+class Command(BaseCommand):
+    help = ('Load test the tick stream: drive many in-process websocket subscribers '
+            'through the ASGI app on one event loop and report delivery and latency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=5000)
+        parser.add_argument('--symbols', type=int, default=2000, help='Size of the symbol universe')
+        parser.add_argument('--per-connection', type=int, default=10, help='Symbols per subscriber')
+        parser.add_argument('--rate', type=int, default=1000, help='Ticks published per second')
+        parser.add_argument('--batches', type=int, default=10, help='Publish batches per second')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to publish for')
+        parser.add_argument('--slow-fraction', type=float, default=0.1,
+                            help='Share of subscribers whose socket drains slowly')
+        parser.add_argument('--slow-delay', type=float, default=0.5, help='Seconds per send for slow subscribers')
+        parser.add_argument('--sample-every', type=int, default=50,
+                            help='Measure latency on every Nth subscriber')
+
+    def handle(self, *args, **options):
+        result = asyncio.run(self.run(options))
+        self.stdout.write(json.dumps(result, indent=2))
+
+    async def run(self, options):
+        random.seed(0)
+        hub = TickHub(get_config()['candle_interval'])
+        app = TickStream(hub, authenticate=False, config={**get_config(), 'redis_url': None})
+        universe = [f'SYM{i}' for i in range(options['symbols'])]
+        stats = {'frames': 0, 'ticks': 0, 'latencies': []}
+        inboxes, tasks = [], []
+
+        for index in range(options['subscribers']):
+            inbox = asyncio.Queue()
+            symbols = random.sample(universe, min(options['per_connection'], len(universe)))
+            inbox.put_nowait({'type': 'websocket.connect'})
+            inbox.put_nowait({'type': 'websocket.receive',
+                              'text': json.dumps({'action': 'subscribe', 'symbols': symbols})})
+            slow = index < options['subscribers'] * options['slow_fraction']
+            sampled = index % options['sample_every'] == 0
+            scope = {'type': 'websocket', 'path': app.config['path'], 'headers': []}
+            tasks.append(asyncio.create_task(app(scope, inbox.get, self.client(stats, slow, sampled, options))))
+            inboxes.append(inbox)
+        await asyncio.sleep(0.5)
+
+        lag = []
+        heartbeat = asyncio.create_task(self.heartbeat(lag))
+        per_batch = max(1, options['rate'] // options['batches'])
+        interval = 1 / options['batches']
+        published = 0
+        started = time.perf_counter()
+        publish_seconds = 0.0
+        deadline = started + options['duration']
+        prices = {symbol: 100.0 for symbol in universe}
+        while time.perf_counter() < deadline:
+            batch = {}
+            for symbol in random.sample(universe, min(per_batch, len(universe))):
+                prices[symbol] = round(prices[symbol] * (1 + random.gauss(0, 0.001)), 2)
+                batch[symbol] = prices[symbol]
+            tick = time.perf_counter()
+            hub.publish_many(batch, datetime.now(dt_timezone.utc))
+            publish_seconds += time.perf_counter() - tick
+            published += len(batch)
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - tick)))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(options['slow_delay'] + 0.5)
+
+        heartbeat.cancel()
+        for inbox in inboxes:
+            inbox.put_nowait({'type': 'websocket.disconnect'})
+        await asyncio.gather(*tasks)
+
+        latencies = sorted(stats['latencies']) or [0.0]
+        return {
+            'subscribers': options['subscribers'],
+            'published_ticks': published,
+            'published_per_second': round(published / elapsed, 1),
+            'publish_ms_per_batch': round(publish_seconds * 1000 / max(1, round(elapsed * options['batches'])), 3),
+            'frames_sent': stats['frames'],
+            'ticks_offered': hub.offered,
+            'ticks_delivered': stats['ticks'],
+            'ticks_coalesced': hub.offered - stats['ticks'],
+            'frames_per_second': round(stats['frames'] / elapsed, 1),
+            'latency_ms_p50': round(statistics.median(latencies) * 1000, 2),
+            'latency_ms_p99': round(latencies[int((len(latencies) - 1) * 0.99)] * 1000, 2),
+            'loop_lag_ms_max': round(max(lag or [0.0]) * 1000, 2),
+        }
+
+    def client(self, stats, slow, sampled, options):
+        """
+        A fake socket: counts frames and ticks and, for sampled subscribers,
+        how old the newest tick in each frame is
+        """
+        async def send(message):
+            if message['type'] != 'websocket.send':
+                return
+            stats['frames'] += 1
+            stats['ticks'] += message['text'].count('"price":')
+            if sampled:
+                data = json.loads(message['text']).get('data', {})
+                if data:
+                    newest = max(datetime.fromisoformat(tick['timestamp'].replace('Z', '+00:00'))
+                                 for tick in data.values())
+                    stats['latencies'].append((datetime.now(dt_timezone.utc) - newest).total_seconds())
+            if slow:
+                await asyncio.sleep(options['slow_delay'])
+        return send
+
+    async def heartbeat(self, lag, period=0.05):
+        """
+        Record how late the event loop wakes up; a starved loop shows here first
+        """
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(period)
+            lag.append(time.perf_counter() - before - period)
@@ -0,0 +1,29 @@
+
+from django.core.management.base import BaseCommand
+
+from trading_api.barstore import bar_store
+from trading_api.models import Stock
+
+
+class Command(BaseCommand):
+    help = 'Rebuild (or catch up) the columnar bar store from HistoricalData'
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbols', nargs='*', help='Symbols to rebuild (default: all)')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only append bars newer than what is already stored')
+
+    def handle(self, *args, **options):
+        stocks = Stock.objects.all()
+        if options['symbols']:
+            stocks = stocks.filter(symbol__in=options['symbols'])
+
+        total = 0
+        for stock in stocks.iterator():
+            if options['incremental']:
+                count = bar_store.sync(stock)
+            else:
+                count = bar_store.rebuild(stock)
+            total += count
+            self.stdout.write(f"{stock.symbol}: {count} bars")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {total} bars"))
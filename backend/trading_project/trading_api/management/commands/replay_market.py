@@ -0,0 +1,52 @@
+import json
+from datetime import datetime, time, timedelta, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from trading_api.barstore import INTERVALS
+from trading_api.models import Stock
+from trading_api.replay import Replay
+
+
+class Command(BaseCommand):
+    help = ('Replay stored bars through the live price-update path, matching the pending orders placed by '
+            'each tick in a separate engine (fills are simulated unless --write-fills)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbols', nargs='*', help='Symbols to replay (default: every stock)')
+        parser.add_argument('--sector', help='Replay every stock in this sector')
+        parser.add_argument('--start', required=True, help='First day (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last day, inclusive (default: --start)')
+        parser.add_argument('--interval', default='1d', choices=list(INTERVALS),
+                            help='Candle width to replay; intraday widths need intraday bars')
+        parser.add_argument('--speed', type=float,
+                            help='Event-time multiple of real time, e.g. 60 (default: as fast as possible)')
+        parser.add_argument('--persist-every', type=int,
+                            help='Also write stock quotes every N seconds of event time (default: daily)')
+        parser.add_argument('--write-fills', action='store_true',
+                            help='Write replay fills to the live orders and holdings (default: keep them in memory)')
+
+    def handle(self, *args, **options):
+        start, end = parse_date(options['start']), parse_date(options['end'] or options['start'])
+        if start is None or end is None or end < start:
+            raise CommandError('--start and --end must be dates with start <= end')
+        stocks = Stock.objects.all()
+        if options['symbols']:
+            stocks = stocks.filter(symbol__in=options['symbols'])
+        if options['sector']:
+            stocks = stocks.filter(sector=options['sector'])
+        symbols = list(stocks.values_list('symbol', flat=True))
+        if not symbols:
+            raise CommandError('No matching stocks')
+
+        replay = Replay(
+            symbols,
+            datetime.combine(start, time.min, timezone.utc),
+            datetime.combine(end + timedelta(days=1), time.min, timezone.utc) - timedelta(microseconds=1),
+            interval=options['interval'],
+            speed=options['speed'],
+            persist_every=options['persist_every'],
+            write_fills=options['write_fills'],
+        )
+        self.stdout.write(json.dumps(replay.run(), indent=2))
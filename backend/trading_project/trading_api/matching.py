@@ -0,0 +1,301 @@
+
+"""
+Order matching engine.
+
+Pending orders are kept in memory in per-symbol books with two heaps keyed by
+trigger price: one for orders that fire when the price rises to a level and
+one for orders that fire when it falls to a level. A price update only pops
+the orders whose trigger was crossed, so its cost depends on the number of
+fills rather than on the number of open orders.
+
+Trigger rules (the fill price is the price that crossed the trigger):
+
+* An order fires on its limit ``price`` only: a BUY when the price falls to
+  it, a SELL when the price rises to it, so a BUY never fills above its
+  limit and a SELL never below it.
+* ``stoploss`` and ``target`` are exit brackets on the position the order
+  opens. When such an order fills, one opposite-side exit order
+  (``parent`` is the entry) is placed for the same quantity and fires at
+  whichever bracket is crossed first: after a BUY, a SELL when the price
+  rises to ``target`` or falls to ``stoploss``; after a SELL, a BUY when it
+  falls to ``target`` or rises to ``stoploss``.
+
+Fills are buffered and written to ``Order`` and ``Holding`` in batched
+transactions by ``flush``. An engine built with ``persist=False`` (the
+historical replay's) applies them to in-memory copies of the holdings
+instead and never writes.
+"""
+
+import heapq
+import itertools
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Holding, Order
+
+CENT = Decimal('0.01')
+
+
+class PendingOrder:
+    __slots__ = ('id', 'portfolio_id', 'stock_id', 'symbol', 'order_type', 'quantity',
+                 'stoploss', 'target', 'parent_id', 'rise_trigger', 'fall_trigger')
+
+    def __init__(self, id, portfolio_id, stock_id, symbol, order_type, quantity, price,
+                 stoploss=None, target=None, parent_id=None):
+        self.id = id
+        self.portfolio_id = portfolio_id
+        self.stock_id = stock_id
+        self.symbol = symbol
+        self.order_type = order_type
+        self.quantity = quantity
+        self.stoploss = stoploss
+        self.target = target
+        self.parent_id = parent_id
+        if parent_id is None:
+            # An entry fires on its limit alone
+            falls, rises = (price, None) if order_type == 'BUY' else (None, price)
+        elif order_type == 'BUY':
+            # Exit of a SELL: take profit below, stop out above
+            falls, rises = target, stoploss
+        else:
+            falls, rises = stoploss, target
+        self.fall_trigger = float(falls) if falls is not None else None
+        self.rise_trigger = float(rises) if rises is not None else None
+
+    def exit_order(self):
+        """
+        The unsaved bracket order to place once this entry fills, if any
+        """
+        if self.parent_id is not None or (self.stoploss is None and self.target is None):
+            return None
+        return Order(portfolio_id=self.portfolio_id, stock_id=self.stock_id,
+                     order_type='SELL' if self.order_type == 'BUY' else 'BUY', quantity=self.quantity,
+                     price=self.target if self.target is not None else self.stoploss,
+                     stoploss=self.stoploss, target=self.target, parent_id=self.id)
+
+
+class OrderBook:
+    """
+    Open orders for one symbol
+    """
+
+    def __init__(self):
+        self.rising = []   # (trigger, seq, order id): fire when price >= trigger
+        self.falling = []  # (-trigger, seq, order id): fire when price <= trigger
+
+    def add(self, order, seq):
+        if order.rise_trigger is not None:
+            heapq.heappush(self.rising, (order.rise_trigger, seq, order.id))
+        if order.fall_trigger is not None:
+            heapq.heappush(self.falling, (-order.fall_trigger, seq, order.id))
+
+    def crossed(self, price):
+        """
+        Pop the ids of every order whose trigger ``price`` reached, oldest
+        first within a price level. Ids may include orders that were already
+        filled or cancelled; the engine filters them.
+        """
+        ids = []
+        rising, falling = self.rising, self.falling
+        while rising and rising[0][0] <= price:
+            ids.append(heapq.heappop(rising)[2])
+        while falling and -falling[0][0] >= price:
+            ids.append(heapq.heappop(falling)[2])
+        return ids
+
+    def __len__(self):
+        return max(len(self.rising), len(self.falling))
+
+
+class MatchingEngine:
+    def __init__(self, persist=True):
+        self.persist = persist
+        self.books = {}
+        self.orders = {}
+        self.fills = []
+        self.last_order_id = 0
+        # Exit orders added by flush that load_pending has not scanned past
+        self.placed = set()
+        # In-memory positions when not persisting; None where there is none
+        self.holdings = {}
+        self._seq = itertools.count()
+        self._simulated_ids = itertools.count(-1, -1)
+        self._lock = threading.RLock()
+
+    def add(self, order):
+        with self._lock:
+            self.orders[order.id] = order
+            self.books.setdefault(order.symbol, OrderBook()).add(order, next(self._seq))
+
+    def cancel(self, order_id):
+        """
+        Drop an order; its heap entries are discarded lazily when reached
+        """
+        with self._lock:
+            return self.orders.pop(order_id, None) is not None
+
+    def load_pending(self):
+        """
+        Add PENDING orders created since the last load with one query
+        """
+        rows = (Order.objects.filter(status='PENDING', id__gt=self.last_order_id)
+                .order_by('id')
+                .values_list('id', 'portfolio_id', 'stock_id', 'stock__symbol', 'order_type',
+                             'quantity', 'price', 'stoploss', 'target', 'parent_id'))
+        count = 0
+        for row in rows.iterator(chunk_size=5000):
+            self.last_order_id = max(self.last_order_id, row[0])
+            if row[0] in self.placed:
+                continue
+            self.add(PendingOrder(*row))
+            count += 1
+        self.placed = {order_id for order_id in self.placed if order_id > self.last_order_id}
+        return count
+
+    def on_price(self, symbol, price, timestamp=None):
+        """
+        Match a price update for ``symbol`` and buffer the resulting fills
+        """
+        book = self.books.get(symbol)
+        if book is None:
+            return 0
+        price = float(price)
+        with self._lock:
+            filled = 0
+            for order_id in book.crossed(price):
+                order = self.orders.pop(order_id, None)
+                if order is None:
+                    continue
+                self.fills.append((order, price, timestamp))
+                filled += 1
+            return filled
+
+    def open_orders(self):
+        return len(self.orders)
+
+    def flush(self):
+        """
+        Write buffered fills to the database in one transaction.
+
+        Orders that stopped being PENDING since they were loaded (for example
+        cancelled through the API) are skipped; SELLs larger than the holding
+        are marked REJECTED. Executed orders with a stoploss or target place
+        their exit order, which joins the books straight away. Returns
+        (executed, rejected). If the write fails the fills go back to the
+        front of the buffer for the next flush.
+        """
+        with self._lock:
+            fills, self.fills = self.fills, []
+        if not fills:
+            return 0, 0
+        try:
+            executed, rejected, exits = self._write(fills) if self.persist else self._simulate(fills)
+        except Exception:
+            with self._lock:
+                self.fills[:0] = fills
+            raise
+        symbols = {order.stock_id: order.symbol for order, _, _ in fills}
+        for exit_order in exits:
+            self.placed.add(exit_order.id)
+            self.add(PendingOrder(exit_order.id, exit_order.portfolio_id, exit_order.stock_id,
+                                  symbols[exit_order.stock_id], exit_order.order_type, exit_order.quantity,
+                                  exit_order.price, exit_order.stoploss, exit_order.target, exit_order.parent_id))
+        return len(executed), len(rejected)
+
+    def _simulate(self, fills):
+        """
+        Apply fills to the in-memory holdings, read from the database the
+        first time a position is touched; exit orders get negative ids
+        """
+        keys = {(order.portfolio_id, order.stock_id) for order, _, _ in fills} - self.holdings.keys()
+        if keys:
+            self.holdings.update(dict.fromkeys(keys))
+            for holding in Holding.objects.filter(portfolio_id__in={key[0] for key in keys},
+                                                  stock_id__in={key[1] for key in keys}):
+                key = (holding.portfolio_id, holding.stock_id)
+                if key in keys:
+                    self.holdings[key] = holding
+        executed, rejected, exits = apply_fills(fills, self.holdings, timezone.now())
+        for exit_order in exits:
+            exit_order.id = next(self._simulated_ids)
+        return executed, rejected, exits
+
+    def _write(self, fills):
+        now = timezone.now()
+        with transaction.atomic():
+            live = set(Order.objects.select_for_update()
+                       .filter(id__in=[order.id for order, _, _ in fills], status='PENDING')
+                       .values_list('id', flat=True))
+            fills = [fill for fill in fills if fill[0].id in live]
+            keys = {(order.portfolio_id, order.stock_id) for order, _, _ in fills}
+            holdings = {
+                (holding.portfolio_id, holding.stock_id): holding
+                for holding in Holding.objects.select_for_update().filter(
+                    portfolio_id__in={key[0] for key in keys},
+                    stock_id__in={key[1] for key in keys},
+                )
+            }
+            executed, rejected, exits = apply_fills(fills, holdings, now)
+
+            Holding.objects.bulk_create([h for h in holdings.values() if h.pk is None and h.quantity > 0])
+            existing = [h for h in holdings.values() if h.pk is not None]
+            Holding.objects.bulk_update([h for h in existing if h.quantity > 0],
+                                        ['quantity', 'average_price'], batch_size=1000)
+            Holding.objects.filter(id__in=[h.id for h in existing if h.quantity <= 0]).delete()
+            Order.objects.bulk_update(executed, ['status', 'price', 'executed_at'], batch_size=1000)
+            Order.objects.bulk_create(exits, batch_size=1000)
+            if rejected:
+                Order.objects.filter(id__in=rejected).update(status='REJECTED', executed_at=now)
+        return executed, rejected, exits
+
+
+def apply_fills(fills, holdings, now):
+    """
+    Apply ``fills`` in order to ``holdings`` ((portfolio id, stock id) ->
+    Holding, updated in place; new positions are added unsaved). Returns the
+    executed orders (unsaved, with their fill), the ids of rejected SELLs
+    and the exit orders to place.
+    """
+    executed, rejected, exits = [], [], []
+    for order, price, timestamp in fills:
+        key = (order.portfolio_id, order.stock_id)
+        holding = holdings.get(key)
+        fill_price = Decimal(str(price)).quantize(CENT, ROUND_HALF_UP)
+        if order.order_type == 'BUY':
+            if holding is None:
+                holding = Holding(portfolio_id=order.portfolio_id, stock_id=order.stock_id,
+                                  quantity=0, average_price=Decimal('0'))
+                holdings[key] = holding
+            cost = holding.quantity * holding.average_price + order.quantity * fill_price
+            holding.quantity += order.quantity
+            holding.average_price = (cost / holding.quantity).quantize(CENT, ROUND_HALF_UP)
+        elif holding is None or holding.quantity < order.quantity:
+            rejected.append(order.id)
+            continue
+        else:
+            holding.quantity -= order.quantity
+        # An executed order's price is its fill price
+        executed.append(Order(id=order.id, status='EXECUTED', price=fill_price, executed_at=timestamp or now))
+        exit_order = order.exit_order()
+        if exit_order is not None:
+            exits.append(exit_order)
+    return executed, rejected, exits
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    The process-wide engine, hydrated from the database on first use
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = MatchingEngine()
+            _engine.load_pending()
+        return _engine
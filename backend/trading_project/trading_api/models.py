@@ -1,7 +1,47 @@
 
 from django.db import models
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import Avg, Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 
+MONEY = models.DecimalField(max_digits=20, decimal_places=2)
+
+def money_sum(expression):
+    return Coalesce(Sum(expression, output_field=MONEY), Value(0), output_field=MONEY)
+
+def executed_total(order_type):
+    """
+    Amount traded by a portfolio's executed orders of ``order_type``, as a
+    subquery so it does not multiply rows joined for other aggregates
+    """
+    total = (Order.objects.filter(portfolio=OuterRef('pk'), status='EXECUTED', order_type=order_type)
+             .values('portfolio')
+             .annotate(total=Sum(F('price') * F('quantity'), output_field=MONEY))
+             .values('total'))
+    return Coalesce(Subquery(total, output_field=MONEY), Value(0), output_field=MONEY)
+
+def percent_change(price, previous_close):
+    if not previous_close:
+        return Decimal('0.00')
+    change = (Decimal(price) - Decimal(previous_close)) * 100 / Decimal(previous_close)
+    return change.quantize(Decimal('0.01'), ROUND_HALF_UP)
+
+class StockQuerySet(models.QuerySet):
+    def breadth(self):
+        """
+        Advancers, decliners and average move per sector, with unclassified
+        stocks grouped as 'Other'
+        """
+        return (self.values(sector_name=Coalesce('sector', Value('Other')))
+                .annotate(advancers=Count('id', filter=Q(percent_change__gt=0)),
+                          decliners=Count('id', filter=Q(percent_change__lt=0)),
+                          unchanged=Count('id', filter=Q(percent_change=0)),
+                          average_change=Avg('percent_change'),
+                          volume=Sum('volume'))
+                .order_by('sector_name'))
+
 class Stock(models.Model):
     symbol = models.CharField(max_length=10, unique=True)
     name = models.CharField(max_length=100)
@@ -10,11 +50,26 @@ class Stock(models.Model):
     open_price = models.DecimalField(max_digits=10, decimal_places=2)
     high_price = models.DecimalField(max_digits=10, decimal_places=2)
     low_price = models.DecimalField(max_digits=10, decimal_places=2)
-    volume = models.BigIntegerField()
+    volume = models.BigIntegerField(db_index=True)
+    # Maintained from current_price/previous_close on every write so movers
+    # are an index range scan instead of a sort over the whole table
+    percent_change = models.DecimalField(max_digits=10, decimal_places=2, default=0, db_index=True)
     sector = models.CharField(max_length=100, null=True, blank=True)
     market_cap = models.BigIntegerField(null=True, blank=True)
     last_updated = models.DateTimeField(auto_now=True)
     
+    objects = StockQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['sector', 'percent_change']),
+            models.Index(fields=['sector', 'volume']),
+        ]
+    
+    def save(self, *args, **kwargs):
+        self.percent_change = percent_change(self.current_price, self.previous_close)
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         return f"{self.symbol} - {self.name}"
 
@@ -43,20 +98,56 @@ class HistoricalData(models.Model):
     def __str__(self):
         return f"{self.stock.symbol} - {self.date}"
 
+class PortfolioQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate market value, cost basis and day change summed over holdings
+        """
+        return self.annotate(
+            total_value=money_sum(F('holdings__quantity') * F('holdings__stock__current_price')),
+            total_investment=money_sum(F('holdings__quantity') * F('holdings__average_price')),
+            day_change=money_sum(F('holdings__quantity') * (
+                F('holdings__stock__current_price') - F('holdings__stock__previous_close'))),
+        )
+    
+    def with_cash_flows(self):
+        """
+        Annotate starting capital and the amounts spent on executed buys and
+        received from executed sells
+        """
+        return self.annotate(
+            initial_capital=Coalesce(F('user__userprofile__initial_capital'), Value(0), output_field=MONEY),
+            bought=executed_total('BUY'),
+            sold=executed_total('SELL'),
+        )
+
 class Portfolio(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     last_modified = models.DateTimeField(auto_now=True)
     
+    objects = PortfolioQuerySet.as_manager()
+    
     def __str__(self):
         return f"{self.user.username}'s Portfolio"
 
+class HoldingQuerySet(models.QuerySet):
+    def sector_values(self):
+        """
+        Market value per sector, with unclassified stocks grouped as 'Other'
+        """
+        return (self.values(sector=Coalesce('stock__sector', Value('Other')))
+                .annotate(value=money_sum(F('quantity') * F('stock__current_price')))
+                .order_by('-value'))
+
 class Holding(models.Model):
     portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='holdings')
     stock = models.ForeignKey(Stock, on_delete=models.PROTECT)
     quantity = models.IntegerField()
     average_price = models.DecimalField(max_digits=10, decimal_places=2)
     
+    objects = HoldingQuerySet.as_manager()
+    
     class Meta:
         unique_together = ('portfolio', 'stock')
         
@@ -86,10 +177,45 @@ class Order(models.Model):
     executed_at = models.DateTimeField(null=True, blank=True)
     stoploss = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     target = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # Set on the exit order placed when an order with a stoploss or target fills
+    parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='exits')
+    
+    class Meta:
+        indexes = [
+            # Order history pages, newest first, optionally by status; the
+            # second also covers the executed-order lookups per portfolio
+            models.Index(fields=['portfolio', '-timestamp', '-id']),
+            models.Index(fields=['portfolio', 'status', '-timestamp', '-id']),
+            # The matching engine's scan for newly placed orders
+            models.Index(fields=['id'], condition=Q(status='PENDING'), name='order_pending_idx'),
+        ]
     
     def __str__(self):
         return f"{self.order_type} {self.quantity} {self.stock.symbol} at {self.price}"
 
+class PortfolioSnapshot(models.Model):
+    SNAPSHOT_KINDS = (
+        ('EOD', 'End of day'),
+        ('INTRADAY', 'Intraday'),
+    )
+    
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='snapshots')
+    kind = models.CharField(max_length=8, choices=SNAPSHOT_KINDS, default='EOD')
+    # End-of-day snapshots are stamped at midnight UTC of their day, like daily bars
+    timestamp = models.DateTimeField()
+    value = models.DecimalField(max_digits=20, decimal_places=2)
+    cash = models.DecimalField(max_digits=20, decimal_places=2)
+    invested = models.DecimalField(max_digits=20, decimal_places=2)
+    realized_pnl = models.DecimalField(max_digits=20, decimal_places=2)
+    unrealized_pnl = models.DecimalField(max_digits=20, decimal_places=2)
+    
+    class Meta:
+        # Also the index behind P&L range scans
+        unique_together = ('portfolio', 'kind', 'timestamp')
+        
+    def __str__(self):
+        return f"{self.portfolio} {self.kind} {self.timestamp}"
+
 class Watchlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
@@ -98,6 +224,22 @@ class Watchlist(models.Model):
     
     class Meta:
         unique_together = ('user', 'name')
+    
+    def set_symbols(self, symbols, existing=None):
+        """
+        Make the watchlist hold exactly ``symbols``, ignoring unknown ones:
+        one lookup, one bulk insert and one bulk delete. Pass ``existing``
+        (stock ids) when the current members are already known.
+        """
+        through = Watchlist.stocks.through
+        wanted = set(Stock.objects.filter(symbol__in=set(symbols)).values_list('id', flat=True))
+        if existing is None:
+            existing = through.objects.filter(watchlist=self).values_list('stock_id', flat=True)
+        existing = set(existing)
+        through.objects.bulk_create(
+            [through(watchlist_id=self.id, stock_id=stock_id) for stock_id in wanted - existing])
+        if existing - wanted:
+            through.objects.filter(watchlist=self, stock_id__in=existing - wanted).delete()
         
     def __str__(self):
         return f"{self.user.username} - {self.name}"
@@ -109,3 +251,72 @@ class UserProfile(models.Model):
     
     def __str__(self):
         return self.user.username
+
+class ScreenerRun(models.Model):
+    RUN_STATUS = (
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    )
+    
+    status = models.CharField(max_length=10, choices=RUN_STATUS, default='RUNNING')
+    bars = models.IntegerField()
+    symbols = models.IntegerField(default=0)
+    shards = models.IntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Screener run {self.id} ({self.status})"
+
+class ScreenerResult(models.Model):
+    run = models.ForeignKey(ScreenerRun, on_delete=models.CASCADE, related_name='results')
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    as_of = models.DateTimeField()
+    close = models.FloatField()
+    # Factors are ratios (0.05 == 5%); None when the history is too short
+    trend = models.FloatField(null=True)
+    momentum_3m = models.FloatField(null=True)
+    momentum_12m = models.FloatField(null=True)
+    volatility = models.FloatField(null=True)
+    high_distance = models.FloatField(null=True)
+    volume_spike = models.FloatField(null=True)
+    score = models.FloatField(null=True)
+    rank = models.IntegerField(null=True)
+    
+    class Meta:
+        unique_together = ('run', 'stock')
+        indexes = [models.Index(fields=['run', 'rank'])]
+        
+    def __str__(self):
+        return f"{self.stock.symbol} #{self.rank} (run {self.run_id})"
+
+class ReportRun(models.Model):
+    RUN_STATUS = (
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    )
+    
+    REPORT_FORMATS = (
+        ('csv', 'CSV'),
+        ('parquet', 'Parquet'),
+    )
+    
+    status = models.CharField(max_length=10, choices=RUN_STATUS, default='RUNNING')
+    format = models.CharField(max_length=8, choices=REPORT_FORMATS, default='csv')
+    # Set for single-user runs
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    path = models.CharField(max_length=255, blank=True)
+    # Checkpoint: users are processed in id order; a resumed run continues
+    # after last_user_id, with CSV files truncated back to these offsets
+    last_user_id = models.IntegerField(default=0)
+    offsets = models.JSONField(default=dict)
+    chunks = models.IntegerField(default=0)
+    users = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Report run {self.id} ({self.status})"
@@ -0,0 +1,170 @@
+
+"""
+Vectorized European option pricing.
+
+Every function takes NumPy arrays (or scalars that broadcast against them)
+and prices whole chains in a handful of array operations. Two models share
+one formula written on the forward price:
+
+* ``black-scholes`` -- options on the spot price, with a continuous
+  dividend yield: F = S * exp((r - q) * T);
+* ``black-76`` -- options on a futures/forward price: F = S.
+
+Expiries are in years. Theta is per calendar day and vega per volatility
+point (0.01), the units option chains are usually quoted in.
+``implied_volatility`` inverts the price with a safeguarded Newton solver:
+Newton steps on vega, falling back to bisection of a per-contract bracket
+whenever a step would leave it, so every contract converges.
+"""
+
+import numpy as np
+
+MODELS = ('black-scholes', 'black-76')
+
+# Floors that keep d1/d2 finite for contracts at expiry or with zero vol
+MIN_EXPIRY = 1.0 / (365 * 24 * 60)
+MIN_VOLATILITY = 1e-6
+
+IV_BOUNDS = (1e-4, 5.0)
+IV_TOLERANCE = 1e-8
+IV_MAX_ITERATIONS = 100
+
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / SQRT_2PI
+
+
+def norm_cdf(x):
+    """
+    Standard normal CDF to double precision (Hart's rational approximation,
+    with a continued fraction in the tail)
+    """
+    z = np.abs(x)
+    e = np.exp(-0.5 * z * z)
+    numerator = ((((((0.0352624965998911 * z + 0.700383064443688) * z + 6.37396220353165) * z
+                    + 33.912866078383) * z + 112.079291497871) * z + 221.213596169931) * z + 220.206867912376)
+    denominator = (((((((0.0883883476483184 * z + 1.75566716318264) * z + 16.064177579207) * z
+                       + 86.7807322029461) * z + 296.564248779674) * z + 637.333633378831) * z
+                    + 793.826512519948) * z + 440.413735824752)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = z + 0.65
+        for k in (4.0, 3.0, 2.0, 1.0):
+            fraction = z + k / fraction
+        tail = np.where(z < 7.07106781186547, e * numerator / denominator, e / fraction / SQRT_2PI)
+    tail = np.where(z > 37.0, 0.0, tail)
+    return np.where(x > 0, 1.0 - tail, tail)
+
+
+def terms(underlying, strike, expiry, volatility, rate, dividend, model):
+    """
+    Forward, discount factor, carry (dF/dS) and d1/d2 for a set of contracts
+    """
+    if model not in MODELS:
+        raise ValueError(f'Unknown model {model}')
+    expiry = np.maximum(np.asarray(expiry, dtype=np.float64), MIN_EXPIRY)
+    volatility = np.maximum(np.asarray(volatility, dtype=np.float64), MIN_VOLATILITY)
+    underlying = np.asarray(underlying, dtype=np.float64)
+    discount = np.exp(-rate * expiry)
+    carry = np.exp((rate - dividend) * expiry) if model == 'black-scholes' else np.ones_like(expiry)
+    forward = underlying * carry
+    deviation = volatility * np.sqrt(expiry)
+    d1 = (np.log(forward / strike) + 0.5 * deviation * deviation) / deviation
+    return forward, discount, carry, expiry, deviation, d1, d1 - deviation
+
+
+def price(underlying, strike, expiry, volatility, is_call, rate=0.0, dividend=0.0, model='black-scholes'):
+    forward, discount, _, _, _, d1, d2 = terms(underlying, strike, expiry, volatility, rate, dividend, model)
+    sign = np.where(is_call, 1.0, -1.0)
+    return discount * sign * (forward * norm_cdf(sign * d1) - strike * norm_cdf(sign * d2))
+
+
+def greeks(underlying, strike, expiry, volatility, is_call, rate=0.0, dividend=0.0, model='black-scholes'):
+    """
+    Price, delta, gamma, theta and vega as arrays, from one pass over the
+    contracts
+    """
+    forward, discount, carry, expiry, deviation, d1, d2 = terms(
+        underlying, strike, expiry, volatility, rate, dividend, model)
+    sign = np.where(is_call, 1.0, -1.0)
+    cdf_d1 = norm_cdf(sign * d1)
+    pdf_d1 = norm_pdf(d1)
+    value = discount * sign * (forward * cdf_d1 - strike * norm_cdf(sign * d2))
+    # Growth of the forward with time: r - q on spot, none on futures
+    drift = (rate - dividend) if model == 'black-scholes' else 0.0
+    decay = discount * forward * pdf_d1 * deviation / (2 * expiry)
+    return {
+        'price': value,
+        'delta': discount * carry * sign * cdf_d1,
+        'gamma': discount * carry * pdf_d1 / (np.asarray(underlying, dtype=np.float64) * deviation),
+        'theta': (rate * value - drift * discount * forward * sign * cdf_d1 - decay) / 365,
+        'vega': discount * forward * pdf_d1 * np.sqrt(expiry) / 100,
+    }
+
+
+def implied_volatility(premium, underlying, strike, expiry, is_call, rate=0.0, dividend=0.0,
+                       model='black-scholes', tolerance=IV_TOLERANCE, max_iterations=IV_MAX_ITERATIONS):
+    """
+    Volatilities that reproduce ``premium``; NaN where the premium is outside
+    the no-arbitrage bounds (or has no time value left to solve for)
+    """
+    premium, underlying, strike, expiry, is_call = np.broadcast_arrays(
+        *(np.asarray(value, dtype=np.float64) for value in (premium, underlying, strike, expiry, is_call)))
+    is_call = is_call.astype(bool)
+    forward, discount = terms(underlying, strike, expiry, 1.0, rate, dividend, model)[:2]
+    intrinsic = discount * np.maximum(np.where(is_call, forward - strike, strike - forward), 0.0)
+    ceiling = discount * np.where(is_call, forward, strike)
+    result = np.full(premium.shape, np.nan)
+    active = np.flatnonzero((premium > intrinsic) & (premium < ceiling))
+
+    # Brenner-Subrahmanyam at-the-money estimate as the first guess
+    low, high = np.full(len(active), IV_BOUNDS[0]), np.full(len(active), IV_BOUNDS[1])
+    guess = np.sqrt(2 * np.pi / np.maximum(expiry.flat[active], MIN_EXPIRY)) * premium.flat[active] / (
+        discount.flat[active] * forward.flat[active])
+    volatility = np.clip(guess, low * 2, high / 2)
+    args = [array.flat[active] for array in (underlying, strike, expiry, is_call, premium)]
+
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        values = greeks(args[0], args[1], args[2], volatility, args[3], rate, dividend, model)
+        error = values['price'] - args[4]
+        done = np.abs(error) <= tolerance * np.maximum(args[4], 1.0)
+        result.flat[active[done]] = volatility[done]
+
+        keep = ~done
+        active, volatility, error, low, high = active[keep], volatility[keep], error[keep], low[keep], high[keep]
+        vega = values['vega'][keep] * 100
+        args = [array[keep] for array in args]
+        high = np.where(error > 0, volatility, high)
+        low = np.where(error < 0, volatility, low)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            step = volatility - error / vega
+        bisect = ~np.isfinite(step) | (step <= low) | (step >= high)
+        volatility = np.where(bisect, 0.5 * (low + high), step)
+    return result
+
+
+def chain(underlying, strikes, expiries, volatility, rate=0.0, dividend=0.0, model='black-scholes'):
+    """
+    Greeks for a call and a put at every (expiry, strike) pair; arrays are
+    shaped (2, expiries, strikes) with calls first
+    """
+    strikes = np.asarray(strikes, dtype=np.float64)
+    expiries = np.asarray(expiries, dtype=np.float64)
+    is_call = np.array([True, False])[:, None, None]
+    values = greeks(underlying, strikes[None, None, :], expiries[None, :, None], volatility, is_call,
+                    rate, dividend, model)
+    shape = (2, len(expiries), len(strikes))
+    return {name: np.broadcast_to(array, shape) for name, array in values.items()}
+
+
+def historical_volatility(close, window=30, periods_per_year=252):
+    """
+    Annualized standard deviation of the last ``window`` log returns
+    """
+    close = np.asarray(close, dtype=np.float64)[-(window + 1):]
+    if len(close) < 3:
+        return None
+    return float(np.diff(np.log(close)).std(ddof=1) * np.sqrt(periods_per_year))
@@ -0,0 +1,23 @@
+
+from rest_framework.pagination import CursorPagination
+
+
+class OrderPagination(CursorPagination):
+    """
+    Keyset pages of a portfolio's orders, newest first; the cursor encodes
+    the last timestamp seen, so every page is an index range scan
+    """
+    ordering = ('-timestamp', '-id')
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 500
+
+
+class SnapshotPagination(CursorPagination):
+    """
+    Keyset pages of a portfolio's snapshots, oldest first
+    """
+    ordering = ('timestamp',)
+    page_size = 500
+    page_size_query_param = 'limit'
+    max_page_size = 5000
@@ -0,0 +1,67 @@
+
+import logging
+
+from celery.signals import task_postrun, task_prerun
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import caching, instrumentation
+from .matching import get_engine
+from .models import MarketIndex, Stock
+from .signals import indices_updated, quotes_updated
+from .streaming import publish_ticks
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(quotes_updated)
+def match_orders(sender, prices, timestamp=None, replay=False, **kwargs):
+    """
+    Run new prices through the order matching engine and persist the fills.
+    Failures are logged rather than raised, so the other receivers (tick
+    stream, cache invalidation) still see the update; unwritten fills stay
+    buffered in the engine and are retried on the next update. Replayed
+    history never reaches the live engine.
+    """
+    if replay:
+        return
+    try:
+        engine = get_engine()
+        engine.load_pending()
+        for symbol, price in prices.items():
+            engine.on_price(symbol, price, timestamp)
+        engine.flush()
+    except Exception:
+        logger.exception("Order matching failed")
+
+
+@receiver(quotes_updated)
+def stream_ticks(sender, prices, timestamp=None, **kwargs):
+    """
+    Push new prices to websocket subscribers
+    """
+    publish_ticks(prices, timestamp)
+
+
+@receiver(quotes_updated)
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def invalidate_stocks(sender, **kwargs):
+    caching.bump(caching.STOCKS)
+
+
+@receiver(indices_updated)
+@receiver(post_save, sender=MarketIndex)
+@receiver(post_delete, sender=MarketIndex)
+def invalidate_indices(sender, **kwargs):
+    caching.bump(caching.INDICES)
+
+
+@task_prerun.connect
+def start_task_timer(sender=None, task_id=None, **kwargs):
+    instrumentation.start_task(task_id)
+
+
+@task_postrun.connect
+def record_task_duration(sender=None, task_id=None, state=None, **kwargs):
+    instrumentation.finish_task(task_id, sender.name, state)
@@ -0,0 +1,193 @@
+
+"""
+Columnar response formats for chart and bulk endpoints.
+
+Views that opt in (``ColumnarMixin``) return a ``Columns`` payload when the
+client negotiates one of these formats, through the ``Accept`` header or
+``?format=``:
+
+* ``columns`` -- compact JSON, ``{..., "length": n, "columns": {field: [...]}}``;
+* ``msgpack`` -- the same document as MessagePack (needs ``msgpack``);
+* ``arrow`` -- an Arrow IPC stream with one record batch (needs ``pyarrow``),
+  extra keys in the schema metadata as JSON.
+
+Columns are built straight from NumPy arrays or ``values_list`` rows, with
+no serializer per row. Decimals go out as numbers instead of strings, and
+timestamps as epoch milliseconds (UTC) in JSON and MessagePack, and as
+``timestamp[ms, UTC]`` in Arrow. Anything else (errors, for one) is
+rendered as-is in the negotiated format. With ``orjson`` installed the
+JSON encoder reads the arrays directly instead of going through lists.
+"""
+
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+
+class Columns:
+    """
+    Equal-length columns keyed by field name, plus top-level ``meta`` keys
+    """
+
+    def __init__(self, columns, **meta):
+        self.columns = columns
+        self.meta = meta
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    @classmethod
+    def from_values(cls, queryset, fields, names=None, **meta):
+        """
+        Columns for ``fields`` of a queryset, from one ``values_list`` query
+        """
+        rows = list(queryset.values_list(*fields))
+        values = list(zip(*rows)) if rows else [()] * len(fields)
+        return cls({name: to_array(column) for name, column in zip(names or fields, values)}, **meta)
+
+    def document(self, arrays=False):
+        """
+        The payload as plain lists, for the JSON and MessagePack encoders;
+        ``arrays`` leaves numeric columns as arrays (for orjson)
+        """
+        return {**self.meta, 'length': len(self), 'columns': {
+            name: to_list(values, arrays) for name, values in self.columns.items()}}
+
+
+def to_array(values):
+    """
+    NumPy array for a column of database values: floats (NaN for null) for
+    decimals, datetime64[ms] (NaT for null) for datetimes, int64 for ints
+    without nulls; other columns stay lists
+    """
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, (Decimal, float)):
+        return np.array([np.nan if value is None else float(value) for value in values])
+    if isinstance(sample, datetime):
+        return np.array([round(value.timestamp() * 1000) if value is not None else np.iinfo(np.int64).min
+                         for value in values]).astype('datetime64[ms]')
+    if isinstance(sample, int) and not isinstance(sample, bool) and None not in values:
+        return np.array(values, dtype=np.int64)
+    return list(values)
+
+
+def to_list(values, arrays=False):
+    if not isinstance(values, np.ndarray):
+        return list(values)
+    missing = None
+    if values.dtype.kind == 'M':
+        missing = np.isnat(values)
+        values = values.astype('datetime64[ms]').astype(np.int64)
+    elif values.dtype.kind == 'f':
+        # orjson writes NaN as null itself
+        missing = np.isnan(values) if not arrays else None
+    if missing is None or not missing.any():
+        return np.ascontiguousarray(values) if arrays else values.tolist()
+    values = values.astype(object)
+    values[missing] = None
+    return values.tolist()
+
+
+def to_arrow(values):
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'M':
+        return pyarrow.array(values.astype('datetime64[ms]'), type=pyarrow.timestamp('ms', tz='UTC'))
+    if isinstance(values, np.ndarray):
+        return pyarrow.array(values, from_pandas=True)
+    return pyarrow.array(values)
+
+
+def plain(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {type(value).__name__}')
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    media_type = 'application/vnd.trading.columns+json'
+    format = 'columns'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, Columns):
+            if orjson is not None:
+                return orjson.dumps(data.document(arrays=True), default=plain,
+                                    option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z)
+            data = data.document()
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, Columns):
+            data = data.document()
+        return msgpack.packb(data, use_bin_type=True, default=plain)
+
+
+class ArrowRenderer(BaseRenderer):
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, Columns):
+            table = pyarrow.table({name: to_arrow(values) for name, values in data.columns.items()})
+            metadata = {name: json.dumps(value, default=plain) for name, value in data.meta.items()}
+        else:
+            table = pyarrow.Table.from_pylist(data if isinstance(data, list) else [data])
+            metadata = {}
+        table = table.replace_schema_metadata(metadata)
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+COLUMNAR_RENDERERS = [ColumnarJSONRenderer]
+if msgpack is not None:
+    COLUMNAR_RENDERERS.append(MessagePackRenderer)
+if pyarrow is not None:
+    COLUMNAR_RENDERERS.append(ArrowRenderer)
+
+
+def is_columnar(request):
+    return isinstance(getattr(request, 'accepted_renderer', None), tuple(COLUMNAR_RENDERERS))
+
+
+class ColumnarMixin:
+    """
+    Offer the columnar formats on ``columnar_actions`` in addition to the
+    default renderers
+    """
+    columnar_actions = ('list',)
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.action in self.columnar_actions:
+            renderers += [renderer() for renderer in COLUMNAR_RENDERERS]
+        return renderers
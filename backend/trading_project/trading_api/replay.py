@@ -0,0 +1,227 @@
+
+"""
+Historical market replay.
+
+Bars from the bar store are turned back into a deterministic tick stream
+and fed through the live write path, so the websocket hub and caches see
+the same signals they see from a real feed.
+
+Each bar becomes four ticks inside its bucket: open at the bucket start,
+then low and high (high and low on a down bar) at one and two thirds of
+the width, and the close one microsecond before the next bucket. Ticks are
+ordered by event time, then symbol; ticks sharing a time go out as one
+update.
+
+Orders are matched by the replay's own ``MatchingEngine``, never the live
+one: a PENDING order joins its books once the clock reaches the order's
+timestamp, and fires at the tick that crossed it, with that tick's price
+and event time as the fill. Fills, and the exit orders they place, stay
+in memory unless ``write_fills`` asks for them to be written to the live
+orders and holdings.
+
+Ticks are announced with ``quotes_updated`` (``replay=True``, so the live
+engine ignores them) for the websocket hub. Stock quotes are written through
+``ingestion.ingest`` at each day's last close, and also every
+``persist_every`` seconds of event time when that is set (with the day
+open/high/low, cumulative volume and the prior day's close); writing 500
+quotes costs far more than matching them, so a per-minute cadence is
+opt-in. ``speed`` paces event time against the wall clock (1 is real
+time, 60 a minute per second); without it the replay runs as fast as it
+can.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from .barstore import INTERVALS, bar_store, to_datetime, to_datetime64
+from .ingestion import MarketBatch, ingest, to_price
+from .matching import MatchingEngine, PendingOrder
+from .models import Order, Stock
+from .signals import quotes_updated
+
+DAY_NS = INTERVALS['1d'] * 10**9
+US_NS = 1000
+
+# Tick positions within a bar: open, first extreme, second extreme, close
+CLOSE = 3
+
+
+class Replay:
+    """
+    Replay ``symbols`` between ``start`` and ``end`` at ``interval`` candles
+    """
+
+    def __init__(self, symbols, start, end, interval='1d', speed=None, persist_every=None, write_fills=False):
+        if interval not in INTERVALS:
+            raise ValueError(f'Unknown interval {interval}')
+        if speed is not None and speed <= 0:
+            raise ValueError('speed must be positive')
+        self.symbols = sorted(set(symbols))
+        self.start = start
+        self.end = end
+        self.interval = interval
+        self.speed = speed
+        self.persist_every = persist_every
+        self.write_fills = write_fills
+
+    def load(self):
+        """
+        Read every symbol's bars into flat arrays, sorted by symbol then time,
+        with the running day values the close quotes need
+        """
+        stocks = Stock.objects.filter(symbol__in=self.symbols).order_by('symbol')
+        bar_store.sync_many(stocks)
+        self.symbols = [stock.symbol for stock in stocks]
+
+        columns = {name: [] for name in ('symbol', 'dates', 'open', 'high', 'low', 'close', 'volume')}
+        previous = {}
+        before = to_datetime64(self.start) - np.timedelta64(1, 'ns')
+        for index, symbol in enumerate(self.symbols):
+            bars = bar_store.query(symbol, self.start, self.end, self.interval).slice(self.start, self.end)
+            if not len(bars):
+                continue
+            prior = bar_store.read(symbol, end=to_datetime(before)).tail(1)
+            columns['symbol'].append(np.full(len(bars), index))
+            columns['dates'].append(bars.dates.astype(np.int64))
+            for name in ('open', 'high', 'low', 'close', 'volume'):
+                columns[name].append(getattr(bars, name))
+            if len(prior):
+                previous[index] = prior.close[-1]
+        if not columns['dates']:
+            return pd.DataFrame(columns=list(columns))
+        frame = pd.DataFrame({name: np.concatenate(values) for name, values in columns.items()})
+
+        # The previous close of a bar is the last close of the symbol's prior
+        # day; the first replayed day looks it up in the stored history
+        frame['day'] = frame['dates'] // DAY_NS
+        days = frame.groupby(['symbol', 'day'], sort=False)
+        last_close = days['close'].last()
+        prior_close = last_close.groupby(level='symbol').shift()
+        stored = prior_close.index.get_level_values('symbol').map(previous)
+        prior_close = prior_close.fillna(pd.Series(stored, index=prior_close.index))
+        frame['previous_close'] = prior_close.reindex(
+            pd.MultiIndex.from_frame(frame[['symbol', 'day']])).to_numpy()
+        frame['day_open'] = days['open'].transform('first')
+        frame['previous_close'] = frame['previous_close'].fillna(frame['day_open'])
+        frame['day_high'] = days['high'].cummax()
+        frame['day_low'] = days['low'].cummin()
+        frame['day_volume'] = days['volume'].cumsum()
+
+        # Closes that are written as quotes: each day's last, plus every
+        # persist_every seconds
+        frame['persist'] = (frame['symbol'] != frame['symbol'].shift(-1)) | (frame['day'] != frame['day'].shift(-1))
+        if self.persist_every:
+            ends = frame['dates'] + INTERVALS[self.interval] * 10**9
+            frame['persist'] |= ends % int(self.persist_every * 10**9) == 0
+        return frame
+
+    def orders(self):
+        """
+        PENDING orders on the replayed symbols placed by the end of the range,
+        as (placed at, PendingOrder) in placement order
+        """
+        rows = (Order.objects.filter(status='PENDING', timestamp__lte=self.end, stock__symbol__in=self.symbols)
+                .order_by('timestamp', 'id')
+                .values_list('timestamp', 'id', 'portfolio_id', 'stock_id', 'stock__symbol', 'order_type',
+                             'quantity', 'price', 'stoploss', 'target', 'parent_id'))
+        return [(placed, PendingOrder(*row)) for placed, *row in rows]
+
+    def ticks(self, frame):
+        """
+        Four ticks per bar as (time, point, symbol index, bar row, price)
+        arrays in replay order
+        """
+        width = INTERVALS[self.interval] * 10**9
+        rows = np.arange(len(frame))
+        up = (frame['close'] >= frame['open']).to_numpy()
+        high, low = frame['high'].to_numpy(), frame['low'].to_numpy()
+        prices = np.stack([
+            frame['open'].to_numpy(),
+            np.where(up, low, high),
+            np.where(up, high, low),
+            frame['close'].to_numpy(),
+        ])
+        offsets = np.array([0, width // 3, 2 * width // 3, width - US_NS])
+        times = frame['dates'].to_numpy()[None, :] + offsets[:, None]
+        points = np.repeat(np.arange(4), len(frame)).reshape(4, len(frame))
+        symbols = np.broadcast_to(frame['symbol'].to_numpy(), (4, len(frame)))
+        rows = np.broadcast_to(rows, (4, len(frame)))
+
+        times, points, symbols, rows, prices = (
+            array.ravel() for array in (times, points, symbols, rows, prices))
+        order = np.lexsort((symbols, points, times))
+        return times[order], points[order], symbols[order], rows[order], prices[order]
+
+    def run(self):
+        """
+        Replay the range and return counts and timings
+        """
+        started = time.perf_counter()
+        frame = self.load()
+        loaded = time.perf_counter()
+        times, points, symbols, rows, prices = self.ticks(frame)
+        steps = np.flatnonzero((np.diff(times) != 0) | (np.diff(points) != 0)) + 1
+        engine = MatchingEngine(persist=self.write_fills)
+        pending = self.orders()
+
+        names = np.array(self.symbols, dtype=object)
+        persist = frame['persist'].to_numpy() if len(frame) else None
+        first = times[0] if len(times) else 0
+        clock = time.perf_counter()
+        updates = writes = admitted = executed = rejected = 0
+        for step in np.split(np.arange(len(times)), steps) if len(times) else ():
+            event_time = times[step[0]]
+            if self.speed is not None:
+                delay = clock + (event_time - first) / 1e9 / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            timestamp = to_datetime(np.datetime64(int(event_time), 'ns'))
+            while admitted < len(pending) and pending[admitted][0] <= timestamp:
+                engine.add(pending[admitted][1])
+                admitted += 1
+            update = {symbol: to_price(price) for symbol, price in zip(names[symbols[step]], prices[step])}
+            for symbol, price in update.items():
+                engine.on_price(symbol, price, timestamp)
+            filled, refused = engine.flush()
+            executed += filled
+            rejected += refused
+            if points[step[0]] == CLOSE and persist[rows[step]].any():
+                self.close(frame, names[symbols[step]], rows[step], timestamp)
+                writes += 1
+            else:
+                quotes_updated.send(sender=Replay, timestamp=timestamp, prices=update, replay=True)
+            updates += 1
+        finished = time.perf_counter()
+
+        return {
+            'symbols': int(frame['symbol'].nunique()) if len(frame) else 0,
+            'bars': len(frame),
+            'ticks': len(times),
+            'updates': updates,
+            'quote_writes': writes,
+            'orders': admitted,
+            'executed': executed,
+            'rejected': rejected,
+            'open_orders': engine.open_orders(),
+            'fills_written': self.write_fills,
+            'load_seconds': round(loaded - started, 3),
+            'replay_seconds': round(finished - loaded, 3),
+            'ticks_per_second': round(len(times) / (finished - loaded), 1) if finished > loaded else None,
+        }
+
+    def close(self, frame, symbols, rows, timestamp):
+        """
+        Write the closing quotes of one bucket through the ingestion path,
+        which also announces them
+        """
+        values = frame.iloc[rows]
+        quotes = [
+            {'symbol': symbol, 'price': close, 'previous_close': previous, 'open': day_open,
+             'high': day_high, 'low': day_low, 'volume': volume, 'timestamp': timestamp}
+            for symbol, close, previous, day_open, day_high, day_low, volume in zip(
+                symbols, values['close'], values['previous_close'], values['day_open'],
+                values['day_high'], values['day_low'], values['day_volume'])
+        ]
+        ingest(MarketBatch(quotes=quotes), replay=True)
@@ -0,0 +1,213 @@
+
+"""
+Bulk user statements.
+
+Users are read in id order in keyset chunks (``id > last id``). For each
+chunk, portfolio totals and cash flows, holdings with their stock prices,
+and executed orders come from one query apiece, so the query count per
+chunk does not depend on the chunk's contents. Rows are streamed straight
+to the output files:
+
+* statements: one row per portfolio -- capital, cash, invested, value,
+  realized/unrealized P&L (as in snapshots), fees and trade count
+* holdings: open positions at the current price
+* trades: executed orders
+
+Fees apply REPORTS['commission'] to the traded value, like the backtest
+commission. After each chunk the files are flushed and the run stores a
+checkpoint (last user id and the CSV byte offsets); a resumed run truncates
+the files back to the checkpoint and carries on after that user, so a
+crash never duplicates or loses rows. Parquet output (needs pyarrow) is
+written as one part file per chunk instead.
+"""
+
+import csv
+import os
+from decimal import Decimal, ROUND_HALF_UP
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import Holding, Order, Portfolio
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CENT = Decimal('0.01')
+
+COLUMNS = {
+    'statements': ['user_id', 'username', 'portfolio_id', 'initial_capital', 'cash', 'invested', 'value',
+                   'realized_pnl', 'unrealized_pnl', 'fees', 'trades'],
+    'holdings': ['user_id', 'symbol', 'quantity', 'average_price', 'price', 'value', 'unrealized_pnl'],
+    'trades': ['user_id', 'order_id', 'executed_at', 'symbol', 'side', 'quantity', 'price', 'value', 'fee'],
+}
+
+
+class CsvSink:
+    """
+    Appends rows to ``<name>.csv``, truncated to ``offset`` on open
+    """
+
+    def __init__(self, directory, name, offset=0):
+        self.path = directory / f'{name}.csv'
+        if offset:
+            os.truncate(self.path, offset)
+        self.file = open(self.path, 'a' if offset else 'w', newline='')
+        self.writer = csv.writer(self.file)
+        if not offset:
+            self.writer.writerow(COLUMNS[name])
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def commit(self, chunk):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    """
+    Writes each chunk's rows to ``<name>/part-<chunk>.parquet``; parts past
+    the checkpoint are removed on open
+    """
+
+    def __init__(self, directory, name, chunk=0):
+        if pyarrow is None:
+            raise RuntimeError('Parquet reports require pyarrow')
+        self.name = name
+        self.directory = directory / name
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for part in self.directory.glob('part-*.parquet'):
+            if int(part.stem.split('-')[1]) > chunk:
+                part.unlink()
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append([float(value) if isinstance(value, Decimal) else value for value in row])
+
+    def commit(self, chunk):
+        columns = {column: [row[index] for row in self.rows] for index, column in enumerate(COLUMNS[self.name])}
+        pyarrow.parquet.write_table(pyarrow.table(columns), self.directory / f'part-{chunk:06d}.parquet')
+        self.rows = []
+
+    def close(self):
+        self.rows = []
+
+
+def open_sinks(run):
+    directory = Path(run.path)
+    directory.mkdir(parents=True, exist_ok=True)
+    if run.format == 'parquet':
+        return {name: ParquetSink(directory, name, run.chunks) for name in COLUMNS}
+    return {name: CsvSink(directory, name, run.offsets.get(name, 0)) for name in COLUMNS}
+
+
+def money(value):
+    return Decimal(value).quantize(CENT, ROUND_HALF_UP)
+
+
+def user_chunks(run, chunk_size):
+    """
+    Yield lists of (id, username) after the run's checkpoint
+    """
+    users = User.objects.order_by('id')
+    if run.user_id is not None:
+        users = users.filter(id=run.user_id)
+    last_id = run.last_user_id
+    while True:
+        chunk = list(users.filter(id__gt=last_id).values_list('id', 'username')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+def write_chunk(users, sinks, commission):
+    """
+    Write statements, holdings and trades for one chunk of users. Returns
+    the number of statements written.
+    """
+    user_ids = [user_id for user_id, _ in users]
+    names = dict(users)
+
+    for user_id, symbol, quantity, average_price, price in (
+            Holding.objects.filter(portfolio__user_id__in=user_ids, quantity__gt=0)
+            .order_by('portfolio__user_id', 'stock__symbol')
+            .values_list('portfolio__user_id', 'stock__symbol', 'quantity', 'average_price',
+                         'stock__current_price')
+            .iterator(chunk_size=5000)):
+        sinks['holdings'].write([user_id, symbol, quantity, average_price, price, money(quantity * price),
+                                 money(quantity * (price - average_price))])
+
+    trades = {}
+    for user_id, order_id, executed_at, symbol, side, quantity, price in (
+            Order.objects.filter(portfolio__user_id__in=user_ids, status='EXECUTED')
+            .order_by('portfolio__user_id', 'executed_at', 'id')
+            .values_list('portfolio__user_id', 'id', 'executed_at', 'stock__symbol', 'order_type',
+                         'quantity', 'price')
+            .iterator(chunk_size=5000)):
+        value = money(quantity * price)
+        sinks['trades'].write([user_id, order_id, executed_at.isoformat() if executed_at else '', symbol, side,
+                               quantity, price, value, money(value * commission)])
+        trades[user_id] = trades.get(user_id, 0) + 1
+
+    statements = (Portfolio.objects.filter(user_id__in=user_ids).order_by('user_id')
+                  .with_totals().with_cash_flows()
+                  .values_list('user_id', 'id', 'total_value', 'total_investment', 'initial_capital',
+                               'bought', 'sold'))
+    count = 0
+    for user_id, portfolio_id, value, invested, initial, bought, sold in statements:
+        initial, value, invested = money(initial), money(value), money(invested)
+        cash = initial - money(bought) + money(sold)
+        sinks['statements'].write([
+            user_id, names[user_id], portfolio_id, initial, cash, invested, value,
+            cash + invested - initial, value - invested, money((bought + sold) * commission),
+            trades.get(user_id, 0),
+        ])
+        count += 1
+    return count
+
+
+def run_reports(run, on_progress=None):
+    """
+    Generate (or resume) ``run``, checkpointing after every chunk
+    """
+    config = settings.REPORTS
+    commission = Decimal(str(config['commission']))
+    if not run.path:
+        run.path = str(Path(config['dir']) / f'run-{run.id}')
+    if not run.total:
+        run.total = User.objects.count() if run.user_id is None else 1
+    run.status = 'RUNNING'
+    run.save(update_fields=['path', 'total', 'status'])
+
+    sinks = open_sinks(run)
+    try:
+        for users in user_chunks(run, config['chunk_size']):
+            write_chunk(users, sinks, commission)
+            chunk = run.chunks + 1
+            offsets = {name: sink.commit(chunk) for name, sink in sinks.items()}
+            run.last_user_id = users[-1][0]
+            run.offsets = offsets if run.format == 'csv' else {}
+            run.chunks = chunk
+            run.users += len(users)
+            run.save(update_fields=['last_user_id', 'offsets', 'chunks', 'users'])
+            if on_progress:
+                on_progress(run)
+    finally:
+        for sink in sinks.values():
+            sink.close()
+
+    run.status = 'COMPLETED'
+    run.completed_at = timezone.now()
+    run.save(update_fields=['status', 'completed_at'])
+    return run
@@ -0,0 +1,277 @@
+
+"""
+Portfolio risk analytics.
+
+Daily closes of a portfolio's holdings are aligned into a dates x symbols
+matrix (forward-filled, starting once every symbol has a price) and turned
+into simple returns. Everything that depends only on prices is built once
+per symbol set and bar state -- the covariance matrix, benchmark returns
+and the correlation summary -- and cached as a returns model that
+portfolios holding the same symbols share. Weights are applied afterwards,
+which is a handful of matrix-vector products.
+
+Rolling correlations are computed a block of windows at a time and reduced
+on the spot to what the report shows (the latest matrix and the average
+pairwise correlation of every window), so neither the computation nor the
+cached model ever holds the T x N x N series.
+
+Holdings are valued at their last stored close so that a report depends
+only on the holdings and the bars. Both cache keys are fingerprints of
+exactly those inputs, so a new bar or a changed holding produces a new key
+and nothing has to be invalidated explicitly.
+"""
+
+import hashlib
+from statistics import NormalDist
+
+import numpy as np
+from django.core.cache import cache
+
+from .backtest import TRADING_DAYS
+from .barstore import bar_store, index_symbol, to_datetime
+from .models import MarketIndex, Stock
+
+CONFIDENCE_LEVELS = (0.95, 0.99)
+CACHE_TIMEOUT = 60 * 60 * 24
+# Rolling correlations cost one N x N matrix per day; past this only the
+# latest window is computed
+ROLLING_MAX_SYMBOLS = 100
+# Windows per block of the rolling computation
+ROLLING_BLOCK = 64
+
+
+def fingerprint(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def bar_state(symbols):
+    """
+    (length, last timestamp) per symbol; changes whenever a bar is written
+    """
+    return tuple(
+        (symbol, bar_store.length(symbol), str(bar_store.last_timestamp(symbol))) for symbol in symbols
+    )
+
+
+def aligned_closes(symbols, lookback):
+    """
+    The last ``lookback`` + 1 daily closes of ``symbols`` on a common date
+    axis. Returns (dates, closes) with closes shaped (dates, symbols).
+    """
+    series = [bar_store.query(symbol, interval='1d').tail(lookback * 2 + 1) for symbol in symbols]
+    dates = np.unique(np.concatenate([np.asarray(bars.dates) for bars in series]))
+    closes = np.full((len(dates), len(symbols)), np.nan)
+    for column, bars in enumerate(series):
+        # Forward fill: each date takes the latest close at or before it
+        position = np.searchsorted(bars.dates, dates, 'right') - 1
+        known = position >= 0
+        closes[known, column] = np.asarray(bars.close)[position[known]]
+    complete = ~np.isnan(closes).any(axis=1)
+    dates, closes = dates[complete], closes[complete]
+    return dates[-(lookback + 1):], closes[-(lookback + 1):]
+
+
+def window_correlations(returns, window):
+    """
+    Correlation matrix of every trailing ``window`` of returns, from running
+    sums of the returns and of their outer products. Shape (T - window + 1, N, N).
+    """
+    padded = np.vstack([np.zeros((1, returns.shape[1])), returns])
+    sums = np.cumsum(padded, axis=0)
+    products = np.cumsum(np.einsum('ti,tj->tij', padded, padded), axis=0)
+    window_sums = sums[window:] - sums[:-window]
+    window_products = products[window:] - products[:-window]
+    covariance = (window_products - np.einsum('ti,tj->tij', window_sums, window_sums) / window) / (window - 1)
+    std = np.sqrt(np.clip(np.einsum('tii->ti', covariance), 0, None))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = covariance / np.einsum('ti,tj->tij', std, std)
+    return np.clip(np.nan_to_num(correlation), -1.0, 1.0)
+
+
+def rolling_correlations(returns, window, block=ROLLING_BLOCK):
+    """
+    ``window_correlations`` in blocks of at most ``block`` consecutive
+    windows, each from the running sums over its own rows only
+    """
+    count = len(returns) - window + 1
+    for start in range(0, count, block):
+        yield window_correlations(returns[start:start + min(block, count - start) + window - 1], window)
+
+
+def correlation_summary(returns, window):
+    """
+    The latest window's correlation matrix and the average pairwise
+    correlation of every window
+    """
+    symbols = returns.shape[1]
+    pairs = symbols * (symbols - 1)
+    averages = []
+    for correlations in rolling_correlations(returns, window):
+        averages.append((correlations.sum(axis=(1, 2)) - symbols) / pairs if pairs
+                        else np.ones(len(correlations)))
+        latest = correlations[-1]
+    return latest, np.concatenate(averages)
+
+
+def returns_model(symbols, lookback, window, benchmark):
+    """
+    Price-only statistics for a symbol set, cached by the state of its bars
+    """
+    tracked = list(symbols) + ([index_symbol(benchmark)] if benchmark else [])
+    key = 'risk-model:' + fingerprint(lookback, window, benchmark, bar_state(tracked))
+    model = cache.get(key)
+    if model is not None:
+        return model
+
+    dates, closes = aligned_closes(symbols, lookback)
+    returns = closes[1:] / closes[:-1] - 1
+    model = {
+        'dates': dates[1:],
+        'closes': closes[-1] if len(closes) else np.full(len(symbols), np.nan),
+        'returns': returns,
+        'mean': returns.mean(axis=0) if len(returns) else None,
+        'covariance': np.atleast_2d(np.cov(returns, rowvar=False)) if len(returns) > 1 else None,
+        'correlation': None,
+        'average_correlation': None,
+        'benchmark': None,
+    }
+    if len(returns) >= window > 1:
+        rolling = returns if len(symbols) <= ROLLING_MAX_SYMBOLS else returns[-window:]
+        model['correlation'], model['average_correlation'] = correlation_summary(rolling, window)
+    if benchmark and len(returns) > 1:
+        index_bars = bar_store.query(index_symbol(benchmark), interval='1d')
+        index_dates, index_closes = np.asarray(index_bars.dates), np.asarray(index_bars.close)
+        # Benchmark returns over the same date-to-date steps as the holdings;
+        # NaN before the index history starts
+        position = np.searchsorted(index_dates, dates, 'right') - 1
+        if len(index_dates):
+            levels = np.where(position >= 0, index_closes[np.maximum(position, 0)], np.nan)
+            model['benchmark'] = levels[1:] / levels[:-1] - 1
+    cache.set(key, model, CACHE_TIMEOUT)
+    return model
+
+
+def value_at_risk(portfolio_returns, mean, sigma, value):
+    """
+    Historical and parametric (normal) VaR and CVaR, as positive amounts
+    """
+    result = {'historical': {}, 'parametric': {}}
+    normal = NormalDist()
+    for level in CONFIDENCE_LEVELS:
+        cutoff = np.quantile(portfolio_returns, 1 - level)
+        tail = portfolio_returns[portfolio_returns <= cutoff]
+        z = normal.inv_cdf(1 - level)
+        result['historical'][str(level)] = {
+            'var': round(float(-cutoff * value), 2),
+            'cvar': round(float(-tail.mean() * value), 2),
+        }
+        result['parametric'][str(level)] = {
+            'var': round(float(-(mean + z * sigma) * value), 2),
+            'cvar': round(float(-(mean - sigma * normal.pdf(z) / (1 - level)) * value), 2),
+        }
+    return result
+
+
+def portfolio_risk(portfolio, lookback=TRADING_DAYS, window=60, benchmark=None):
+    """
+    Risk report for a portfolio, cached per portfolio until its holdings or
+    any of the underlying bars change
+    """
+    holdings = list(portfolio.holdings.filter(quantity__gt=0).order_by('stock__symbol')
+                    .values_list('stock__id', 'stock__symbol', 'quantity'))
+    if benchmark is None:
+        benchmark = MarketIndex.objects.order_by('id').values_list('name', flat=True).first()
+    bar_store.sync_many(Stock(id=stock_id, symbol=symbol) for stock_id, symbol, _ in holdings)
+
+    symbols = [symbol for _, symbol, _ in holdings if bar_store.length(symbol)]
+    tracked = symbols + ([index_symbol(benchmark)] if benchmark else [])
+    key = f'risk:{portfolio.id}:' + fingerprint(holdings, lookback, window, benchmark, bar_state(tracked))
+    report = cache.get(key)
+    if report is None:
+        report = build_report(holdings, symbols, lookback, window, benchmark)
+        cache.set(key, report, CACHE_TIMEOUT)
+    return report
+
+
+def build_report(holdings, symbols, lookback, window, benchmark):
+    report = {
+        'asOf': None,
+        'lookback': lookback,
+        'window': window,
+        'benchmark': benchmark,
+        'value': 0.0,
+        'missing': [symbol for _, symbol, _ in holdings if symbol not in symbols],
+        'volatility': None,
+        'beta': None,
+        'valueAtRisk': None,
+        'holdings': [],
+        'correlation': None,
+        'averageCorrelation': [],
+        'drawdown': None,
+    }
+    if not symbols:
+        return report
+    model = returns_model(symbols, lookback, window, benchmark)
+    returns = model['returns']
+    if len(returns) < 2:
+        return report
+
+    quantities = {symbol: quantity for _, symbol, quantity in holdings}
+    values = model['closes'] * np.array([quantities[symbol] for symbol in symbols], dtype=np.float64)
+    value = values.sum()
+    weights = values / value
+    covariance = model['covariance']
+    portfolio_returns = returns @ weights
+    mean = float(model['mean'] @ weights)
+    sigma = float(np.sqrt(max(weights @ covariance @ weights, 0.0)))
+    # Each holding's share of portfolio variance; sums to one
+    contribution = weights * (covariance @ weights) / sigma ** 2 if sigma > 0 else np.zeros(len(symbols))
+
+    betas = np.full(len(symbols), np.nan)
+    portfolio_beta = None
+    if model['benchmark'] is not None:
+        overlap = ~np.isnan(model['benchmark'])
+        market = model['benchmark'][overlap]
+        market_variance = market.var(ddof=1) if len(market) > 1 else 0.0
+        if market_variance > 0:
+            centered = returns[overlap] - returns[overlap].mean(axis=0)
+            betas = centered.T @ (market - market.mean()) / (len(market) - 1) / market_variance
+            portfolio_beta = round(float(weights @ betas), 3)
+
+    equity = np.cumprod(1 + portfolio_returns)
+    drawdown = equity / np.maximum.accumulate(np.maximum(equity, 1.0)) - 1
+    dates = [to_datetime(date) for date in model['dates']]
+
+    report.update({
+        'asOf': dates[-1],
+        'value': round(float(value), 2),
+        'volatility': round(sigma * np.sqrt(TRADING_DAYS) * 100, 2),
+        'beta': portfolio_beta,
+        'valueAtRisk': value_at_risk(portfolio_returns, mean, sigma, value),
+        'holdings': [
+            {
+                'symbol': symbol,
+                'weight': round(float(weights[i]) * 100, 2),
+                'volatility': round(float(np.sqrt(covariance[i, i] * TRADING_DAYS)) * 100, 2),
+                'beta': None if np.isnan(betas[i]) else round(float(betas[i]), 3),
+                'riskContribution': round(float(contribution[i]) * 100, 2),
+            }
+            for i, symbol in enumerate(symbols)
+        ],
+        'drawdown': {
+            'max': round(float(-drawdown.min()) * 100, 2),
+            'series': [{'date': date, 'value': round(float(point) * 100, 2)}
+                       for date, point in zip(dates, drawdown)],
+        },
+    })
+    if model['correlation'] is not None:
+        average = model['average_correlation']
+        report['correlation'] = {
+            'symbols': symbols,
+            'matrix': np.round(model['correlation'], 3).tolist(),
+        }
+        report['averageCorrelation'] = [
+            {'date': date, 'value': round(float(point), 3)}
+            for date, point in zip(dates[-len(average):], average)
+        ]
+    return report
@@ -0,0 +1,288 @@
+
+"""
+Robustness analysis for backtests.
+
+Walk-forward optimization slides an in-sample / out-of-sample window pair
+over the bars: every parameter combination is scored on the in-sample
+bars, the best one is traded on the following out-of-sample bars, and
+the out-of-sample returns are stitched into one equity curve. That curve
+is what the strategy would have earned had it been re-optimized on a
+schedule.
+
+Monte Carlo analysis takes a full-period backtest and resamples it:
+
+* trade sequences -- trade returns drawn with replacement;
+* return paths -- moving-block bootstrap of the per-bar returns, which
+  keeps short-range autocorrelation and volatility clustering.
+
+Paths are built as (paths x bars) index arrays and their metrics computed
+along axis 1, in chunks spread over a process pool. Each chunk gets its own
+child of one ``SeedSequence``, so results depend on the seed only, not on
+the number of workers.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import backtest
+from .sweep import ASCENDING_METRICS, expand_grid
+
+MC_METRICS = ('totalReturn', 'maxDrawdown', 'sharpeRatio')
+
+_worker_bars = None
+
+
+def attach(bars):
+    global _worker_bars
+    _worker_bars = bars
+
+
+def windows(length, train_bars, test_bars):
+    """
+    (train start, test start, test end) triples; the last test window may
+    be short
+    """
+    return [(start, start + train_bars, min(start + train_bars + test_bars, length))
+            for start in range(0, length - train_bars, test_bars)]
+
+
+def score_window(strategy_name, runs, initial_capital, commission, rank_by):
+    """
+    Score (window, start, end, params) runs on their in-sample bars
+    """
+    scores = []
+    for window, start, end, params in runs:
+        metrics = backtest.evaluate(_worker_bars[start:end], strategy_name, params, initial_capital, commission)
+        scores.append((window, params, metrics, metrics.get(rank_by)))
+    return scores
+
+
+def batch_metrics(returns, periods_per_year):
+    """
+    Total return, max drawdown (both in percent) and Sharpe ratio of every
+    row of a (paths x periods) return array
+    """
+    equity = np.cumprod(1.0 + returns, axis=1)
+    peaks = np.maximum.accumulate(equity, axis=1)
+    std = returns.std(axis=1)
+    safe = np.where(std > 0, std, 1.0)
+    return {
+        'totalReturn': (equity[:, -1] - 1.0) * 100,
+        'maxDrawdown': ((peaks - equity) / peaks).max(axis=1) * 100,
+        'sharpeRatio': np.where(std > 0, returns.mean(axis=1) / safe * np.sqrt(periods_per_year), 0.0),
+    }
+
+
+def bootstrap_returns(returns, paths, block_size, seed):
+    """
+    Moving-block bootstrap: (paths x len(returns)) made of random blocks of
+    ``block_size`` consecutive returns
+    """
+    rng = np.random.default_rng(seed)
+    length = len(returns)
+    block_size = min(block_size, length)
+    blocks = -(-length // block_size)
+    starts = rng.integers(0, length - block_size + 1, (paths, blocks))
+    index = (starts[:, :, None] + np.arange(block_size)).reshape(paths, -1)[:, :length]
+    return returns[index]
+
+
+def resample_trades(trade_returns, paths, seed):
+    rng = np.random.default_rng(seed)
+    return trade_returns[rng.integers(0, len(trade_returns), (paths, len(trade_returns)))]
+
+
+def simulate_chunk(kind, values, paths, seed, periods_per_year, block_size):
+    if kind == 'trades':
+        sampled = resample_trades(values, paths, seed)
+    else:
+        sampled = bootstrap_returns(values, paths, block_size, seed)
+    return batch_metrics(sampled, periods_per_year)
+
+
+def summarize(samples, observed, confidence):
+    """
+    Mean, median and the two-sided ``confidence`` interval of each metric
+    """
+    tail = (1.0 - confidence) / 2 * 100
+    summary = {}
+    for name, values in samples.items():
+        low, median, high = np.percentile(values, [tail, 50, 100 - tail])
+        summary[name] = {
+            'observed': observed.get(name),
+            'mean': round(float(values.mean()), 2),
+            'median': round(float(median), 2),
+            'low': round(float(low), 2),
+            'high': round(float(high), 2),
+        }
+    summary['probabilityOfLoss'] = round(float((samples['totalReturn'] < 0).mean()) * 100, 2)
+    return summary
+
+
+class Runner:
+    """
+    Maps chunks over a process pool, or in-process with one worker
+    """
+
+    def __init__(self, bars, max_workers):
+        self.executor = None
+        if max_workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=attach, initargs=(bars,))
+        else:
+            attach(bars)
+
+    def map(self, func, chunks, on_result=None):
+        futures = [self.executor.submit(func, *chunk) for chunk in chunks] if self.executor else None
+        results = []
+        for index, chunk in enumerate(chunks):
+            results.append(futures[index].result() if futures else func(*chunk))
+            if on_result is not None:
+                on_result(len(results), len(chunks))
+        return results
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+
+def walk_forward(runner, bars, strategy_name, params, grid, train_bars, test_bars, rank_by,
+                 initial_capital, commission, chunk_size=16, on_progress=None):
+    """
+    Optimize on each in-sample window, trade the winner out of sample and
+    stitch the out-of-sample returns together
+    """
+    spans = windows(len(bars), train_bars, test_bars)
+    if not spans:
+        raise ValueError(f'Walk-forward needs more than {train_bars} bars, got {len(bars)}')
+    combinations = [{**params, **combo} for combo in expand_grid(grid)] if grid else [params]
+    for combo in combinations[:1]:
+        backtest.resolve_params(strategy_name, combo)
+
+    runs = [(window, start, test_start, combo)
+            for window, (start, test_start, _) in enumerate(spans) for combo in combinations]
+    chunks = [(strategy_name, runs[i:i + chunk_size], initial_capital, commission, rank_by)
+              for i in range(0, len(runs), chunk_size)]
+    sign = -1.0 if rank_by in ASCENDING_METRICS else 1.0
+    best = {}
+    for scores in runner.map(score_window, chunks, on_progress):
+        for window, combo, metrics, score in scores:
+            if score is None:
+                continue
+            # Ties keep the first combination in grid order
+            if window not in best or sign * score > sign * best[window][2]:
+                best[window] = (combo, metrics, score)
+
+    returns, positions, closes, report = [], [], [], []
+    for window, (start, test_start, end) in enumerate(spans):
+        if window not in best:
+            continue
+        combo, in_sample, _ = best[window]
+        func, resolved = backtest.resolve_params(strategy_name, combo)
+        window_bars = bars[start:end]
+        position = func(window_bars, **resolved)
+        segment, equity = backtest.simulate(window_bars.close, position, 1.0, commission,
+                                            backtest.bar_returns(window_bars, strategy_name, resolved))
+        segment, position = segment[test_start - start:], position[test_start - start:]
+        returns.append(segment)
+        positions.append(position)
+        closes.append(bars.close[test_start:end])
+        equity = initial_capital * np.cumprod(1.0 + segment)
+        _, _, pnl, _ = backtest.extract_trades(position, equity, bars.close[test_start:end])
+        report.append({
+            'trainStart': day(bars.dates[start]),
+            'testStart': day(bars.dates[test_start]),
+            'testEnd': day(bars.dates[end - 1]),
+            'params': resolved,
+            'inSample': in_sample,
+            'outOfSample': backtest.compute_metrics(segment, equity, pnl, initial_capital),
+        })
+    if not returns:
+        raise ValueError(f'No parameter combination produced a {rank_by} score')
+
+    returns = np.concatenate(returns)
+    position = np.concatenate(positions)
+    equity = initial_capital * np.cumprod(1.0 + returns)
+    _, _, pnl, _ = backtest.extract_trades(position, equity, np.concatenate(closes))
+    out_of_sample = backtest.compute_metrics(returns, equity, pnl, initial_capital)
+    in_sample = np.mean([window['inSample']['annualizedReturn'] for window in report])
+    return {
+        'trainBars': train_bars,
+        'testBars': test_bars,
+        'rankBy': rank_by,
+        'combinations': len(combinations),
+        'windows': report,
+        'outOfSample': out_of_sample,
+        # Out-of-sample over average in-sample annualized return
+        'efficiency': round(out_of_sample['annualizedReturn'] / in_sample, 2) if in_sample > 0 else None,
+    }
+
+
+def monte_carlo(runner, bars, strategy_name, params, paths, block_size, confidence, seed,
+                initial_capital, commission, chunk_paths=1000, on_progress=None):
+    """
+    Confidence intervals for return, drawdown and Sharpe from resampled
+    trade sequences and bootstrapped return paths
+    """
+    func, params = backtest.resolve_params(strategy_name, params)
+    position = func(bars, **params)
+    returns, equity = backtest.simulate(bars.close, position, initial_capital, commission,
+                                        backtest.bar_returns(bars, strategy_name, params))
+    entries, exits, pnl, _ = backtest.extract_trades(position, equity, bars.close)
+    observed = backtest.compute_metrics(returns, equity, pnl, initial_capital)
+    years = len(bars) / backtest.TRADING_DAYS
+
+    sizes = [min(chunk_paths, paths - done) for done in range(0, paths, chunk_paths)]
+    seeds = np.random.SeedSequence(seed).spawn(2 * len(sizes))
+    trade_returns = equity[exits] / equity[entries] - 1.0
+    chunks = [('returns', returns, size, seeds[i], backtest.TRADING_DAYS, block_size)
+              for i, size in enumerate(sizes)]
+    if len(trade_returns) > 1:
+        chunks += [('trades', trade_returns, size, seeds[len(sizes) + i], len(trade_returns) / years, 0)
+                   for i, size in enumerate(sizes)]
+    results = runner.map(simulate_chunk, chunks, on_progress)
+
+    def merged(kind):
+        parts = [result for chunk, result in zip(chunks, results) if chunk[0] == kind]
+        return {name: np.concatenate([part[name] for part in parts]) for name in MC_METRICS}
+
+    return {
+        'paths': paths,
+        'blockSize': block_size,
+        'confidence': confidence,
+        'observed': observed,
+        'returnPaths': summarize(merged('returns'), observed, confidence),
+        'tradeSequences': summarize(merged('trades'), observed, confidence) if len(trade_returns) > 1 else None,
+    }
+
+
+def day(value):
+    return str(np.datetime_as_string(value, unit='D'))
+
+
+def run_analysis(bars, strategy_name, params=None, grid=None, train_bars=252, test_bars=63,
+                 rank_by='sharpeRatio', paths=2000, block_size=5, confidence=0.9, seed=0,
+                 initial_capital=100000.0, commission=0.0, max_workers=None, on_progress=None):
+    """
+    Walk-forward optimization followed by Monte Carlo analysis of ``params``.
+    ``on_progress(stage, completed, total)`` is called as chunks finish.
+    """
+    params = params or {}
+    runner = Runner(bars, max_workers or os.cpu_count() or 1)
+
+    def progress(stage):
+        if on_progress is None:
+            return None
+        return lambda completed, total: on_progress(stage, completed, total)
+
+    try:
+        return {
+            'strategy': strategy_name,
+            'walkForward': walk_forward(runner, bars, strategy_name, params, grid, train_bars, test_bars,
+                                        rank_by, initial_capital, commission, on_progress=progress('walkForward')),
+            'monteCarlo': monte_carlo(runner, bars, strategy_name, params, paths, block_size, confidence, seed,
+                                      initial_capital, commission, on_progress=progress('monteCarlo')),
+        }
+    finally:
+        runner.close()
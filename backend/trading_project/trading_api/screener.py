@@ -0,0 +1,171 @@
+
+"""
+Cross-sectional market screener.
+
+The latest daily bars of every symbol are stacked into symbols x time
+matrices, right-aligned so the last column is each symbol's newest bar and
+padded with NaN on the left when a history is short. Every factor is then
+computed for the whole universe at once:
+
+* trend: 50-bar over 200-bar average close, minus one
+* momentum_3m / momentum_12m: return over the last 63 / 252 bars
+* volatility: annualized standard deviation of the last 63 log returns
+* high_distance: last close against the 252-bar high, minus one (<= 0)
+* volume_spike: last volume over the average of the 20 before it
+
+A factor whose window reaches into the padding is NaN (stored as NULL).
+The score is the mean percentile rank of trend, both momentums and
+high_distance, with volatility ranked the other way; ranking is
+cross-sectional, so a sharded run is ranked once every shard is stored.
+"""
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching
+from .backtest import TRADING_DAYS
+from .barstore import bar_store, to_datetime
+from .models import ScreenerResult, ScreenerRun, Stock
+
+FACTORS = ['trend', 'momentum_3m', 'momentum_12m', 'volatility', 'high_distance', 'volume_spike']
+# (factor, +1 when higher is better / -1 when lower is better) used for the score
+SCORED = [('trend', 1), ('momentum_3m', 1), ('momentum_12m', 1), ('high_distance', 1), ('volatility', -1)]
+
+
+def load_matrix(stocks, bars):
+    """
+    Stack the last ``bars`` daily bars of ``stocks``; symbols without data
+    are dropped. Returns (stocks, as_of, close, high, volume).
+    """
+    bar_store.sync_many(stocks)
+    close = np.full((len(stocks), bars), np.nan)
+    high = np.full((len(stocks), bars), np.nan)
+    volume = np.full((len(stocks), bars), np.nan)
+    kept, as_of = [], []
+    for stock in stocks:
+        series = bar_store.query(stock.symbol, interval='1d').tail(bars)
+        count = len(series)
+        if count == 0:
+            continue
+        row = len(kept)
+        close[row, bars - count:] = series.close
+        high[row, bars - count:] = series.high
+        volume[row, bars - count:] = series.volume
+        kept.append(stock)
+        as_of.append(to_datetime(series.dates[-1]))
+    rows = len(kept)
+    return kept, as_of, close[:rows], high[:rows], volume[:rows]
+
+
+def window_mean(matrix, start, stop=None):
+    # NaN padding propagates, so a window that is not full yields NaN
+    return matrix[:, start:stop].mean(axis=1)
+
+
+def compute_factors(close, high, volume):
+    """
+    Factor columns for every row of the matrices, in one vectorized pass
+    """
+    bars = close.shape[1]
+    empty = np.full(close.shape[0], np.nan)
+    last = close[:, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factors = {
+            'trend': window_mean(close, -50) / window_mean(close, -200) - 1 if bars >= 200 else empty,
+            'momentum_3m': last / close[:, -64] - 1 if bars > 63 else empty,
+            'momentum_12m': last / close[:, -253] - 1 if bars > 252 else empty,
+            'volatility': (np.diff(np.log(close[:, -64:]), axis=1).std(axis=1, ddof=1) * np.sqrt(TRADING_DAYS)
+                           if bars > 63 else empty),
+            'high_distance': last / high[:, -252:].max(axis=1) - 1 if bars >= 252 else empty,
+            'volume_spike': volume[:, -1] / window_mean(volume, -21, -1) if bars > 20 else empty,
+        }
+    for name, values in factors.items():
+        values[~np.isfinite(values)] = np.nan
+    return factors
+
+
+def percentile_ranks(values):
+    """
+    Rank in [0, 1] among the non-NaN values; NaN stays NaN
+    """
+    ranks = np.full(len(values), np.nan)
+    valid = ~np.isnan(values)
+    count = int(valid.sum())
+    if count == 1:
+        ranks[valid] = 0.5
+    elif count > 1:
+        ranks[valid] = values[valid].argsort(kind='stable').argsort(kind='stable') / (count - 1)
+    return ranks
+
+
+def score_factors(factors):
+    """
+    Composite score and 1-based rank (best first); None where no factor is known
+    """
+    ranks = np.vstack([
+        percentile_ranks(factors[name]) if direction > 0 else 1 - percentile_ranks(factors[name])
+        for name, direction in SCORED
+    ])
+    known = (~np.isnan(ranks)).sum(axis=0)
+    score = np.where(known > 0, np.nansum(ranks, axis=0) / np.maximum(known, 1), np.nan)
+    rank = np.full(len(score), np.nan)
+    valid = ~np.isnan(score)
+    rank[np.flatnonzero(valid)[np.argsort(-score[valid], kind='stable')]] = np.arange(1, int(valid.sum()) + 1)
+    return score, rank
+
+
+def nullable(value):
+    return None if np.isnan(value) else float(value)
+
+
+def screen(run, stock_ids, ranked=False):
+    """
+    Compute and store factors for ``stock_ids`` under ``run``. With
+    ``ranked`` the ids are the whole universe and rows are scored as well.
+    """
+    stocks = list(Stock.objects.filter(id__in=stock_ids).order_by('id').only('id', 'symbol'))
+    stocks, as_of, close, high, volume = load_matrix(stocks, run.bars)
+    factors = compute_factors(close, high, volume)
+    score, rank = score_factors(factors) if ranked else (np.full(len(stocks), np.nan),) * 2
+    ScreenerResult.objects.bulk_create([
+        ScreenerResult(
+            run=run, stock=stock, as_of=as_of[row], close=float(close[row, -1]),
+            score=nullable(score[row]), rank=None if np.isnan(rank[row]) else int(rank[row]),
+            **{name: nullable(factors[name][row]) for name in FACTORS}
+        )
+        for row, stock in enumerate(stocks)
+    ], batch_size=2000)
+    return len(stocks)
+
+
+def rank_run(run):
+    """
+    Score the stored rows of a sharded run across the whole universe
+    """
+    rows = list(ScreenerResult.objects.filter(run=run).order_by('id').values_list('id', *FACTORS))
+    if rows:
+        columns = np.array([row[1:] for row in rows], dtype=np.float64)
+        score, rank = score_factors({name: columns[:, index] for index, name in enumerate(FACTORS)})
+        ScreenerResult.objects.bulk_update([
+            ScreenerResult(id=row[0], score=nullable(score[index]),
+                           rank=None if np.isnan(rank[index]) else int(rank[index]))
+            for index, row in enumerate(rows)
+        ], ['score', 'rank'], batch_size=1000)
+    return len(rows)
+
+
+def complete_run(run, symbols):
+    """
+    Publish a finished run and drop the oldest ones beyond SCREENER['keep_runs']
+    """
+    with transaction.atomic():
+        run.status = 'COMPLETED'
+        run.symbols = symbols
+        run.completed_at = timezone.now()
+        run.save(update_fields=['status', 'symbols', 'completed_at'])
+        stale = (ScreenerRun.objects.filter(status='COMPLETED').order_by('-completed_at')
+                 .values_list('id', flat=True)[settings.SCREENER['keep_runs']:])
+        ScreenerRun.objects.filter(id__in=list(stale)).delete()
+    caching.bump(caching.SCREENER)
@@ -0,0 +1,294 @@
+
+"""
+In-memory symbol search.
+
+Every process keeps an index over ``Stock.symbol`` and the words of
+``Stock.name``:
+
+* prefix index -- all search keys (the lower-cased symbol and each name
+  word) in one sorted array, i.e. the leaf order of a trie, so the keys
+  under any prefix are one contiguous range found with two binary
+  searches;
+* trigram index -- trigram -> array of entries, for typo-tolerant
+  matches when the prefixes do not fill the page.
+
+Prefix matches rank exact symbols first, then symbol prefixes, then name
+word prefixes; within a tier (and for trigram matches, after similarity)
+by market cap, or traded value (volume x price) where no market cap is
+known. Candidates are scored with array operations, so a query costs a
+few binary searches and a sort of its matches.
+
+Searches read an immutable state that a refresh swaps in whole. A search
+checks the ``stocks`` response-cache version at most every
+``REFRESH_SECONDS``; when it has moved, a background thread re-reads the
+stocks and rebuilds only the keys and trigrams of added, renamed or
+removed entries (ranks are replaced wholesale). Searches meanwhile keep
+using the previous state. While the cache is unreachable every check
+counts as a change.
+"""
+
+import re
+import threading
+import time
+
+import numpy as np
+from django.db import connection
+
+from .caching import STOCKS, namespace_version
+from .models import Stock
+
+REFRESH_SECONDS = 5
+# Share of a query's trigrams an entry must contain to count as a match
+MIN_SIMILARITY = 0.5
+
+SYMBOL, NAME = 0, 1
+WORD = re.compile(r'[0-9a-z]+')
+
+
+def words(text):
+    return list(dict.fromkeys(WORD.findall((text or '').lower())))
+
+
+def trigrams(terms):
+    grams = set()
+    for term in terms:
+        padded = f'  {term} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def entry_keys(symbol, name):
+    symbol = symbol.lower()
+    return [(symbol, SYMBOL)] + [(word, NAME) for word in words(name) if word != symbol]
+
+
+def rank_scores(volume, price, market_cap):
+    volume, price, market_cap = (np.asarray(values, dtype=np.float64) for values in (volume, price, market_cap))
+    return np.where(np.nan_to_num(market_cap) > 0, market_cap, volume * price)
+
+
+class IndexState:
+    """
+    One immutable generation of the index
+    """
+
+    def __init__(self, ids, symbols, names, sectors, scores, keys, key_slots, key_kinds, grams, gram_counts):
+        self.ids = ids
+        self.symbols = symbols
+        self.names = names
+        self.sectors = sectors
+        self.scores = scores
+        self.keys = keys
+        self.key_slots = key_slots
+        self.key_kinds = key_kinds
+        self.grams = grams
+        self.gram_counts = gram_counts
+        self.slots = {stock_id: slot for slot, stock_id in enumerate(ids) if stock_id is not None}
+        # Position of every entry in descending score order, and the most keys
+        # one entry has (bounds how many range entries hold `limit` stocks)
+        self.ranks = np.empty(len(ids), dtype=np.int64)
+        self.ranks[np.argsort(-scores, kind='stable')] = np.arange(len(ids))
+        self.max_keys = int(np.bincount(key_slots).max()) if len(key_slots) else 1
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], np.empty(0), np.empty(0, dtype='<U1'), np.empty(0, dtype=np.int64),
+                   np.empty(0, dtype=np.int8), {}, np.empty(0, dtype=np.int64))
+
+    def prefix(self, term):
+        """
+        The range of keys starting with ``term``; needles keep the keys' width
+        so the keys are never cast
+        """
+        width = self.keys.dtype.itemsize // 4
+        if len(term) > width:
+            return 0, 0
+        needles = np.array([term, term.ljust(width, '\U0010ffff')], dtype=self.keys.dtype)
+        return np.searchsorted(self.keys, needles[0], 'left'), np.searchsorted(self.keys, needles[1], 'right')
+
+    def entry(self, slot, match):
+        return {
+            'id': self.ids[slot],
+            'symbol': self.symbols[slot],
+            'name': self.names[slot],
+            'sector': self.sectors[slot],
+            'match': match,
+        }
+
+
+def rebuild(state, rows):
+    """
+    New state for the full current list of ``rows`` (id, symbol, name,
+    sector, volume, price, market cap); only entries whose text changed
+    touch the prefix and trigram indexes
+    """
+    ids, symbols, names, sectors = list(state.ids), list(state.symbols), list(state.names), list(state.sectors)
+    seen, changed = set(), {}
+    for stock_id, symbol, name, sector, *_ in rows:
+        seen.add(stock_id)
+        slot = state.slots.get(stock_id)
+        if slot is None:
+            slot = len(ids)
+            ids.append(stock_id)
+            symbols.append(None)
+            names.append(None)
+            sectors.append(None)
+        elif symbols[slot] == symbol and names[slot] == name:
+            sectors[slot] = sector
+            continue
+        changed[slot] = (symbol, name)
+        sectors[slot] = sector
+    removed = [slot for stock_id, slot in state.slots.items() if stock_id not in seen]
+
+    scores = np.zeros(len(ids))
+    if rows:
+        slots = np.array([state.slots.get(row[0], -1) for row in rows])
+        fresh = slots < 0
+        slots[fresh] = len(state.ids) + np.arange(fresh.sum())
+        _, _, _, _, volume, price, market_cap = zip(*rows)
+        scores[slots] = rank_scores(volume, price, [value if value is not None else np.nan for value in market_cap])
+    scores[removed] = -np.inf
+
+    touched = list(changed) + removed
+    if not touched:
+        return IndexState(ids, symbols, names, sectors, scores, state.keys, state.key_slots, state.key_kinds,
+                          state.grams, state.gram_counts)
+
+    # Drop the old keys and trigrams of touched entries, then add the new ones
+    keep = ~np.isin(state.key_slots, touched)
+    keys, key_slots, key_kinds = state.keys[keep], state.key_slots[keep], state.key_kinds[keep]
+    grams = dict(state.grams)
+    stale = {}
+    for slot in touched:
+        if slot < len(state.symbols):
+            for gram in trigrams([term for term, _ in entry_keys(state.symbols[slot], state.names[slot])]):
+                stale.setdefault(gram, []).append(slot)
+    for gram, slots in stale.items():
+        remaining = grams[gram][~np.isin(grams[gram], slots)]
+        if len(remaining):
+            grams[gram] = remaining
+        else:
+            del grams[gram]
+
+    gram_counts = np.zeros(len(ids), dtype=np.int64)
+    gram_counts[:len(state.gram_counts)] = state.gram_counts
+    new_keys, added = [], {}
+    for slot, (symbol, name) in changed.items():
+        symbols[slot], names[slot] = symbol, name
+        terms = entry_keys(symbol, name)
+        new_keys += [(term, slot, kind) for term, kind in terms]
+        slot_grams = trigrams([term for term, _ in terms])
+        gram_counts[slot] = len(slot_grams)
+        for gram in slot_grams:
+            added.setdefault(gram, []).append(slot)
+    for slot in removed:
+        ids[slot] = symbols[slot] = names[slot] = sectors[slot] = None
+        gram_counts[slot] = 0
+    for gram, slots in added.items():
+        slots = np.array(slots, dtype=np.int64)
+        grams[gram] = np.concatenate([grams[gram], slots]) if gram in grams else slots
+
+    if new_keys:
+        new_keys.sort()
+        terms = np.array([term for term, _, _ in new_keys])
+        width = max(keys.dtype.itemsize, terms.dtype.itemsize) // 4
+        keys = keys.astype(f'<U{width}')
+        at = np.searchsorted(keys, terms)
+        keys = np.insert(keys, at, terms)
+        key_slots = np.insert(key_slots, at, [slot for _, slot, _ in new_keys])
+        key_kinds = np.insert(key_kinds, at, [kind for _, _, kind in new_keys])
+    return IndexState(ids, symbols, names, sectors, scores, keys, key_slots, key_kinds, grams, gram_counts)
+
+
+class SymbolIndex:
+    """
+    The process-wide search index over all stocks
+    """
+
+    def __init__(self):
+        self.state = None
+        self.version = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def load(self, rows):
+        """
+        Bring the index up to date with ``rows``; returns the new state
+        """
+        with self.lock:
+            self.state = rebuild(self.state or IndexState.empty(), rows)
+            return self.state
+
+    def fetch(self):
+        return list(Stock.objects.values_list('id', 'symbol', 'name', 'sector', 'volume', 'current_price',
+                                              'market_cap').iterator(chunk_size=10000))
+
+    def refresh(self, version=None, background=False):
+        try:
+            self.load(self.fetch())
+            self.version = version
+        finally:
+            self.refreshing = False
+            if background:
+                connection.close()
+
+    def current(self):
+        """
+        The state to search: built on first use, refreshed in the background
+        once the stocks have changed
+        """
+        if self.state is None:
+            self.refresh(namespace_version(STOCKS))
+            self.checked_at = time.monotonic()
+            return self.state
+        now = time.monotonic()
+        if now - self.checked_at >= REFRESH_SECONDS and not self.refreshing:
+            self.checked_at = now
+            version = namespace_version(STOCKS)
+            if version is None or version != self.version:
+                self.refreshing = True
+                thread = threading.Thread(target=self.refresh, args=(version, True), name='symbol-index', daemon=True)
+                thread.start()
+        return self.state
+
+    def search(self, query, limit=10, state=None):
+        state = state or self.current()
+        terms = words(query)
+        if not terms or not len(state.keys):
+            return []
+
+        lo, hi = state.prefix(terms[0])
+        slots = state.key_slots[lo:hi]
+        tiers = np.where(state.key_kinds[lo:hi] == SYMBOL, np.where(state.keys[lo:hi] == terms[0], 0, 1), 2)
+        for term in terms[1:]:
+            lo, hi = state.prefix(term)
+            also = np.isin(slots, state.key_slots[lo:hi])
+            slots, tiers = slots[also], np.maximum(tiers[also], 2)
+        # Tier first, then score; only the best limit x max_keys entries can
+        # hold the first `limit` distinct stocks, so the rest is never sorted
+        order = tiers * len(state.ids) + state.ranks[slots]
+        best = limit * state.max_keys
+        candidates = np.argpartition(order, best)[:best] if len(order) > best else np.arange(len(order))
+        candidates = candidates[np.argsort(order[candidates])]
+        _, first = np.unique(slots[candidates], return_index=True)
+        ranked = candidates[np.sort(first)][:limit]
+        matches = ('symbol', 'symbol', 'name')
+        results = [state.entry(slots[i], matches[tiers[i]]) for i in ranked]
+
+        query_grams = trigrams(terms)
+        if len(results) < limit and sum(map(len, terms)) >= 3:
+            arrays = [state.grams[gram] for gram in query_grams if gram in state.grams]
+            if arrays:
+                counts = np.bincount(np.concatenate(arrays), minlength=len(state.ids))
+                counts[slots] = 0
+                candidates = np.flatnonzero(counts >= MIN_SIMILARITY * len(query_grams))
+                # Share of the query found, then the share of the entry it covers
+                coverage = counts[candidates] / len(query_grams)
+                precision = counts[candidates] / np.maximum(state.gram_counts[candidates], 1)
+                order = np.lexsort((-state.scores[candidates], -precision, -coverage))
+                results += [state.entry(slot, 'fuzzy') for slot in candidates[order][:limit - len(results)]]
+        return results
+
+
+symbol_index = SymbolIndex()
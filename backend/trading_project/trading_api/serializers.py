@@ -1,7 +1,21 @@
 
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Stock, MarketIndex, HistoricalData, Portfolio, Holding, Order, Watchlist, UserProfile
+from .models import (
+    Stock, MarketIndex, HistoricalData, Portfolio, Holding, Order, Watchlist, UserProfile,
+    ScreenerRun, ScreenerResult, PortfolioSnapshot
+)
+from .backtest import STRATEGIES, PERIODS
+from .barstore import INTERVALS
+from .options import MODELS
+from .renderers import Columns
+from .screener import FACTORS
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -23,6 +37,163 @@ class HistoricalDataSerializer(serializers.ModelSerializer):
         model = HistoricalData
         fields = '__all__'
 
+class HistoricalDataQuerySerializer(serializers.Serializer):
+    # Chart range presets: how far back from the last bar (or which calendar
+    # period it falls in), and the default candle
+    TIMEFRAMES = {
+        '1D': ('session', '5m'),
+        '1W': (timedelta(days=7), '1h'),
+        '1M': (timedelta(days=30), '1d'),
+        '3M': (timedelta(days=91), '1d'),
+        '6M': (timedelta(days=182), '1d'),
+        'YTD': ('year', '1d'),
+        '1Y': (timedelta(days=365), '1d'),
+        '5Y': (timedelta(days=5 * 365), '1w'),
+    }
+    MAX_BARS = 10000
+    
+    timeframe = serializers.ChoiceField(choices=list(TIMEFRAMES), default='1D')
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    interval = serializers.ChoiceField(choices=list(INTERVALS), required=False)
+    
+    def validate(self, data):
+        if 'start' in data and 'end' in data and data['start'] > data['end']:
+            raise serializers.ValidationError({"start": "start must not be after end"})
+        return data
+        
+    def resolve_range(self, last_bar):
+        """
+        Fill in start, end and interval from the timeframe preset, anchored
+        at the most recent stored bar
+        """
+        data = self.validated_data
+        span, default_interval = self.TIMEFRAMES[data['timeframe']]
+        end = data.get('end', last_bar)
+        start = data.get('start')
+        if start is None:
+            if span == 'session':
+                start = end.replace(hour=0, minute=0, second=0, microsecond=0)
+            elif span == 'year':
+                start = end.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+            else:
+                start = end - span
+        return start, end, data.get('interval', default_interval)
+
+class RiskQuerySerializer(serializers.Serializer):
+    lookback = serializers.IntegerField(min_value=20, max_value=5 * 252, default=252)
+    window = serializers.IntegerField(min_value=5, max_value=252, default=60)
+    benchmark = serializers.SlugRelatedField(slug_field='name', queryset=MarketIndex.objects.all(),
+                                             required=False)
+    
+    def validate(self, data):
+        if data['window'] > data['lookback']:
+            raise serializers.ValidationError({"window": "window must not exceed lookback"})
+        return data
+
+class OptionPricingSerializer(serializers.Serializer):
+    rate = serializers.FloatField(min_value=-0.1, max_value=1, required=False)
+    dividend = serializers.FloatField(min_value=0, max_value=1, default=0)
+    model = serializers.ChoiceField(choices=MODELS, default='black-scholes')
+    
+    def validate(self, data):
+        data.setdefault('rate', settings.OPTION_PRICING['rate'])
+        return data
+
+class OptionChainQuerySerializer(OptionPricingSerializer):
+    DEFAULT_EXPIRIES = [7, 14, 30, 60, 90, 180, 365]
+    MAX_CONTRACTS = 10000
+    
+    expiries = serializers.CharField(required=False, help_text='Comma-separated days to expiry')
+    strikes = serializers.IntegerField(min_value=0, max_value=500, default=10, help_text='Strikes either side of spot')
+    step = serializers.FloatField(min_value=0.001, max_value=0.5, default=0.025, help_text='Strike spacing over spot')
+    volatility = serializers.FloatField(min_value=0.001, max_value=5, required=False)
+    
+    def validate_expiries(self, value):
+        try:
+            days = sorted({int(day) for day in value.split(',') if day.strip()})
+        except ValueError:
+            raise serializers.ValidationError("expiries must be whole days")
+        if not days or days[0] < 1:
+            raise serializers.ValidationError("expiries must be positive days")
+        return days
+        
+    def validate(self, data):
+        data = super().validate(data)
+        data.setdefault('expiries', self.DEFAULT_EXPIRIES)
+        contracts = 2 * len(data['expiries']) * (2 * data['strikes'] + 1)
+        if contracts > self.MAX_CONTRACTS:
+            raise serializers.ValidationError(f"Chain has {contracts} contracts; at most {self.MAX_CONTRACTS}")
+        return data
+        
+    def strike_prices(self, spot):
+        data = self.validated_data
+        offsets = np.arange(-data['strikes'], data['strikes'] + 1) * data['step']
+        strikes = np.unique(np.round(spot * (1 + offsets), 2))
+        return strikes[strikes > 0]
+
+class OptionContractSerializer(serializers.Serializer):
+    strike = serializers.FloatField(min_value=0.01)
+    days = serializers.IntegerField(min_value=1)
+    type = serializers.ChoiceField(choices=['CALL', 'PUT'])
+    price = serializers.FloatField(min_value=0)
+
+class ImpliedVolatilitySerializer(OptionPricingSerializer):
+    underlying = serializers.FloatField(min_value=0.01, required=False)
+    contracts = OptionContractSerializer(many=True, allow_empty=False, max_length=OptionChainQuerySerializer.MAX_CONTRACTS)
+
+class SnapshotQuerySerializer(serializers.Serializer):
+    kind = serializers.ChoiceField(choices=PortfolioSnapshot.SNAPSHOT_KINDS, default='EOD')
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    
+    def validate(self, data):
+        if 'start' in data and 'end' in data and data['start'] > data['end']:
+            raise serializers.ValidationError({"start": "start must not be after end"})
+        return data
+    
+    def filter(self, snapshots):
+        data = self.validated_data
+        snapshots = snapshots.filter(kind=data['kind'])
+        if 'start' in data:
+            snapshots = snapshots.filter(timestamp__gte=data['start'])
+        if 'end' in data:
+            snapshots = snapshots.filter(timestamp__lte=data['end'])
+        return snapshots.order_by('timestamp')
+
+def bars_to_representation(stock, bars):
+    """
+    Render store bars in the same shape as ``HistoricalDataSerializer``
+    """
+    dates = np.datetime_as_string(bars.dates, unit='s')
+    columns = zip(dates.tolist(), bars.open.tolist(), bars.high.tolist(),
+                  bars.low.tolist(), bars.close.tolist(), bars.volume.tolist())
+    return [
+        {
+            'stock': stock.pk,
+            'date': f"{date}Z",
+            'open_price': f"{open_price:.2f}",
+            'high_price': f"{high_price:.2f}",
+            'low_price': f"{low_price:.2f}",
+            'close_price': f"{close_price:.2f}",
+            'volume': volume,
+        }
+        for date, open_price, high_price, low_price, close_price, volume in columns
+    ]
+
+def bars_to_columns(stock, bars, interval=None):
+    """
+    Store bars as parallel arrays, for the columnar renderers
+    """
+    return Columns({
+        'date': bars.dates,
+        'open_price': np.round(bars.open, 2),
+        'high_price': np.round(bars.high, 2),
+        'low_price': np.round(bars.low, 2),
+        'close_price': np.round(bars.close, 2),
+        'volume': bars.volume,
+    }, stock=stock.pk, symbol=stock.symbol, interval=interval)
+
 class HoldingSerializer(serializers.ModelSerializer):
     symbol = serializers.CharField(source='stock.symbol', read_only=True)
     name = serializers.CharField(source='stock.name', read_only=True)
@@ -41,19 +212,33 @@ class PortfolioSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'holdings', 'total_value', 'created_at', 'last_modified']
         
     def get_total_value(self, obj):
-        total = 0
-        for holding in obj.holdings.all():
-            total += holding.quantity * holding.stock.current_price
-        return total
+        # Annotated by PortfolioQuerySet.with_totals(); fall back to one aggregate query
+        if hasattr(obj, 'total_value'):
+            return obj.total_value
+        return Portfolio.objects.with_totals().get(pk=obj.pk).total_value
+
+class PortfolioSnapshotSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PortfolioSnapshot
+        fields = ['timestamp', 'value', 'cash', 'invested', 'realized_pnl', 'unrealized_pnl']
 
 class OrderSerializer(serializers.ModelSerializer):
     symbol = serializers.CharField(source='stock.symbol', read_only=True)
+    parent = serializers.PrimaryKeyRelatedField(read_only=True)
     
     class Meta:
         model = Order
         fields = ['id', 'symbol', 'order_type', 'quantity', 'price', 'status', 
-                  'timestamp', 'executed_at', 'stoploss', 'target']
+                  'timestamp', 'executed_at', 'stoploss', 'target', 'parent']
         
+class OrderQuerySerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Order.ORDER_STATUS, required=False)
+    
+    def filter(self, orders):
+        if 'status' in self.validated_data:
+            orders = orders.filter(status=self.validated_data['status'])
+        return orders
+
 class OrderCreateSerializer(serializers.ModelSerializer):
     symbol = serializers.CharField(write_only=True)
     
@@ -78,6 +263,59 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         )
         return order
 
+class OrderBatchSerializer(serializers.Serializer):
+    MAX_ORDERS = 1000
+    
+    orders = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=MAX_ORDERS)
+    
+    def place(self, portfolio):
+        """
+        Validate every order against one symbol lookup and insert the valid
+        ones in a single transaction. Returns one result per order, in
+        request order.
+        """
+        items = self.validated_data['orders']
+        stocks = dict(Stock.objects.filter(symbol__in={str(item.get('symbol', '')) for item in items})
+                      .values_list('symbol', 'id'))
+        item_serializer = OrderCreateSerializer()
+        results, accepted = [], []
+        for index, item in enumerate(items):
+            try:
+                data = item_serializer.run_validation(item)
+            except serializers.ValidationError as exc:
+                results.append({'index': index, 'status': 'rejected', 'errors': exc.detail})
+                continue
+            symbol = data.pop('symbol')
+            if symbol not in stocks:
+                results.append({'index': index, 'status': 'rejected',
+                                'errors': {'symbol': [f"Stock with symbol {symbol} does not exist"]}})
+                continue
+            order = Order(portfolio=portfolio, stock_id=stocks[symbol], **data)
+            results.append({'index': index, 'status': 'created', 'order': order})
+            accepted.append(order)
+        
+        with transaction.atomic():
+            Order.objects.bulk_create(accepted, batch_size=1000)
+        for result in results:
+            if 'order' in result:
+                result['id'] = result.pop('order').id
+        return results
+
+class OrderCancelAllSerializer(serializers.Serializer):
+    symbol = serializers.CharField(required=False)
+    order_type = serializers.ChoiceField(choices=Order.ORDER_TYPES, required=False)
+    
+    def cancel(self, portfolio):
+        """
+        Cancel the matching pending orders with one conditional UPDATE
+        """
+        orders = Order.objects.filter(portfolio=portfolio, status='PENDING')
+        if 'symbol' in self.validated_data:
+            orders = orders.filter(stock__symbol=self.validated_data['symbol'])
+        if 'order_type' in self.validated_data:
+            orders = orders.filter(order_type=self.validated_data['order_type'])
+        return orders.update(status='CANCELLED')
+
 class WatchlistSerializer(serializers.ModelSerializer):
     stocks = StockSerializer(many=True, read_only=True)
     stock_symbols = serializers.ListField(
@@ -92,18 +330,9 @@ class WatchlistSerializer(serializers.ModelSerializer):
         
     def create(self, validated_data):
         symbols = validated_data.pop('stock_symbols', [])
-        watchlist = Watchlist.objects.create(
-            user=self.context['request'].user,
-            **validated_data
-        )
-        
-        for symbol in symbols:
-            try:
-                stock = Stock.objects.get(symbol=symbol)
-                watchlist.stocks.add(stock)
-            except Stock.DoesNotExist:
-                pass
-                
+        validated_data['user'] = self.context['request'].user
+        watchlist = Watchlist.objects.create(**validated_data)
+        watchlist.set_symbols(symbols, existing=())
         return watchlist
         
     def update(self, instance, validated_data):
@@ -112,14 +341,7 @@ class WatchlistSerializer(serializers.ModelSerializer):
         instance.save()
         
         if symbols is not None:
-            # Clear existing stocks and add new ones
-            instance.stocks.clear()
-            for symbol in symbols:
-                try:
-                    stock = Stock.objects.get(symbol=symbol)
-                    instance.stocks.add(stock)
-                except Stock.DoesNotExist:
-                    pass
+            instance.set_symbols(symbols)
                     
         return instance
 
@@ -130,3 +352,129 @@ class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = ['id', 'username', 'email', 'initial_capital', 'risk_profile']
+
+class BacktestRequestSerializer(serializers.Serializer):
+    symbol = serializers.CharField()
+    strategy = serializers.ChoiceField(choices=[])
+    timeframe = serializers.ChoiceField(choices=[], default='1Y')
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    initial_capital = serializers.FloatField(min_value=1, default=100000)
+    commission = serializers.FloatField(min_value=0, max_value=0.1, default=0)
+    params = serializers.DictField(child=serializers.FloatField(), required=False, default=dict)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['strategy'].choices = sorted(STRATEGIES)
+        self.fields['timeframe'].choices = list(PERIODS)
+        
+    def validate(self, data):
+        _, defaults = STRATEGIES[data['strategy']]
+        unknown = set(data['params']) - set(defaults)
+        if unknown:
+            raise serializers.ValidationError({"params": f"Unknown parameters: {', '.join(sorted(unknown))}"})
+        return data
+
+class SweepRequestSerializer(serializers.Serializer):
+    RANK_METRICS = ['sharpeRatio', 'totalReturn', 'annualizedReturn', 'maxDrawdown', 'winRate', 'profitFactor']
+    
+    strategy = serializers.ChoiceField(choices=[])
+    symbols = serializers.ListField(child=serializers.CharField(), min_length=1)
+    grid = serializers.DictField(child=serializers.ListField(child=serializers.FloatField(), min_length=1))
+    timeframe = serializers.ChoiceField(choices=[], default='1Y')
+    rank_by = serializers.ChoiceField(choices=RANK_METRICS, default='sharpeRatio')
+    max_workers = serializers.IntegerField(min_value=1, required=False)
+    initial_capital = serializers.FloatField(min_value=1, default=100000)
+    commission = serializers.FloatField(min_value=0, max_value=0.1, default=0)
+    top_n = serializers.IntegerField(min_value=1, max_value=500, default=20)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['strategy'].choices = sorted(STRATEGIES)
+        self.fields['timeframe'].choices = list(PERIODS)
+        
+    def validate(self, data):
+        _, defaults = STRATEGIES[data['strategy']]
+        unknown = set(data['grid']) - set(defaults)
+        if unknown:
+            raise serializers.ValidationError({"grid": f"Unknown parameters: {', '.join(sorted(unknown))}"})
+        return data
+
+class RobustnessRequestSerializer(serializers.Serializer):
+    symbol = serializers.CharField()
+    strategy = serializers.ChoiceField(choices=[])
+    timeframe = serializers.ChoiceField(choices=[], default='3Y')
+    params = serializers.DictField(child=serializers.FloatField(), required=False, default=dict)
+    grid = serializers.DictField(child=serializers.ListField(child=serializers.FloatField(), min_length=1),
+                                 required=False, default=dict)
+    train_bars = serializers.IntegerField(min_value=20, default=252)
+    test_bars = serializers.IntegerField(min_value=5, default=63)
+    rank_by = serializers.ChoiceField(choices=SweepRequestSerializer.RANK_METRICS, default='sharpeRatio')
+    paths = serializers.IntegerField(min_value=100, max_value=50000, default=2000)
+    block_size = serializers.IntegerField(min_value=1, max_value=63, default=5)
+    confidence = serializers.FloatField(min_value=0.5, max_value=0.99, default=0.9)
+    seed = serializers.IntegerField(min_value=0, default=0)
+    max_workers = serializers.IntegerField(min_value=1, required=False)
+    initial_capital = serializers.FloatField(min_value=1, default=100000)
+    commission = serializers.FloatField(min_value=0, max_value=0.1, default=0)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['strategy'].choices = sorted(STRATEGIES)
+        self.fields['timeframe'].choices = list(PERIODS)
+        
+    def validate(self, data):
+        _, defaults = STRATEGIES[data['strategy']]
+        for field in ('params', 'grid'):
+            unknown = set(data[field]) - set(defaults)
+            if unknown:
+                raise serializers.ValidationError({field: f"Unknown parameters: {', '.join(sorted(unknown))}"})
+        return data
+
+class ScreenerRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScreenerRun
+        fields = ['id', 'status', 'bars', 'symbols', 'shards', 'created_at', 'completed_at']
+
+class ScreenerResultSerializer(serializers.ModelSerializer):
+    symbol = serializers.CharField(source='stock.symbol', read_only=True)
+    name = serializers.CharField(source='stock.name', read_only=True)
+    sector = serializers.CharField(source='stock.sector', read_only=True)
+    
+    class Meta:
+        model = ScreenerResult
+        fields = ['rank', 'score', 'symbol', 'name', 'sector', 'as_of', 'close'] + FACTORS
+
+class ScreenerQuerySerializer(serializers.Serializer):
+    """
+    ``ordering`` by rank or any factor (prefix '-' for descending), an
+    optional ``sector`` and ``min_<factor>``/``max_<factor>`` bounds
+    """
+    ORDERINGS = ['rank', 'score'] + FACTORS
+    MAX_LIMIT = 500
+    
+    run = serializers.IntegerField(required=False)
+    sector = serializers.CharField(required=False)
+    ordering = serializers.ChoiceField(
+        choices=ORDERINGS + ['-' + name for name in ORDERINGS], default='rank')
+    limit = serializers.IntegerField(min_value=1, max_value=MAX_LIMIT, default=50)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in FACTORS:
+            self.fields[f'min_{name}'] = serializers.FloatField(required=False)
+            self.fields[f'max_{name}'] = serializers.FloatField(required=False)
+    
+    def filter(self, results):
+        data = self.validated_data
+        if 'sector' in data:
+            results = results.filter(stock__sector=data['sector'])
+        for name in FACTORS:
+            if f'min_{name}' in data:
+                results = results.filter(**{f'{name}__gte': data[f'min_{name}']})
+            if f'max_{name}' in data:
+                results = results.filter(**{f'{name}__lte': data[f'max_{name}']})
+        field = data['ordering'].lstrip('-')
+        # Rows missing the sort key go last either way
+        order = F(field).desc(nulls_last=True) if data['ordering'].startswith('-') else F(field).asc(nulls_last=True)
+        return results.order_by(order, 'id')[:data['limit']]
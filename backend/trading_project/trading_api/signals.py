@@ -0,0 +1,11 @@
+
+from django.dispatch import Signal
+
+# Sent by the market data write path after a batch is committed.
+# quotes_updated: prices={symbol: Decimal price}, timestamp=datetime,
+# replay=True for historical replay ticks (matched by the replay's own engine)
+quotes_updated = Signal()
+# bars_updated: symbols=set of symbols whose HistoricalData changed
+bars_updated = Signal()
+# indices_updated: names=set of MarketIndex names that were written
+indices_updated = Signal()
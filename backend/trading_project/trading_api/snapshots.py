@@ -0,0 +1,181 @@
+
+"""
+Portfolio valuation snapshots.
+
+``take_snapshots`` values every portfolio at current prices with one
+aggregate query (holdings totals plus executed cash flows) and one bulk
+upsert. ``backfill`` fills end-of-day snapshots missing since each
+portfolio's last one by replaying executed orders against daily closes
+from the bar store: positions, cost basis and cash change only on order
+days, so they are built as per-day deltas and accumulated with cumsum.
+
+Accounting (average cost, as Holding.average_price):
+
+* cash = initial capital - executed buys + executed sells
+* invested = cost basis of the open positions
+* realized P&L = cash + invested - initial capital
+* unrealized P&L = value - invested
+"""
+
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+from django.db.models import Max
+from django.utils import timezone
+
+from .barstore import bar_store, to_datetime64
+from .models import Order, Portfolio, PortfolioSnapshot, Stock
+
+CENT = Decimal('0.01')
+VALUE_FIELDS = ['value', 'cash', 'invested', 'realized_pnl', 'unrealized_pnl']
+
+
+def day_start(moment):
+    moment = moment.astimezone(dt_timezone.utc)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def money(value):
+    return Decimal(str(float(value))).quantize(CENT, ROUND_HALF_UP)
+
+
+def make_snapshot(portfolio_id, kind, timestamp, value, invested, cash, initial_capital):
+    value, invested, cash = money(value), money(invested), money(cash)
+    return PortfolioSnapshot(
+        portfolio_id=portfolio_id, kind=kind, timestamp=timestamp,
+        value=value, cash=cash, invested=invested,
+        realized_pnl=cash + invested - money(initial_capital),
+        unrealized_pnl=value - invested,
+    )
+
+
+def save_snapshots(snapshots):
+    PortfolioSnapshot.objects.bulk_create(
+        snapshots, batch_size=2000, update_conflicts=True,
+        unique_fields=['portfolio', 'kind', 'timestamp'], update_fields=VALUE_FIELDS,
+    )
+    return len(snapshots)
+
+
+def take_snapshots(kind='EOD', at=None):
+    """
+    Value every portfolio at current prices. An end-of-day snapshot is
+    stamped with its day and overwritten by later runs on the same day.
+    """
+    at = at or timezone.now()
+    timestamp = day_start(at) if kind == 'EOD' else at
+    rows = (Portfolio.objects.with_totals().with_cash_flows()
+            .values_list('id', 'total_value', 'total_investment', 'initial_capital', 'bought', 'sold'))
+    return save_snapshots([
+        make_snapshot(portfolio_id, kind, timestamp, value, invested, initial - bought + sold, initial)
+        for portfolio_id, value, invested, initial, bought, sold in rows.iterator(chunk_size=2000)
+    ])
+
+
+def daily_closes(symbols, days):
+    """
+    Close at or before each day's end, shaped (days, symbols); NaN before a
+    symbol's first bar
+    """
+    ends = days + np.timedelta64(1, 'D')
+    closes = np.full((len(days), len(symbols)), np.nan)
+    for column, symbol in enumerate(symbols):
+        bars = bar_store.query(symbol, interval='1d')
+        position = np.searchsorted(bars.dates, ends, 'left') - 1
+        known = position >= 0
+        closes[known, column] = np.asarray(bars.close)[position[known]]
+    return closes
+
+
+def backfill(until=None):
+    """
+    Write end-of-day snapshots for the weekdays between each portfolio's
+    last snapshot (or its creation) and the day before ``until``
+    """
+    end = day_start(until or timezone.now())
+    last = dict(PortfolioSnapshot.objects.filter(kind='EOD').values('portfolio')
+                .annotate(last=Max('timestamp')).values_list('portfolio', 'last'))
+    pending = {}
+    initial = {}
+    for portfolio_id, created_at, capital in Portfolio.objects.values_list(
+            'id', 'created_at', 'user__userprofile__initial_capital'):
+        start = last[portfolio_id] + timedelta(days=1) if portfolio_id in last else day_start(created_at)
+        if start < end:
+            pending[portfolio_id] = to_datetime64(start).astype('datetime64[D]')
+            initial[portfolio_id] = float(capital or 0)
+    if not pending:
+        return 0
+
+    calendar = np.arange(min(pending.values()), to_datetime64(end).astype('datetime64[D]'))
+    calendar = calendar[np.is_busday(calendar)]
+    if len(calendar) == 0:
+        return 0
+
+    orders = list(Order.objects.filter(portfolio_id__in=pending, status='EXECUTED', executed_at__lt=end)
+                  .order_by('portfolio_id', 'executed_at', 'id')
+                  .values_list('portfolio_id', 'stock_id', 'stock__symbol', 'order_type', 'quantity',
+                               'price', 'executed_at'))
+    symbols = sorted({order[2] for order in orders})
+    bar_store.sync_many(Stock.objects.filter(symbol__in=symbols).only('id', 'symbol'))
+    # One (days, symbols) close matrix; each portfolio reads its own block
+    closes = daily_closes(symbols, calendar)
+    columns = {symbol: column for column, symbol in enumerate(symbols)}
+
+    by_portfolio = {}
+    for order in orders:
+        by_portfolio.setdefault(order[0], []).append(order)
+
+    snapshots = []
+    for portfolio_id, first_day in pending.items():
+        offset = np.searchsorted(calendar, first_day)
+        days = calendar[offset:]
+        if len(days) == 0:
+            continue
+        ends = (days + np.timedelta64(1, 'D')).astype('datetime64[ns]')
+        portfolio_orders = by_portfolio.get(portfolio_id, ())
+        held = sorted({order[2] for order in portfolio_orders})
+        positions = {symbol: column for column, symbol in enumerate(held)}
+        quantity = np.zeros((len(days), len(held)))
+        cost = np.zeros((len(days), len(held)))
+        cash = np.zeros(len(days))
+        state = {}
+        for _, _, symbol, order_type, count, price, executed_at in portfolio_orders:
+            # An order counts from the first day that ends after it executed;
+            # orders before the first missing day fold into that day
+            row = np.searchsorted(ends, to_datetime64(executed_at), 'right')
+            if row >= len(days):
+                continue
+            column = positions[symbol]
+            shares, basis = state.get(symbol, (0, 0.0))
+            amount = count * float(price)
+            if order_type == 'BUY':
+                change = amount
+                shares += count
+                cash[row] -= amount
+            else:
+                sold = min(count, shares)
+                change = -basis / shares * sold if shares else 0.0
+                shares -= sold
+                cash[row] += amount
+            basis += change
+            state[symbol] = (shares, basis)
+            quantity[row, column] += count if order_type == 'BUY' else -sold
+            cost[row, column] += change
+
+        quantity, cost = np.cumsum(quantity, axis=0), np.cumsum(cost, axis=0)
+        cash = initial[portfolio_id] + np.cumsum(cash)
+        prices = closes[offset:, [columns[symbol] for symbol in held]]
+        # Positions without a close yet are carried at cost
+        value = np.where(np.isnan(prices), cost, quantity * np.nan_to_num(prices)).sum(axis=1)
+        invested = cost.sum(axis=1)
+        for row, day in enumerate(days):
+            timestamp = day.astype('datetime64[s]').item().replace(tzinfo=dt_timezone.utc)
+            snapshots.append(make_snapshot(portfolio_id, 'EOD', timestamp, value[row], invested[row],
+                                           cash[row], initial[portfolio_id]))
+    return save_snapshots(snapshots)
+
+
+def prune_intraday(keep_days):
+    cutoff = timezone.now() - timedelta(days=keep_days)
+    return PortfolioSnapshot.objects.filter(kind='INTRADAY', timestamp__lt=cutoff).delete()[0]
@@ -0,0 +1,291 @@
+
+"""
+Live tick streaming over WebSockets.
+
+Clients connect to ``TICK_STREAM['path']`` and send
+``{"action": "subscribe", "symbols": ["TCS", ...]}`` (or ``unsubscribe``).
+The server pushes ``{"type": "ticks", "data": {symbol: tick}}`` frames, one
+entry per subscribed symbol that changed since the previous frame, where a
+tick holds the latest price and the current candle.
+
+Each subscriber has one pending slot per symbol. Publishing overwrites the
+slot and wakes the subscriber's writer, so a slow client never builds a
+queue: it gets the newest values whenever its socket drains and the ticks
+in between are dropped. A tick is serialized once per publish, not once
+per subscriber.
+
+Prices enter through ``quotes_updated``. Ingestion normally runs in a
+Celery worker, so the receiver publishes to a Redis channel and every ASGI
+worker relays that channel into its own hub. Without a ``redis_url`` the
+hub is fed in-process.
+"""
+
+import asyncio
+import json
+import logging
+import math
+from datetime import datetime, timezone as dt_timezone
+from importlib import import_module
+from urllib.parse import urlsplit
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.http import parse_cookie
+from django.utils.dateparse import parse_datetime
+
+from .barstore import INTERVALS
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'path': '/ws/ticks/',
+    'redis_url': None,
+    'channel': 'ticks',
+    'candle_interval': '1m',
+    'max_symbols': 200,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'TICK_STREAM', {})}
+
+
+class Subscriber:
+    """
+    One websocket connection: its symbols and the latest unsent tick of each
+    """
+
+    def __init__(self, send):
+        self.send = send
+        self.symbols = set()
+        self.pending = {}
+        self.ready = asyncio.Event()
+        self.frames = 0
+        self.dropped = 0
+
+    def offer(self, symbol, fragment):
+        if symbol in self.pending:
+            self.dropped += 1
+        self.pending[symbol] = fragment
+        self.ready.set()
+
+    async def run(self):
+        """
+        Write pending ticks as one frame whenever the previous send completed
+        """
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            if not self.pending:
+                continue
+            pending, self.pending = self.pending, {}
+            text = '{"type":"ticks","data":{' + ','.join(pending.values()) + '}}'
+            await self.send({'type': 'websocket.send', 'text': text})
+            self.frames += 1
+
+
+class TickHub:
+    """
+    Fans prices out to subscribers. Not thread-safe: use it from its event
+    loop, or through ``publish_threadsafe``.
+    """
+
+    def __init__(self, candle_interval='1m'):
+        self.candle_seconds = INTERVALS[candle_interval]
+        self.subscribers = {}
+        self.latest = {}
+        self.candles = {}
+        self.offered = 0
+        self.loop = None
+        self.relay_task = None
+
+    def subscribe(self, subscriber, symbols):
+        for symbol in symbols:
+            if symbol in subscriber.symbols:
+                continue
+            subscriber.symbols.add(symbol)
+            self.subscribers.setdefault(symbol, set()).add(subscriber)
+            if symbol in self.latest:
+                subscriber.offer(symbol, self.latest[symbol])
+
+    def unsubscribe(self, subscriber, symbols=None):
+        for symbol in list(subscriber.symbols if symbols is None else symbols):
+            subscriber.symbols.discard(symbol)
+            subscribers = self.subscribers.get(symbol)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[symbol]
+
+    def publish(self, symbol, price, timestamp):
+        """
+        Record a price and offer it to the symbol's subscribers
+        """
+        price = float(price)
+        seconds = timestamp.timestamp()
+        bucket = int(math.floor(seconds / self.candle_seconds) * self.candle_seconds)
+        candle = self.candles.get(symbol)
+        if candle is None or candle[0] != bucket:
+            candle = self.candles[symbol] = [bucket, price, price, price, price]
+        else:
+            candle[2] = max(candle[2], price)
+            candle[3] = min(candle[3], price)
+            candle[4] = price
+        fragment = '%s:{"price":%s,"timestamp":"%s","candle":{"time":%d,"open":%s,"high":%s,"low":%s,"close":%s}}' % (
+            json.dumps(symbol), price, timestamp.isoformat().replace('+00:00', 'Z'), *candle)
+        self.latest[symbol] = fragment
+        subscribers = self.subscribers.get(symbol, ())
+        self.offered += len(subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(symbol, fragment)
+
+    def publish_many(self, prices, timestamp=None):
+        timestamp = timestamp or datetime.now(dt_timezone.utc)
+        for symbol, price in prices.items():
+            self.publish(symbol, price, timestamp)
+
+    def publish_threadsafe(self, prices, timestamp=None):
+        """
+        Publish from outside the hub's event loop; a no-op until a client connects
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.publish_many, prices, timestamp)
+
+    def start(self, redis_url=None, channel=None):
+        """
+        Bind to the running loop and start relaying the Redis channel, once
+        """
+        self.loop = asyncio.get_running_loop()
+        if redis_url and (self.relay_task is None or self.relay_task.done()):
+            self.relay_task = self.loop.create_task(self.relay(redis_url, channel))
+
+    async def relay(self, redis_url, channel):
+        import redis.asyncio as aioredis
+
+        while True:
+            client = aioredis.from_url(redis_url)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(channel)
+                    async for message in pubsub.listen():
+                        if message['type'] != 'message':
+                            continue
+                        data = json.loads(message['data'])
+                        self.publish_many(data['prices'], parse_datetime(data['timestamp']))
+            except (redis.ConnectionError, OSError) as error:
+                logger.warning(f"Tick relay lost Redis connection: {error}")
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+def session_user_id(scope):
+    """
+    The id of the user logged in through the connection's session cookie
+    """
+    headers = dict(scope.get('headers', ()))
+    session_key = parse_cookie(headers.get(b'cookie', b'').decode('latin-1')).get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return None
+    store = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    return store.get(SESSION_KEY)
+
+
+def origin_allowed(scope):
+    """
+    Browsers always send Origin; refuse cross-site pages riding on the cookie
+    """
+    headers = dict(scope.get('headers', ()))
+    origin = headers.get(b'origin')
+    if origin is None:
+        return True
+    origin = origin.decode('latin-1')
+    host = headers.get(b'host', b'').decode('latin-1')
+    return urlsplit(origin).netloc == host or origin in getattr(settings, 'CORS_ALLOWED_ORIGINS', ())
+
+
+class TickStream:
+    """
+    ASGI application for the tick websocket
+    """
+
+    def __init__(self, hub, authenticate=True, config=None):
+        self.hub = hub
+        self.authenticate = authenticate
+        self.config = config or get_config()
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        if self.authenticate and not (origin_allowed(scope) and await sync_to_async(session_user_id)(scope)):
+            await send({'type': 'websocket.close', 'code': 4401})
+            return
+        await send({'type': 'websocket.accept'})
+        self.hub.start(self.config['redis_url'], self.config['channel'])
+
+        subscriber = Subscriber(send)
+        writer = asyncio.create_task(subscriber.run())
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] == 'websocket.receive':
+                    error = self.handle(subscriber, message.get('text'))
+                    if error:
+                        await send({'type': 'websocket.send', 'text': json.dumps({'type': 'error', 'error': error})})
+        finally:
+            self.hub.unsubscribe(subscriber)
+            writer.cancel()
+
+    def handle(self, subscriber, text):
+        """
+        Apply a subscribe/unsubscribe command; returns an error message or None
+        """
+        try:
+            command = json.loads(text or '')
+            action = command['action']
+            symbols = {str(symbol).upper() for symbol in command.get('symbols', ())}
+        except (ValueError, TypeError, KeyError):
+            return 'Expected {"action": "subscribe"|"unsubscribe", "symbols": [...]}'
+        if action == 'subscribe':
+            if len(subscriber.symbols | symbols) > self.config['max_symbols']:
+                return f"At most {self.config['max_symbols']} symbols per connection"
+            self.hub.subscribe(subscriber, symbols)
+        elif action == 'unsubscribe':
+            self.hub.unsubscribe(subscriber, symbols)
+        else:
+            return f"Unknown action '{action}'"
+        return None
+
+
+_redis = None
+
+
+def publish_ticks(prices, timestamp=None):
+    """
+    Hand committed prices to every ASGI worker's hub
+    """
+    global _redis
+    config = get_config()
+    if not config['redis_url']:
+        hub.publish_threadsafe(prices, timestamp)
+        return
+    if _redis is None:
+        _redis = redis.Redis.from_url(config['redis_url'])
+    timestamp = timestamp or datetime.now(dt_timezone.utc)
+    message = json.dumps({
+        'prices': {symbol: str(price) for symbol, price in prices.items()},
+        'timestamp': timestamp.isoformat(),
+    })
+    try:
+        _redis.publish(config['channel'], message)
+    except redis.RedisError as error:
+        logger.warning(f"Could not publish ticks: {error}")
+
+
+hub = TickHub(get_config()['candle_interval'])
+application = TickStream(hub)
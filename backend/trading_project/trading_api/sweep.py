@@ -0,0 +1,194 @@
+
+"""
+Parameter sweeps for the backtesting engine.
+
+Price arrays are written once to memory-mapped files that every worker process
+maps read-only, so a run only ships a symbol name and a parameter dict across
+the process boundary instead of pickling the bars each time.
+"""
+
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from . import backtest
+from .barstore import Bars
+
+# Metrics where a smaller value ranks higher
+ASCENDING_METRICS = {'maxDrawdown'}
+
+_worker_bars = {}
+
+
+def expand_grid(grid):
+    """
+    Expand {'fast': [10, 20], 'slow': [50]} into a list of parameter dicts
+    """
+    names = sorted(grid)
+    values = [grid[name] if isinstance(grid[name], (list, tuple)) else [grid[name]] for name in names]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+class SharedBars:
+    """
+    Bars for many symbols packed into two memory-mapped files.
+
+    ``layout`` maps each symbol to its (offset, length) in the packed columns
+    and is the only thing workers need to rebuild zero-copy ``Bars`` views.
+    """
+
+    def __init__(self, bars_by_symbol):
+        self.directory = tempfile.mkdtemp(prefix='sweep-')
+        self.layout = {}
+        total = sum(len(bars) for bars in bars_by_symbol.values())
+        prices = np.memmap(self.prices_path, dtype=np.float64, mode='w+', shape=(4, max(total, 1)))
+        integers = np.memmap(self.integers_path, dtype=np.int64, mode='w+', shape=(2, max(total, 1)))
+
+        offset = 0
+        for symbol, bars in bars_by_symbol.items():
+            end = offset + len(bars)
+            prices[:, offset:end] = (bars.open, bars.high, bars.low, bars.close)
+            integers[0, offset:end] = bars.dates.astype('datetime64[ns]').astype(np.int64)
+            integers[1, offset:end] = bars.volume
+            self.layout[symbol] = (offset, len(bars))
+            offset = end
+        prices.flush()
+        integers.flush()
+        self.shape = max(total, 1)
+
+    @property
+    def prices_path(self):
+        return os.path.join(self.directory, 'prices.f64')
+
+    @property
+    def integers_path(self):
+        return os.path.join(self.directory, 'integers.i64')
+
+    def attach_args(self):
+        return (self.prices_path, self.integers_path, self.shape, self.layout)
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def attach(prices_path, integers_path, shape, layout):
+    """
+    Map the packed columns read-only and build per-symbol views of them
+    """
+    prices = np.memmap(prices_path, dtype=np.float64, mode='r', shape=(4, shape))
+    integers = np.memmap(integers_path, dtype=np.int64, mode='r', shape=(2, shape))
+    _worker_bars.clear()
+    for symbol, (offset, length) in layout.items():
+        end = offset + length
+        _worker_bars[symbol] = Bars(
+            integers[0, offset:end].view('datetime64[ns]'),
+            prices[0, offset:end],
+            prices[1, offset:end],
+            prices[2, offset:end],
+            prices[3, offset:end],
+            integers[1, offset:end],
+        )
+
+
+def evaluate_chunk(strategy_name, runs, initial_capital, commission):
+    """
+    Evaluate a chunk of (symbol, params) runs inside a worker
+    """
+    results = []
+    for symbol, params in runs:
+        metrics = backtest.evaluate(_worker_bars[symbol], strategy_name, params, initial_capital, commission)
+        results.append({'symbol': symbol, 'params': params, **metrics})
+    return results
+
+
+class Rankings:
+    """
+    Bounded best-N leaderboard that can be snapshotted while a sweep runs
+    """
+
+    def __init__(self, rank_by='sharpeRatio', top_n=20):
+        self.rank_by = rank_by
+        self.top_n = top_n
+        self.sign = -1.0 if rank_by in ASCENDING_METRICS else 1.0
+        self._heap = []
+        self._counter = itertools.count()
+
+    def add(self, result):
+        score = result.get(self.rank_by)
+        if score is None:
+            return
+        entry = (self.sign * score, next(self._counter), result)
+        if len(self._heap) < self.top_n:
+            heapq.heappush(self._heap, entry)
+        elif entry[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def snapshot(self):
+        return [result for _, _, result in sorted(self._heap, key=lambda entry: (-entry[0], entry[1]))]
+
+
+def run_sweep(bars_by_symbol, strategy_name, grid, initial_capital=100000.0, commission=0.0,
+              rank_by='sharpeRatio', top_n=20, max_workers=None, chunk_size=16,
+              on_progress=None, should_cancel=None, progress_every=1):
+    """
+    Run every parameter combination in ``grid`` against every symbol.
+
+    At most ``max_workers`` processes run concurrently and only twice that many
+    chunks are ever queued, so a cancel takes effect after the chunks already in
+    flight. ``on_progress(completed, total, rankings)`` is called as chunks
+    finish; ``should_cancel()`` is polled between completions.
+    """
+    combinations = expand_grid(grid)
+    for params in combinations[:1]:
+        backtest.resolve_params(strategy_name, params)
+    runs = [(symbol, params) for symbol in bars_by_symbol for params in combinations]
+    total = len(runs)
+    chunks = (runs[i:i + chunk_size] for i in range(0, total, chunk_size))
+    max_workers = max_workers or os.cpu_count() or 1
+    rankings = Rankings(rank_by, top_n)
+    completed = 0
+    cancelled = False
+
+    shared = SharedBars(bars_by_symbol)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=attach,
+                                 initargs=shared.attach_args()) as executor:
+            pending = set()
+            for chunk in itertools.islice(chunks, max_workers * 2):
+                pending.add(executor.submit(evaluate_chunk, strategy_name, chunk, initial_capital, commission))
+
+            batches = 0
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results = future.result()
+                    for result in results:
+                        rankings.add(result)
+                    completed += len(results)
+                batches += len(done)
+
+                if should_cancel is not None and should_cancel():
+                    cancelled = True
+                    for future in pending:
+                        future.cancel()
+                    break
+
+                for chunk in itertools.islice(chunks, len(done)):
+                    pending.add(executor.submit(evaluate_chunk, strategy_name, chunk, initial_capital, commission))
+                if on_progress is not None and (batches % progress_every == 0 or not pending):
+                    on_progress(completed, total, rankings.snapshot())
+    finally:
+        shared.close()
+
+    return {
+        'status': 'cancelled' if cancelled else 'completed',
+        'completed': completed,
+        'total': total,
+        'rank_by': rank_by,
+        'rankings': rankings.snapshot(),
+    }
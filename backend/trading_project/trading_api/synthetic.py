@@ -0,0 +1,138 @@
+
+"""
+Synthetic market and user data for benchmarks.
+
+Everything is drawn from one seeded generator, so the same arguments
+always produce the same universe. Prices follow a geometric random walk
+per symbol (drift and volatility vary by symbol) with daily bars on
+weekdays. Users get a profile, a portfolio with holdings, a mix of
+executed, pending and cancelled orders, and a watchlist. Synthetic rows
+are recognisable by their symbol / username prefix and can be removed
+with ``clear``.
+"""
+
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .barstore import bar_store
+from .models import (
+    HistoricalData, Holding, Order, Portfolio, Stock, UserProfile, Watchlist, percent_change
+)
+
+SYMBOL_PREFIX = 'SY'
+USER_PREFIX = 'synthetic'
+PASSWORD = 'synthetic'
+SECTORS = ['Technology', 'Financials', 'Energy', 'Healthcare', 'Consumer', 'Industrials', 'Materials']
+
+
+def money(value):
+    return Decimal(f'{value:.2f}')
+
+
+def clear():
+    """
+    Remove every synthetic user and symbol, including stored bars
+    """
+    User.objects.filter(username__startswith=USER_PREFIX).delete()
+    symbols = list(Stock.objects.filter(symbol__startswith=SYMBOL_PREFIX).values_list('symbol', flat=True))
+    Stock.objects.filter(symbol__startswith=SYMBOL_PREFIX).delete()
+    for symbol in symbols:
+        bar_store.delete(symbol)
+
+
+def generate(symbols=500, years=2, users=1000, holdings=10, orders=50, watchlist=20, seed=0, end=None):
+    """
+    Write a synthetic universe; returns row counts per model
+    """
+    rng = np.random.default_rng(seed)
+    end = end or datetime(2025, 1, 1, tzinfo=timezone.utc)
+    days = np.arange(np.datetime64(end.date()) - 365 * years, np.datetime64(end.date()))
+    days = days[np.is_busday(days)]
+
+    drift = rng.normal(0.0003, 0.0004, symbols)
+    volatility = rng.uniform(0.01, 0.035, symbols)
+    returns = rng.normal(drift, volatility, (len(days), symbols))
+    close = rng.uniform(20, 2000, symbols) * np.exp(np.cumsum(returns, axis=0))
+    open_ = close * np.exp(rng.normal(0, 0.004, close.shape))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.015, close.shape))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.015, close.shape))
+    volume = rng.integers(10 ** 4, 10 ** 7, close.shape)
+
+    with transaction.atomic():
+        stocks = Stock.objects.bulk_create([
+            Stock(
+                symbol=f'{SYMBOL_PREFIX}{i:05d}', name=f'Synthetic {i}', sector=SECTORS[i % len(SECTORS)],
+                current_price=money(close[-1, i]), previous_close=money(close[-2, i]),
+                percent_change=percent_change(money(close[-1, i]), money(close[-2, i])),
+                open_price=money(open_[-1, i]), high_price=money(high[-1, i]), low_price=money(low[-1, i]),
+                volume=int(volume[-1, i]),
+            )
+            for i in range(symbols)
+        ], batch_size=2000)
+        stocks = list(Stock.objects.filter(symbol__startswith=SYMBOL_PREFIX).order_by('symbol'))
+        dates = [datetime.combine(day.item(), datetime.min.time(), timezone.utc) for day in days]
+        for i, stock in enumerate(stocks):
+            HistoricalData.objects.bulk_create([
+                HistoricalData(stock=stock, date=date, open_price=money(open_[t, i]), high_price=money(high[t, i]),
+                               low_price=money(low[t, i]), close_price=money(close[t, i]), volume=int(volume[t, i]))
+                for t, date in enumerate(dates)
+            ], batch_size=5000)
+
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(username=f'{USER_PREFIX}{i:06d}', password=password) for i in range(users)
+        ], batch_size=2000)
+        user_ids = list(User.objects.filter(username__startswith=USER_PREFIX).order_by('id')
+                        .values_list('id', flat=True))
+        UserProfile.objects.bulk_create([
+            UserProfile(user_id=user_id, initial_capital=Decimal('1000000.00')) for user_id in user_ids
+        ], batch_size=2000)
+        Portfolio.objects.bulk_create([Portfolio(user_id=user_id) for user_id in user_ids], batch_size=2000)
+        portfolios = list(Portfolio.objects.filter(user_id__in=user_ids).order_by('user_id')
+                          .values_list('id', flat=True))
+
+        new_holdings, new_orders, lists = [], [], []
+        statuses = rng.choice(['EXECUTED', 'PENDING', 'CANCELLED'], (len(portfolios), orders), p=[0.7, 0.2, 0.1])
+        for row, portfolio_id in enumerate(portfolios):
+            held = rng.choice(symbols, min(holdings, symbols), replace=False)
+            for column in held:
+                new_holdings.append(Holding(
+                    portfolio_id=portfolio_id, stock=stocks[column], quantity=int(rng.integers(1, 500)),
+                    average_price=money(close[rng.integers(len(days)), column]),
+                ))
+            for n in range(orders):
+                column = held[n % len(held)] if len(held) else rng.integers(symbols)
+                day = int(rng.integers(len(days)))
+                executed = statuses[row, n] == 'EXECUTED'
+                new_orders.append(Order(
+                    portfolio_id=portfolio_id, stock=stocks[column], order_type='BUY' if n % 3 else 'SELL',
+                    quantity=int(rng.integers(1, 100)), price=money(close[day, column]), status=statuses[row, n],
+                    executed_at=dates[day] + timedelta(hours=15) if executed else None,
+                ))
+            lists.append((row, rng.choice(symbols, min(watchlist, symbols), replace=False)))
+        Holding.objects.bulk_create(new_holdings, batch_size=5000)
+        Order.objects.bulk_create(new_orders, batch_size=5000)
+
+        created = Watchlist.objects.bulk_create([
+            Watchlist(user_id=user_ids[row], name='Synthetic') for row, _ in lists
+        ], batch_size=2000)
+        Through = Watchlist.stocks.through
+        Through.objects.bulk_create([
+            Through(watchlist_id=watchlist.id, stock_id=stocks[column].id)
+            for watchlist, (_, columns) in zip(created, lists) for column in columns
+        ], batch_size=5000)
+
+    bar_store.sync_many(stocks)
+    return {
+        'symbols': len(stocks),
+        'bars': len(stocks) * len(dates),
+        'users': len(user_ids),
+        'holdings': len(new_holdings),
+        'orders': len(new_orders),
+        'watchlists': len(created),
+    }
@@ -1,59 +1,278 @@
 
-from celery import shared_task
+from celery import chord, shared_task
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.cache import cache
 import time
 from datetime import datetime
 
+from .models import ReportRun, ScreenerRun, Stock
+from . import backtest, ingestion, reports, robustness, screener, snapshots, sweep
+from .matching import get_engine
+
 logger = get_task_logger(__name__)
 
 @shared_task
-def update_stock_prices():
+def update_stock_prices(max_batches=None):
     """
-    Task to update stock prices from external API
+    Task to update stock prices from the configured market data source
+    
+    Drains the source batch by batch; every batch is written with bulk
+    upserts and reports its own throughput and lag. A looping source never
+    runs dry, so without ``max_batches`` a run replays one pass of it.
     """
     logger.info("Starting stock price update")
-    # Placeholder for actual API call to fetch latest stock prices
-    time.sleep(5)  # Simulate API call
-    logger.info("Completed stock price update")
-    return {"status": "success", "timestamp": datetime.now().isoformat()}
+    source = ingestion.get_source()
+    if max_batches is None and getattr(source, 'loop', False):
+        max_batches = len(source.paths)
+    batches = []
+    while max_batches is None or len(batches) < max_batches:
+        batch = source.fetch()
+        if batch is None:
+            break
+        stats = ingestion.ingest(batch)
+        logger.info(f"Ingested batch: {stats}")
+        batches.append(stats)
+    logger.info(f"Completed stock price update ({len(batches)} batches)")
+    return {"status": "success", "batches": batches, "timestamp": datetime.now().isoformat()}
 
 @shared_task
-def analyze_market_trends(symbol=None):
+def analyze_market_trends(symbol=None, bars=None):
     """
     Task to analyze market trends for a specific symbol or all symbols
+    
+    Screens the universe on trend, momentum, volatility, 52-week-high
+    distance and volume spike in one vectorized pass. Universes larger than
+    SCREENER['shard_size'] fan out to screen_market_shard tasks and are
+    ranked by rank_screener_run once every shard has stored its rows.
     """
     logger.info(f"Analyzing market trends for {'all symbols' if symbol is None else symbol}")
-    # Placeholder for actual market analysis logic
-    time.sleep(10)  # Simulate analysis processing
-    logger.info("Completed market trend analysis")
+    stocks = Stock.objects.order_by('id')
+    if symbol is not None:
+        stocks = stocks.filter(symbol=symbol)
+    stock_ids = list(stocks.values_list('id', flat=True))
+    shard_size = settings.SCREENER['shard_size']
+    shards = [stock_ids[i:i + shard_size] for i in range(0, len(stock_ids), shard_size)] or [[]]
+    run = ScreenerRun.objects.create(bars=bars or settings.SCREENER['bars'], shards=len(shards))
+    
+    if len(shards) > 1:
+        chord(screen_market_shard.s(run.id, shard) for shard in shards)(
+            rank_screener_run.s(run.id).on_error(fail_screener_run.si(run.id)))
+        logger.info(f"Dispatched screener run {run.id} as {len(shards)} shards")
+        return {"status": "dispatched", "run": run.id, "shards": len(shards),
+                "timestamp": datetime.now().isoformat()}
+    
+    try:
+        count = screener.screen(run, shards[0], ranked=True)
+    except Exception:
+        ScreenerRun.objects.filter(id=run.id).update(status='FAILED')
+        raise
+    screener.complete_run(run, count)
+    logger.info(f"Completed market trend analysis: {count} symbols in run {run.id}")
     return {
         "status": "success", 
         "symbol": symbol or "all", 
+        "run": run.id,
+        "symbols": count,
         "timestamp": datetime.now().isoformat()
     }
 
+@shared_task
+def screen_market_shard(run_id, stock_ids):
+    """
+    Task to compute screener factors for one shard of a run
+    """
+    return screener.screen(ScreenerRun.objects.get(id=run_id), stock_ids)
+
+@shared_task
+def rank_screener_run(counts, run_id):
+    """
+    Task to rank a sharded screener run once all shards are stored
+    """
+    run = ScreenerRun.objects.get(id=run_id)
+    screener.rank_run(run)
+    screener.complete_run(run, sum(counts))
+    logger.info(f"Completed market trend analysis: {sum(counts)} symbols in run {run_id}")
+    return {"status": "success", "run": run_id, "symbols": sum(counts),
+            "timestamp": datetime.now().isoformat()}
+
+@shared_task
+def fail_screener_run(run_id):
+    ScreenerRun.objects.filter(id=run_id).update(status='FAILED')
+
+def sweep_cancel_key(task_id):
+    return f"sweep:cancel:{task_id}"
+
+@shared_task(bind=True)
+def run_parameter_sweep(self, strategy, grid, symbols, timeframe='1Y', rank_by='sharpeRatio',
+                        max_workers=None, initial_capital=100000, commission=0, top_n=20):
+    """
+    Task to run a backtest parameter grid across a list of symbols
+    
+    Partial rankings are published as PROGRESS state while runs finish and the
+    sweep stops early once its cancel flag is set. Runs fan out to a process
+    pool, so route this task to a worker started with ``--pool=solo`` or
+    ``--pool=threads``.
+    """
+    logger.info(f"Starting {strategy} sweep over {len(symbols)} symbols")
+    bars_by_symbol = {}
+    for stock in Stock.objects.filter(symbol__in=symbols):
+        bars = backtest.load_period(stock, timeframe)
+        if len(bars):
+            bars_by_symbol[stock.symbol] = bars
+    
+    cap = settings.BACKTEST_SWEEP_MAX_WORKERS
+    max_workers = min(max_workers or cap, cap)
+    cancel_key = sweep_cancel_key(self.request.id)
+    last_update = [0.0]
+    
+    def on_progress(completed, total, rankings):
+        now = time.monotonic()
+        if now - last_update[0] < 0.5 and completed < total:
+            return
+        last_update[0] = now
+        self.update_state(state='PROGRESS', meta={
+            'completed': completed, 'total': total, 'rank_by': rank_by, 'rankings': rankings,
+        })
+    
+    result = sweep.run_sweep(
+        bars_by_symbol, strategy, grid,
+        initial_capital=initial_capital,
+        commission=commission,
+        rank_by=rank_by,
+        top_n=top_n,
+        max_workers=max_workers,
+        on_progress=on_progress if self.request.id else None,
+        should_cancel=lambda: bool(cache.get(cancel_key)),
+    )
+    cache.delete(cancel_key)
+    logger.info(f"Sweep {result['status']} after {result['completed']}/{result['total']} runs")
+    return {**result, "timestamp": datetime.now().isoformat()}
+
+@shared_task(bind=True)
+def run_robustness_analysis(self, symbol, strategy, timeframe='3Y', params=None, grid=None, train_bars=252,
+                            test_bars=63, rank_by='sharpeRatio', paths=2000, block_size=5, confidence=0.9,
+                            seed=0, max_workers=None, initial_capital=100000, commission=0):
+    """
+    Task to run walk-forward optimization and Monte Carlo analysis of a strategy
+    
+    Progress is published as PROGRESS state; the result stays in the result
+    backend for the Backtesting page to poll. Like sweeps, chunks fan out to
+    a process pool, so route this task to a ``--pool=solo`` or
+    ``--pool=threads`` worker.
+    """
+    logger.info(f"Starting {strategy} robustness analysis for {symbol}")
+    stock = Stock.objects.get(symbol=symbol)
+    bars = backtest.load_period(stock, timeframe)
+    
+    cap = settings.BACKTEST_SWEEP_MAX_WORKERS
+    last_update = [0.0]
+    
+    def on_progress(stage, completed, total):
+        now = time.monotonic()
+        if now - last_update[0] < 0.5 and completed < total:
+            return
+        last_update[0] = now
+        self.update_state(state='PROGRESS', meta={'stage': stage, 'completed': completed, 'total': total})
+    
+    result = robustness.run_analysis(
+        bars, strategy, params, grid,
+        train_bars=train_bars,
+        test_bars=test_bars,
+        rank_by=rank_by,
+        paths=paths,
+        block_size=block_size,
+        confidence=confidence,
+        seed=seed,
+        initial_capital=initial_capital,
+        commission=commission,
+        max_workers=min(max_workers or cap, cap),
+        on_progress=on_progress if self.request.id else None,
+    )
+    logger.info(f"Robustness analysis for {symbol} finished over {len(bars)} bars")
+    return {**result, "symbol": symbol, "timestamp": datetime.now().isoformat()}
+
 @shared_task
 def process_trade_orders():
     """
     Task to process pending trade orders
+    
+    Newly placed orders are added to the in-memory books and every book is
+    matched against the latest stored price; fills are written in one batch.
     """
     logger.info("Processing pending trade orders")
-    # Placeholder for actual trade order processing logic
-    time.sleep(3)  # Simulate processing
-    logger.info("Completed processing trade orders")
-    return {"status": "success", "timestamp": datetime.now().isoformat()}
+    engine = get_engine()
+    loaded = engine.load_pending()
+    for symbol, price in Stock.objects.values_list('symbol', 'current_price').iterator():
+        engine.on_price(symbol, price)
+    executed, rejected = engine.flush()
+    logger.info(f"Completed processing trade orders: {executed} executed, {rejected} rejected")
+    return {
+        "status": "success",
+        "loaded": loaded,
+        "executed": executed,
+        "rejected": rejected,
+        "open_orders": engine.open_orders(),
+        "timestamp": datetime.now().isoformat()
+    }
 
 @shared_task
-def generate_user_reports(user_id=None):
+def snapshot_portfolios(kind='EOD'):
+    """
+    Task to store a valuation snapshot of every portfolio
+    
+    End-of-day runs first backfill the days missed since each portfolio's
+    last snapshot from its executed orders and the daily bars.
+    """
+    logger.info(f"Taking {kind} portfolio snapshots")
+    backfilled = pruned = 0
+    if kind == 'EOD':
+        backfilled = snapshots.backfill()
+    else:
+        pruned = snapshots.prune_intraday(settings.PORTFOLIO_SNAPSHOTS['intraday_days'])
+    taken = snapshots.take_snapshots(kind)
+    logger.info(f"Completed portfolio snapshots: {taken} taken, {backfilled} backfilled, {pruned} pruned")
+    return {
+        "status": "success",
+        "kind": kind,
+        "snapshots": taken,
+        "backfilled": backfilled,
+        "pruned": pruned,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@shared_task(bind=True)
+def generate_user_reports(self, user_id=None, run_id=None, report_format='csv'):
     """
     Task to generate reports for users
+    
+    Streams statements, holdings and trades for every user (or one user)
+    to files under REPORTS['dir'], chunk by chunk. Pass ``run_id`` to
+    resume an interrupted run from its last checkpoint.
     """
-    logger.info(f"Generating reports for {'all users' if user_id is None else f'user {user_id}'}")
-    # Placeholder for actual report generation logic
-    time.sleep(8)  # Simulate report generation
-    logger.info("Completed generating user reports")
+    if run_id is not None:
+        run = ReportRun.objects.get(id=run_id)
+        logger.info(f"Resuming report run {run_id} after user {run.last_user_id}")
+    else:
+        run = ReportRun.objects.create(user_id=user_id, format=report_format)
+        logger.info(f"Generating reports for {'all users' if user_id is None else f'user {user_id}'}")
+    
+    def on_progress(run):
+        self.update_state(state='PROGRESS', meta={
+            'run': run.id, 'users': run.users, 'total': run.total, 'last_user_id': run.last_user_id,
+        })
+    
+    try:
+        reports.run_reports(run, on_progress=on_progress if self.request.id else None)
+    except Exception:
+        ReportRun.objects.filter(id=run.id).update(status='FAILED')
+        raise
+    logger.info(f"Completed generating user reports: {run.users} users in run {run.id}")
     return {
         "status": "success", 
-        "user_id": user_id or "all", 
+        "user_id": run.user_id or "all", 
+        "run": run.id,
+        "users": run.users,
+        "path": run.path,
         "timestamp": datetime.now().isoformat()
     }
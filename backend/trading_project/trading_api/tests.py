@@ -0,0 +1,527 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from decimal import Decimal
+from unittest import mock
+
+import msgpack
+import numpy as np
+import pyarrow
+import pyarrow.ipc
+import redis
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from . import caching, receivers, risk, synthetic
+from .barstore import bar_store
+from .ingestion import FileReplaySource, MarketBatch, ingest
+from .matching import MatchingEngine
+from .models import HistoricalData, Holding, Order, Portfolio, PortfolioSnapshot, Stock, UserProfile
+from .replay import Replay
+from .snapshots import VALUE_FIELDS, backfill, take_snapshots
+from .tasks import update_stock_prices
+
+
+class PortfolioQueryCountTests(APITestCase):
+    """
+    The portfolio endpoints issue a fixed number of queries, however many
+    holdings a portfolio has
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        sectors = ['Technology', 'Financials', 'Energy', None]
+        cls.stocks = Stock.objects.bulk_create([
+            Stock(symbol=f'QC{i}', name=f'Query Count {i}', current_price=Decimal('110.00'),
+                  previous_close=Decimal('100.00'), open_price=Decimal('100.00'), high_price=Decimal('111.00'),
+                  low_price=Decimal('99.00'), volume=1000, percent_change=Decimal('10.00'),
+                  sector=sectors[i % len(sectors)])
+            for i in range(50)
+        ])
+        cls.portfolios = {}
+        for count in (1, 50):
+            user = User.objects.create_user(f'holder{count}', password='secret')
+            portfolio = Portfolio.objects.create(user=user)
+            Holding.objects.bulk_create([
+                Holding(portfolio=portfolio, stock=stock, quantity=10, average_price=Decimal('95.00'))
+                for stock in cls.stocks[:count]
+            ])
+            cls.portfolios[count] = portfolio
+
+    def test_summary_query_count(self):
+        for count, portfolio in self.portfolios.items():
+            with self.subTest(holdings=count):
+                self.client.force_authenticate(portfolio.user)
+                with self.assertNumQueries(3):
+                    response = self.client.get(f'/api/portfolio/{portfolio.id}/summary/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['holdings']), count)
+                self.assertEqual(response.data['totalValue'], Decimal('1100.00') * count)
+
+    def test_list_query_count(self):
+        for count, portfolio in self.portfolios.items():
+            with self.subTest(holdings=count):
+                self.client.force_authenticate(portfolio.user)
+                with self.assertNumQueries(2):
+                    response = self.client.get('/api/portfolio/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data[0]['holdings']), count)
+
+
+class ColumnarFormatTests(APITestCase):
+    """
+    The stock list answers in MessagePack and Arrow with the same columns
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('columns', password='secret')
+        Stock.objects.bulk_create([
+            Stock(symbol=f'CF{i}', name=f'Columnar {i}', current_price=Decimal('10.50') + i,
+                  previous_close=Decimal('10.00'), open_price=Decimal('10.00'), high_price=Decimal('12.00'),
+                  low_price=Decimal('9.00'), volume=100 * i, percent_change=Decimal('5.00'))
+            for i in range(3)
+        ])
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_msgpack(self):
+        response = self.client.get('/api/stocks/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        document = msgpack.unpackb(response.content)
+        self.assertEqual(document['length'], 3)
+        self.assertEqual(document['columns']['symbol'], ['CF0', 'CF1', 'CF2'])
+        self.assertEqual(document['columns']['current_price'], [10.5, 11.5, 12.5])
+
+    def test_arrow(self):
+        response = self.client.get('/api/stocks/?format=arrow')
+        self.assertEqual(response.status_code, 200)
+        table = pyarrow.ipc.open_stream(response.content).read_all()
+        self.assertEqual(table.column('symbol').to_pylist(), ['CF0', 'CF1', 'CF2'])
+        self.assertEqual(table.column('volume').to_pylist(), [0, 100, 200])
+
+
+class MatchingEngineTests(TestCase):
+    """
+    Orders fire on their limit only; stoploss and target exit the position
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stock = Stock.objects.create(symbol='ENG', name='Engine', current_price=Decimal('100.00'),
+                                         previous_close=Decimal('100.00'), open_price=Decimal('100.00'),
+                                         high_price=Decimal('100.00'), low_price=Decimal('100.00'), volume=0)
+        cls.portfolio = Portfolio.objects.create(user=User.objects.create_user('engine', password='secret'))
+
+    def order(self, order_type, quantity, price, stoploss=None, target=None):
+        return Order.objects.create(portfolio=self.portfolio, stock=self.stock, order_type=order_type,
+                                    quantity=quantity, price=Decimal(price), stoploss=stoploss, target=target)
+
+    def hold(self, quantity, average_price):
+        return Holding.objects.create(portfolio=self.portfolio, stock=self.stock, quantity=quantity,
+                                      average_price=Decimal(average_price))
+
+    def match(self, engine, *prices):
+        """
+        Load new orders, then run each price through and flush it
+        """
+        results = []
+        for price in prices:
+            engine.load_pending()
+            engine.on_price('ENG', Decimal(price))
+            results.append(engine.flush())
+        return results
+
+    def test_buy_fires_at_or_below_limit_only(self):
+        order = self.order('BUY', 10, '100.00', stoploss=Decimal('95.00'), target=Decimal('110.00'))
+        engine = MatchingEngine()
+        self.assertEqual(self.match(engine, '105', '120', '94'), [(0, 0), (0, 0), (1, 0)])
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.price), ('EXECUTED', Decimal('94.00')))
+
+    def test_buy_brackets_exit_at_target(self):
+        entry = self.order('BUY', 10, '100.00', stoploss=Decimal('95.00'), target=Decimal('110.00'))
+        engine = MatchingEngine()
+        self.match(engine, '99')
+        exit_order = Order.objects.get(parent=entry)
+        self.assertEqual((exit_order.order_type, exit_order.quantity, exit_order.status), ('SELL', 10, 'PENDING'))
+        self.assertEqual(self.match(engine, '105', '110.50'), [(0, 0), (1, 0)])
+        exit_order.refresh_from_db()
+        self.assertEqual((exit_order.status, exit_order.price), ('EXECUTED', Decimal('110.50')))
+        self.assertFalse(Holding.objects.filter(portfolio=self.portfolio).exists())
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_buy_brackets_exit_at_stoploss(self):
+        entry = self.order('BUY', 10, '100.00', stoploss=Decimal('95.00'), target=Decimal('110.00'))
+        engine = MatchingEngine()
+        self.match(engine, '100', '96', '94.50')
+        exit_order = Order.objects.get(parent=entry)
+        self.assertEqual((exit_order.status, exit_order.price), ('EXECUTED', Decimal('94.50')))
+
+    def test_sell_fires_at_or_above_limit_only(self):
+        self.hold(10, '90.00')
+        entry = self.order('SELL', 10, '120.00', stoploss=Decimal('125.00'), target=Decimal('100.00'))
+        engine = MatchingEngine()
+        self.assertEqual(self.match(engine, '115', '90', '121'), [(0, 0), (0, 0), (1, 0)])
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.price), ('EXECUTED', Decimal('121.00')))
+        # The exit BUY stops out above the stoploss
+        self.assertEqual(self.match(engine, '124', '126'), [(0, 0), (1, 0)])
+        exit_order = Order.objects.get(parent=entry)
+        self.assertEqual((exit_order.order_type, exit_order.status, exit_order.price),
+                         ('BUY', 'EXECUTED', Decimal('126.00')))
+
+    def test_cancelled_orders_are_skipped(self):
+        cancelled = self.order('BUY', 10, '100.00')
+        dropped = self.order('BUY', 5, '100.00')
+        engine = MatchingEngine()
+        engine.load_pending()
+        Order.objects.filter(id=cancelled.id).update(status='CANCELLED')
+        engine.cancel(dropped.id)
+        engine.on_price('ENG', Decimal('99'))
+        self.assertEqual(engine.flush(), (0, 0))
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, 'CANCELLED')
+        self.assertFalse(Holding.objects.exists())
+
+    def test_oversized_sell_is_rejected(self):
+        self.hold(5, '90.00')
+        order = self.order('SELL', 10, '100.00')
+        self.assertEqual(self.match(MatchingEngine(), '101'), [(0, 1)])
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'REJECTED')
+        self.assertEqual(Holding.objects.get().quantity, 5)
+
+    def test_buy_updates_weighted_average_price(self):
+        self.hold(10, '100.00')
+        self.order('BUY', 30, '85.00')
+        self.match(MatchingEngine(), '80')
+        holding = Holding.objects.get()
+        self.assertEqual((holding.quantity, holding.average_price), (40, Decimal('85.00')))
+
+    def test_failed_flush_requeues_fills(self):
+        order = self.order('BUY', 10, '100.00')
+        engine = MatchingEngine()
+        engine.load_pending()
+        engine.on_price('ENG', Decimal('99'))
+        with mock.patch.object(Order.objects, 'bulk_update', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                engine.flush()
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'PENDING')
+        self.assertEqual(len(engine.fills), 1)
+        self.assertEqual(engine.flush(), (1, 0))
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.price), ('EXECUTED', Decimal('99.00')))
+
+
+class ReplayTests(TestCase):
+    """
+    A replay matches orders in its own engine, only once they were placed
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stock = Stock.objects.create(symbol='RPL', name='Replay', current_price=Decimal('100.00'),
+                                         previous_close=Decimal('100.00'), open_price=Decimal('100.00'),
+                                         high_price=Decimal('100.00'), low_price=Decimal('100.00'), volume=0)
+        # A down day: ticks at 100, 102, 90, 95
+        HistoricalData.objects.create(stock=cls.stock, date=datetime(2023, 1, 2, tzinfo=timezone.utc),
+                                      open_price=Decimal('100.00'), high_price=Decimal('102.00'),
+                                      low_price=Decimal('90.00'), close_price=Decimal('95.00'), volume=1000)
+        portfolio = Portfolio.objects.create(user=User.objects.create_user('replay', password='secret'))
+        cls.placed, cls.later = Order.objects.bulk_create([
+            Order(portfolio=portfolio, stock=cls.stock, order_type='BUY', quantity=10, price=Decimal('92.00'))
+            for _ in range(2)
+        ])
+        Order.objects.filter(id=cls.placed.id).update(timestamp=datetime(2023, 1, 1, tzinfo=timezone.utc))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(bar_store, 'root', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def replay(self, **kwargs):
+        replay = Replay(['RPL'], datetime(2023, 1, 2, tzinfo=timezone.utc),
+                        datetime(2023, 1, 2, 23, 59, tzinfo=timezone.utc), **kwargs)
+        with mock.patch.object(receivers, 'get_engine') as get_engine:
+            result = replay.run()
+        get_engine.assert_not_called()
+        return result
+
+    def test_fills_stay_in_memory(self):
+        result = self.replay()
+        self.assertEqual((result['orders'], result['executed']), (1, 1))
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'PENDING'})
+        self.assertFalse(Holding.objects.exists())
+
+    def test_write_fills(self):
+        result = self.replay(write_fills=True)
+        self.assertEqual(result['executed'], 1)
+        self.placed.refresh_from_db()
+        self.assertEqual((self.placed.status, self.placed.price), ('EXECUTED', Decimal('90.00')))
+        self.assertEqual(self.placed.executed_at, datetime(2023, 1, 2, 16, tzinfo=timezone.utc))
+        self.assertEqual(Order.objects.get(id=self.later.id).status, 'PENDING')
+        self.assertEqual(Holding.objects.get().quantity, 10)
+
+
+class BenchmarkBackendTests(TestCase):
+    """
+    benchmark_backend runs on a tiny universe under the project's settings
+    """
+
+    def test_smoke(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(bar_store, 'root', directory):
+            synthetic.generate(symbols=2, years=1, users=1, holdings=1, orders=2, watchlist=2)
+            out = StringIO()
+            with override_settings(ALLOWED_HOSTS=[]):
+                call_command('benchmark_backend', '--only', 'historical_data_1y', 'portfolio_summary',
+                             '--repeat', '1', '--users', '1', stdout=out)
+        scenarios = json.loads(out.getvalue())['scenarios']
+        self.assertEqual(set(scenarios), {'historical_data_1y', 'portfolio_summary'})
+
+
+class IngestionTests(TestCase):
+    """
+    Batches are upserted in bulk; file replays resume where the last run
+    stopped
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = mock.patch.object(bar_store, 'root', os.path.join(directory.name, 'barstore'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def quote(self, symbol, price, **fields):
+        return {'symbol': symbol, 'price': price, 'previous_close': '100', 'open': '100', 'high': '110',
+                'low': '90', 'volume': '1000', **fields}
+
+    def bar(self, symbol, close, date='2025-01-02T00:00:00Z'):
+        return {'symbol': symbol, 'date': date, 'open': '100', 'high': '110', 'low': '90', 'close': close,
+                'volume': '500'}
+
+    def write_files(self, count):
+        for i in range(count):
+            with open(os.path.join(self.directory, f'{i:03d}.json'), 'w') as handle:
+                json.dump({'quotes': [self.quote('ING', str(100 + i))]}, handle)
+
+    def test_quotes_and_bars_are_upserted(self):
+        ingest(MarketBatch(quotes=[self.quote('ING', '101'), self.quote('NEW', '50')]))
+        with CaptureQueriesContext(connection) as captured:
+            stats = ingest(MarketBatch(quotes=[self.quote('ING', '105'), self.quote('NEW', '55')],
+                                       bars=[self.bar('ING', '104')]))
+        ingest(MarketBatch(bars=[self.bar('ING', '106')]))
+        upserts = [query['sql'] for query in captured.captured_queries if 'ON CONFLICT' in query['sql']]
+        self.assertEqual(len(upserts), 2)
+        self.assertEqual((stats['quotes'], stats['bars']), (2, 1))
+        self.assertEqual(dict(Stock.objects.values_list('symbol', 'current_price')),
+                         {'ING': Decimal('105.00'), 'NEW': Decimal('55.00')})
+        self.assertEqual(list(HistoricalData.objects.values_list('close_price', flat=True)), [Decimal('106.00')])
+
+    def test_partial_quotes_keep_stored_day_fields(self):
+        ingest(MarketBatch(quotes=[self.quote('ING', '101')]))
+        ingest(MarketBatch(quotes=[{'symbol': 'ING', 'price': '120'}]))
+        stock = Stock.objects.get(symbol='ING')
+        self.assertEqual((stock.current_price, stock.high_price, stock.low_price, stock.volume),
+                         (Decimal('120.00'), Decimal('110.00'), Decimal('90.00'), 1000))
+        self.assertEqual(stock.percent_change, Decimal('20.00'))
+
+    def test_unknown_symbols_are_dropped_before_counting(self):
+        ingest(MarketBatch(quotes=[self.quote('ING', '101')]))
+        stats = ingest(MarketBatch(bars=[self.bar('ING', '101'), self.bar('NOPE', '5'),
+                                         self.bar('NOPE', '6', date='2025-01-03T00:00:00Z')]))
+        self.assertEqual((stats['bars'], stats['unknown_symbols'], stats['duplicates']), (1, 1, 0))
+        self.assertEqual(HistoricalData.objects.count(), 1)
+
+    def test_file_replay_resumes_between_runs(self):
+        self.write_files(3)
+        self.assertEqual(FileReplaySource(self.directory).fetch().quotes[0]['price'], '100')
+        source = FileReplaySource(self.directory)
+        self.assertEqual(source.fetch().quotes[0]['price'], '101')
+        self.assertEqual(source.fetch().quotes[0]['price'], '102')
+        self.assertIsNone(FileReplaySource(self.directory).fetch())
+        self.assertIsNone(FileReplaySource(os.path.join(self.directory, 'missing')).fetch())
+
+    def test_looping_source_runs_one_pass_per_task(self):
+        self.write_files(2)
+        config = {'class': 'trading_api.ingestion.FileReplaySource',
+                  'options': {'path': self.directory, 'loop': True}}
+        with override_settings(MARKET_DATA_SOURCE=config):
+            for _ in range(2):
+                result = update_stock_prices.apply(throw=True).result
+                self.assertEqual([batch['quotes'] for batch in result['batches']], [1, 1])
+        self.assertEqual(Stock.objects.get(symbol='ING').current_price, Decimal('101.00'))
+
+
+class ResponseCacheTests(APITestCase):
+    """
+    Cached responses follow namespace bumps and survive a cache outage
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stock = Stock.objects.create(symbol='RC', name='Response Cache', current_price=Decimal('110.00'),
+                                         previous_close=Decimal('100.00'), open_price=Decimal('100.00'),
+                                         high_price=Decimal('110.00'), low_price=Decimal('100.00'),
+                                         volume=1000, percent_change=Decimal('10.00'))
+        cls.users = [User.objects.create_user(f'cache{i}', password='secret') for i in range(2)]
+
+    def setUp(self):
+        cache.clear()
+        caching.response_cache.local.clear()
+        self.client.force_authenticate(self.users[0])
+
+    def gainers(self):
+        response = self.client.get('/api/stocks/top_gainers/')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_bump_serves_fresh_data(self):
+        self.assertEqual(self.gainers()[0]['current_price'], '110.00')
+        # A write that skips the signals leaves the cached body in place
+        Stock.objects.filter(id=self.stock.id).update(current_price=Decimal('120.00'))
+        self.assertEqual(self.gainers()[0]['current_price'], '110.00')
+        version = caching.namespace_version(caching.STOCKS)
+        caching.bump(caching.STOCKS)
+        self.assertEqual(caching.namespace_version(caching.STOCKS), version + 1)
+        self.assertEqual(self.gainers()[0]['current_price'], '120.00')
+
+    def test_entries_are_shared_but_never_skip_authentication(self):
+        body = self.gainers()
+        self.client.force_authenticate(self.users[1])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.gainers(), body)
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get('/api/stocks/top_gainers/').status_code, (401, 403))
+
+    def test_unreachable_cache_serves_uncached(self):
+        broken = mock.Mock(**{f'{name}.side_effect': redis.ConnectionError('down')
+                              for name in ('get', 'get_many', 'set', 'add', 'incr')})
+        with mock.patch.object(caching, 'cache', broken):
+            self.assertEqual(self.gainers()[0]['symbol'], 'RC')
+            self.stock.save()
+            self.assertIsNone(caching.namespace_version(caching.STOCKS))
+        # Versions readable, entries not
+        with mock.patch.object(caching.cache, 'get', side_effect=redis.ConnectionError('down')), \
+                mock.patch.object(caching.cache, 'set', side_effect=redis.ConnectionError('down')):
+            self.assertEqual(self.gainers()[0]['symbol'], 'RC')
+
+
+class SnapshotBackfillTests(TestCase):
+    """
+    Backfilled end-of-day values match a live snapshot taken that day
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        closes = {'SNA': ['101', '111', '121', '125'], 'SNB': [None, None, '52', '53']}
+        cls.stocks = {}
+        for symbol, values in closes.items():
+            close = Decimal(values[-1])
+            stock = Stock.objects.create(symbol=symbol, name=symbol, current_price=close, previous_close=close,
+                                         open_price=close, high_price=close, low_price=close, volume=0)
+            cls.stocks[symbol] = stock
+            for day, value in enumerate(values):
+                if value is not None:
+                    HistoricalData.objects.create(
+                        stock=stock, date=datetime(2025, 1, 6 + day, tzinfo=timezone.utc),
+                        open_price=Decimal(value), high_price=Decimal(value), low_price=Decimal(value),
+                        close_price=Decimal(value), volume=100)
+
+        # Monday to Thursday, 2025-01-06 to 2025-01-09
+        cls.portfolios = []
+        for name, trades, holdings in (
+            ('both', [('SNA', 'BUY', 10, '100', 6), ('SNA', 'BUY', 10, '110', 7), ('SNA', 'SELL', 5, '120', 8),
+                      ('SNB', 'BUY', 4, '50', 8)], [('SNA', 15, '105.00'), ('SNB', 4, '50.00')]),
+            ('one', [('SNB', 'BUY', 2, '51', 8)], [('SNB', 2, '51.00')]),
+        ):
+            user = User.objects.create_user(name, password='secret')
+            UserProfile.objects.create(user=user, initial_capital=Decimal('10000.00'))
+            portfolio = Portfolio.objects.create(user=user)
+            Portfolio.objects.filter(id=portfolio.id).update(created_at=datetime(2025, 1, 6, tzinfo=timezone.utc))
+            for symbol, order_type, quantity, price, day in trades:
+                Order.objects.create(portfolio=portfolio, stock=cls.stocks[symbol], order_type=order_type,
+                                     quantity=quantity, price=Decimal(price), status='EXECUTED',
+                                     executed_at=datetime(2025, 1, day, 10, tzinfo=timezone.utc))
+            for symbol, quantity, average_price in holdings:
+                Holding.objects.create(portfolio=portfolio, stock=cls.stocks[symbol], quantity=quantity,
+                                       average_price=Decimal(average_price))
+            cls.portfolios.append(portfolio)
+        # The second portfolio only misses the last two days
+        PortfolioSnapshot.objects.create(portfolio=cls.portfolios[1], timestamp=datetime(2025, 1, 7, tzinfo=timezone.utc),
+                                         value=0, cash=Decimal('10000.00'), invested=0, realized_pnl=0,
+                                         unrealized_pnl=0)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(bar_store, 'root', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def values(self, day):
+        return {
+            row[0]: row[1:] for row in PortfolioSnapshot.objects.filter(
+                kind='EOD', timestamp=datetime(2025, 1, day, tzinfo=timezone.utc)).values_list('portfolio', *VALUE_FIELDS)
+        }
+
+    def test_backfill_matches_take_snapshots(self):
+        self.assertEqual(backfill(until=datetime(2025, 1, 10, 12, tzinfo=timezone.utc)), 4 + 2)
+        backfilled = self.values(9)
+        self.assertEqual(backfilled[self.portfolios[0].id][0], Decimal('2087.00'))
+        PortfolioSnapshot.objects.filter(timestamp=datetime(2025, 1, 9, tzinfo=timezone.utc)).delete()
+        take_snapshots(at=datetime(2025, 1, 9, 18, tzinfo=timezone.utc))
+        self.assertEqual(self.values(9), backfilled)
+        self.assertEqual(set(PortfolioSnapshot.objects.filter(portfolio=self.portfolios[1])
+                             .values_list('timestamp__day', flat=True)), {7, 8, 9})
+
+
+class RiskModelTests(TestCase):
+    """
+    Rolling correlations are reduced block by block; the cached model holds
+    no per-day matrices
+    """
+
+    def test_blocks_match_the_full_series(self):
+        returns = np.random.default_rng(0).normal(0, 0.01, (300, 5))
+        full = risk.window_correlations(returns, 20)
+        latest, average = risk.correlation_summary(returns, 20)
+        np.testing.assert_allclose(latest, full[-1])
+        np.testing.assert_allclose(latest, np.corrcoef(returns[-20:], rowvar=False))
+        np.testing.assert_allclose(average, (full.sum(axis=(1, 2)) - 5) / 20)
+
+    def test_cached_model_is_bounded(self):
+        rng = np.random.default_rng(1)
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for symbol in ('RKA', 'RKB', 'RKC'):
+            stock = Stock.objects.create(symbol=symbol, name=symbol, current_price=Decimal('100.00'),
+                                         previous_close=Decimal('100.00'), open_price=Decimal('100.00'),
+                                         high_price=Decimal('100.00'), low_price=Decimal('100.00'), volume=0)
+            closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, 120)))
+            HistoricalData.objects.bulk_create([
+                HistoricalData(stock=stock, date=start + timedelta(days=day), open_price=Decimal(f'{close:.2f}'),
+                               high_price=Decimal(f'{close:.2f}'), low_price=Decimal(f'{close:.2f}'),
+                               close_price=Decimal(f'{close:.2f}'), volume=100)
+                for day, close in enumerate(closes)
+            ])
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(bar_store, 'root', directory):
+            bar_store.sync_many(Stock.objects.all())
+            model = risk.returns_model(['RKA', 'RKB', 'RKC'], 90, 20, None)
+        self.assertEqual(model['correlation'].shape, (3, 3))
+        self.assertEqual(len(model['average_correlation']), 90 - 20 + 1)
+        self.assertTrue(all(np.ndim(value) <= 2 for value in model.values()))
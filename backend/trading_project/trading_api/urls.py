@@ -3,7 +3,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     StockViewSet, MarketIndexViewSet, PortfolioViewSet,
-    OrderViewSet, WatchlistViewSet, UserProfileViewSet
+    OrderViewSet, WatchlistViewSet, UserProfileViewSet, BacktestViewSet, ScreenerViewSet
 )
 
 router = DefaultRouter()
@@ -13,6 +13,8 @@ router.register(r'portfolio', PortfolioViewSet, basename='portfolio')
 router.register(r'orders', OrderViewSet, basename='orders')
 router.register(r'watchlists', WatchlistViewSet, basename='watchlists')
 router.register(r'profile', UserProfileViewSet, basename='profile')
+router.register(r'backtests', BacktestViewSet, basename='backtests')
+router.register(r'screener', ScreenerViewSet, basename='screener')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,81 +1,316 @@
 
+from datetime import timedelta
+
+import numpy as np
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import F, Sum, Value, DecimalField
-from django.db.models.functions import Coalesce
+from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.utils import timezone
+from django.core.cache import cache
+from celery.result import AsyncResult
+from django.db.models import Prefetch
 
-from .models import Stock, MarketIndex, HistoricalData, Portfolio, Holding, Order, Watchlist, UserProfile
+from .models import (
+    Stock, MarketIndex, Portfolio, Holding, Order, Watchlist, UserProfile,
+    ScreenerRun, ScreenerResult
+)
 from .serializers import (
-    StockSerializer, MarketIndexSerializer, HistoricalDataSerializer,
+    StockSerializer, MarketIndexSerializer,
     PortfolioSerializer, HoldingSerializer, OrderSerializer, OrderCreateSerializer,
-    WatchlistSerializer, UserProfileSerializer, UserSerializer
+    WatchlistSerializer, UserProfileSerializer, BacktestRequestSerializer,
+    SweepRequestSerializer, HistoricalDataQuerySerializer, bars_to_representation, bars_to_columns,
+    ScreenerRunSerializer, ScreenerResultSerializer, ScreenerQuerySerializer, RiskQuerySerializer,
+    PortfolioSnapshotSerializer, SnapshotQuerySerializer, OrderQuerySerializer, OrderBatchSerializer,
+    OrderCancelAllSerializer, RobustnessRequestSerializer, OptionChainQuerySerializer,
+    ImpliedVolatilitySerializer
 )
+from .pagination import OrderPagination, SnapshotPagination
+from .barstore import INTERVALS, Bars, bar_store, to_datetime
+from .indicators import current_indicators
+from . import backtest, options, risk
+from .caching import INDICES, SCREENER, STOCKS, cached_response
+from .search import symbol_index
+from .renderers import Columns, ColumnarMixin, is_columnar
+from .tasks import run_parameter_sweep, run_robustness_analysis, sweep_cancel_key
+
+MOVERS_LIMIT = 10
+MOVERS_MAX_LIMIT = 100
+QUOTES_MAX_SYMBOLS = 500
+SEARCH_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+STOCK_COLUMNS = [field.attname for field in Stock._meta.concrete_fields]
 
-class StockViewSet(viewsets.ReadOnlyModelViewSet):
+class StockViewSet(ColumnarMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Stock.objects.all()
     serializer_class = StockSerializer
     permission_classes = [permissions.IsAuthenticated]
+    columnar_actions = ('list', 'historical_data')
+    
+    @cached_response(STOCKS)
+    def list(self, request, *args, **kwargs):
+        if is_columnar(request):
+            return Response(Columns.from_values(self.filter_queryset(self.get_queryset()), STOCK_COLUMNS))
+        return super().list(request, *args, **kwargs)
+    
+    def movers(self, request, ordering):
+        """
+        The first ``limit`` stocks by ``ordering``, optionally within a
+        ``sector``; served from the matching index without a table scan
+        """
+        try:
+            limit = min(max(int(request.query_params.get('limit', MOVERS_LIMIT)), 1), MOVERS_MAX_LIMIT)
+        except ValueError:
+            return Response({'error': "'limit' must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        stocks = Stock.objects.all()
+        sector = request.query_params.get('sector')
+        if sector:
+            stocks = stocks.filter(sector=sector)
+        serializer = self.get_serializer(stocks.order_by(ordering)[:limit], many=True)
+        return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
+    @cached_response(STOCKS)
     def top_gainers(self, request):
-        gainers = Stock.objects.filter(previous_close__gt=0).order_by('-current_price')[:10]
-        serializer = self.get_serializer(gainers, many=True)
-        return Response(serializer.data)
+        return self.movers(request, '-percent_change')
         
     @action(detail=False, methods=['get'])
+    @cached_response(STOCKS)
     def top_losers(self, request):
-        losers = Stock.objects.filter(previous_close__gt=0).order_by('current_price')[:10]
-        serializer = self.get_serializer(losers, many=True)
-        return Response(serializer.data)
+        return self.movers(request, 'percent_change')
+    
+    @action(detail=False, methods=['get'])
+    @cached_response(STOCKS)
+    def most_active(self, request):
+        return self.movers(request, '-volume')
+    
+    @action(detail=False, methods=['get'])
+    @cached_response(STOCKS)
+    def quotes(self, request):
+        """
+        Compact quotes for ``?symbols=A,B,C`` in one round trip, in request
+        order; unknown symbols are left out
+        """
+        symbols = list(dict.fromkeys(
+            symbol.strip().upper() for symbol in request.query_params.get('symbols', '').split(',')
+            if symbol.strip()))
+        if not symbols:
+            return Response({'error': "'symbols' is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(symbols) > QUOTES_MAX_SYMBOLS:
+            return Response({'error': f"At most {QUOTES_MAX_SYMBOLS} symbols per request"},
+                           status=status.HTTP_400_BAD_REQUEST)
+        
+        rows = {
+            row[0]: row
+            for row in Stock.objects.filter(symbol__in=symbols).values_list(
+                'symbol', 'current_price', 'previous_close', 'percent_change', 'volume', 'last_updated')
+        }
+        return Response([
+            {
+                'symbol': symbol,
+                'price': price,
+                'previousClose': previous_close,
+                'percentChange': change,
+                'volume': volume,
+                'lastUpdated': last_updated,
+            }
+            for symbol, price, previous_close, change, volume, last_updated in
+            (rows[symbol] for symbol in symbols if symbol in rows)
+        ])
+    
+    @action(detail=False, methods=['get'])
+    @cached_response(STOCKS)
+    def sector_breadth(self, request):
+        """
+        Advancers/decliners per sector; one aggregate per ingested batch,
+        every other request is a cache hit
+        """
+        sectors = [
+            {
+                'sector': row['sector_name'],
+                'advancers': row['advancers'],
+                'decliners': row['decliners'],
+                'unchanged': row['unchanged'],
+                'averageChange': round(row['average_change'] or 0, 2),
+                'volume': row['volume'] or 0,
+            }
+            for row in Stock.objects.breadth()
+        ]
+        market = {key: sum(row[key] for row in sectors) for key in ('advancers', 'decliners', 'unchanged')}
+        return Response({'market': market, 'sectors': sectors})
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Stocks matching ``?q=`` by symbol or name prefix, with typo-tolerant
+        matches filling the rest of the page; served from the in-memory index
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': "'q' is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', SEARCH_LIMIT)), 1), SEARCH_MAX_LIMIT)
+        except ValueError:
+            return Response({'error': "'limit' must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(symbol_index.search(query[:100], limit))
         
     @action(detail=True, methods=['get'])
     def historical_data(self, request, pk=None):
+        """
+        OHLCV candles for a range; accepts a ``timeframe`` preset and/or
+        explicit ``start``, ``end`` and ``interval`` query parameters.
+        Columnar formats get parallel arrays straight from the bar store.
+        """
         stock = self.get_object()
-        timeframe = request.query_params.get('timeframe', '1D')
-        
-        # Logic to filter historical data based on timeframe
-        if timeframe == '1D':
-            # Get today's data at 5-minute intervals
-            data = HistoricalData.objects.filter(stock=stock).order_by('-date')[:24]
-        elif timeframe == '1W':
-            # Get last week's data
-            data = HistoricalData.objects.filter(stock=stock).order_by('-date')[:7]
-        else:
-            # Default to 1 month
-            data = HistoricalData.objects.filter(stock=stock).order_by('-date')[:30]
-            
-        serializer = HistoricalDataSerializer(data, many=True)
-        return Response(serializer.data)
+        query = HistoricalDataQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        
+        bar_store.sync(stock)
+        last_bar = bar_store.last_timestamp(stock.symbol)
+        if last_bar is None:
+            return Response(bars_to_columns(stock, Bars.empty()) if is_columnar(request) else [])
+        
+        start, end, interval = query.resolve_range(to_datetime(last_bar))
+        bars = bar_store.query(stock.symbol, start, end, interval)
+        if len(bars) > query.MAX_BARS:
+            return Response({'error': f"Range returns {len(bars)} bars; use a coarser interval"},
+                           status=status.HTTP_400_BAD_REQUEST)
+        if is_columnar(request):
+            return Response(bars_to_columns(stock, bars, interval))
+        return Response(bars_to_representation(stock, bars))
+
+    @action(detail=True, methods=['get'])
+    def indicators(self, request, pk=None):
+        stock = self.get_object()
+        interval = request.query_params.get('interval', '1d')
+        if interval not in INTERVALS:
+            return Response({'error': f"Unsupported interval '{interval}'"},
+                           status=status.HTTP_400_BAD_REQUEST)
+        
+        values, timestamp = current_indicators(stock, interval)
+        return Response({
+            'symbol': stock.symbol,
+            'interval': interval,
+            'timestamp': to_datetime(timestamp) if timestamp is not None else None,
+            'indicators': values,
+        })
+
+    @action(detail=True, methods=['get'], url_path='options')
+    @cached_response(STOCKS)
+    def option_chain(self, request, pk=None):
+        """
+        Calls and puts at every expiry and strike around the current price;
+        volatility defaults to the trailing historical volatility
+        """
+        stock = self.get_object()
+        query = OptionChainQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        
+        spot = float(stock.current_price)
+        volatility, source = params.get('volatility'), 'request'
+        if volatility is None:
+            bar_store.sync(stock)
+            window = settings.OPTION_PRICING['volatility_window']
+            volatility, source = options.historical_volatility(
+                bar_store.query(stock.symbol, interval='1d').tail(window + 1).close, window), 'historical'
+        if not volatility:
+            return Response({'error': f"Not enough history to estimate volatility for {stock.symbol}; pass 'volatility'"},
+                           status=status.HTTP_400_BAD_REQUEST)
+        
+        strikes = query.strike_prices(spot)
+        days = np.array(params['expiries'])
+        values = options.chain(spot, strikes, days / 365, volatility, params['rate'], params['dividend'],
+                               params['model'])
+        columns = {name: np.round(array, 4).tolist() for name, array in values.items()}
+        today = timezone.localdate()
+        sides = ('call', 'put')
+        return Response({
+            'symbol': stock.symbol,
+            'underlying': spot,
+            'model': params['model'],
+            'rate': params['rate'],
+            'dividend': params['dividend'],
+            'volatility': round(volatility, 4),
+            'volatilitySource': source,
+            'expiries': [
+                {
+                    'days': int(day),
+                    'expiry': today + timedelta(days=int(day)),
+                    'strikes': [
+                        {
+                            'strike': strike,
+                            **{side: {name: columns[name][s][e][k] for name in columns}
+                               for s, side in enumerate(sides)},
+                        }
+                        for k, strike in enumerate(strikes.tolist())
+                    ],
+                }
+                for e, day in enumerate(days.tolist())
+            ],
+        })
+    
+    @action(detail=True, methods=['post'])
+    def implied_volatility(self, request, pk=None):
+        """
+        Implied volatility and Greeks for quoted contracts on this stock
+        """
+        stock = self.get_object()
+        serializer = ImpliedVolatilitySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        
+        spot = params.get('underlying', float(stock.current_price))
+        contracts = params['contracts']
+        strike = np.array([contract['strike'] for contract in contracts])
+        expiry = np.array([contract['days'] for contract in contracts]) / 365
+        is_call = np.array([contract['type'] == 'CALL' for contract in contracts])
+        premium = np.array([contract['price'] for contract in contracts])
+        pricing = (params['rate'], params['dividend'], params['model'])
+        volatility = options.implied_volatility(premium, spot, strike, expiry, is_call, *pricing)
+        solved = ~np.isnan(volatility)
+        values = options.greeks(spot, strike, expiry, np.where(solved, volatility, 1.0), is_call, *pricing)
+        columns = {name: np.where(solved, np.round(values[name], 4), np.nan).tolist()
+                   for name in ('delta', 'gamma', 'theta', 'vega')}
+        columns['impliedVolatility'] = np.round(volatility, 6).tolist()
+        return Response({
+            'symbol': stock.symbol,
+            'underlying': spot,
+            'contracts': [
+                {**contract, **{name: None if np.isnan(column[i]) else column[i] for name, column in columns.items()}}
+                for i, contract in enumerate(contracts)
+            ],
+        })
 
 class MarketIndexViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = MarketIndex.objects.all()
     serializer_class = MarketIndexSerializer
     permission_classes = [permissions.IsAuthenticated]
+    
+    @cached_response(INDICES)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
 class PortfolioViewSet(viewsets.ModelViewSet):
     serializer_class = PortfolioSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return Portfolio.objects.filter(user=self.request.user)
+        holdings = Holding.objects.select_related('stock').order_by('id')
+        return (Portfolio.objects.filter(user=self.request.user)
+                .with_totals()
+                .prefetch_related(Prefetch('holdings', queryset=holdings)))
     
     @action(detail=True, methods=['get'])
     def summary(self, request, pk=None):
+        # Totals are DB aggregates annotated on the portfolio; holdings arrive
+        # prefetched with their stocks, so the query count is independent of
+        # the number of holdings
         portfolio = self.get_object()
-        holdings = portfolio.holdings.all()
-        
-        total_value = 0
-        total_investment = 0
-        day_change = 0
-        
-        for holding in holdings:
-            current_value = holding.quantity * holding.stock.current_price
-            investment = holding.quantity * holding.average_price
-            day_change += (holding.stock.current_price - holding.stock.previous_close) * holding.quantity
-            
-            total_value += current_value
-            total_investment += investment
+        total_value = portfolio.total_value
+        total_investment = portfolio.total_investment
+        day_change = portfolio.day_change
         
         # Calculate percentages
         overall_pnl = total_value - total_investment
@@ -90,25 +325,14 @@ class PortfolioViewSet(viewsets.ModelViewSet):
         # Calculate allocation by sector
         sector_allocation = []
         if total_value > 0:
-            sector_data = {}
-            for holding in holdings:
-                sector = holding.stock.sector or 'Other'
-                sector_value = holding.quantity * holding.stock.current_price
-                
-                if sector in sector_data:
-                    sector_data[sector] += sector_value
-                else:
-                    sector_data[sector] = sector_value
-                    
-            for sector, value in sector_data.items():
-                percentage = (value / total_value) * 100
+            for row in Holding.objects.filter(portfolio=portfolio).sector_values():
                 sector_allocation.append({
-                    'category': sector,
-                    'value': round(percentage, 2)
+                    'category': row['sector'],
+                    'value': round((row['value'] / total_value) * 100, 2)
                 })
         
         # Serialize holdings for response
-        holdings_data = HoldingSerializer(holdings, many=True).data
+        holdings_data = HoldingSerializer(portfolio.holdings.all(), many=True).data
         
         response_data = {
             'totalValue': total_value,
@@ -122,9 +346,40 @@ class PortfolioViewSet(viewsets.ModelViewSet):
         }
         
         return Response(response_data)
+    
+    @action(detail=True, methods=['get'])
+    def risk(self, request, pk=None):
+        """
+        VaR/CVaR, beta, correlations and drawdown from the holdings' daily
+        bars; cached until the holdings or the bars change
+        """
+        portfolio = self.get_object()
+        query = RiskQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        benchmark = query.validated_data.get('benchmark')
+        return Response(risk.portfolio_risk(
+            portfolio,
+            lookback=query.validated_data['lookback'],
+            window=query.validated_data['window'],
+            benchmark=benchmark.name if benchmark else None,
+        ))
+    
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Value and P&L series from the stored snapshots in cursor pages; each
+        page is one range scan of the (portfolio, kind, timestamp) index
+        """
+        portfolio = self.get_object()
+        query = SnapshotQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        paginator = SnapshotPagination()
+        page = paginator.paginate_queryset(query.filter(portfolio.snapshots.all()), request, view=self)
+        return paginator.get_paginated_response(PortfolioSnapshotSerializer(page, many=True).data)
 
 class OrderViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderPagination
     
     def get_serializer_class(self):
         if self.action in ['create']:
@@ -135,7 +390,13 @@ class OrderViewSet(viewsets.ModelViewSet):
         user = self.request.user
         try:
             portfolio = Portfolio.objects.get(user=user)
-            return Order.objects.filter(portfolio=portfolio).order_by('-timestamp')
+            orders = Order.objects.filter(portfolio=portfolio).select_related('stock')
+            if self.action == 'list':
+                # Served from the (portfolio, status, timestamp) index
+                query = OrderQuerySerializer(data=self.request.query_params)
+                query.is_valid(raise_exception=True)
+                orders = query.filter(orders)
+            return orders.order_by('-timestamp', '-id')
         except Portfolio.DoesNotExist:
             return Order.objects.none()
             
@@ -151,13 +412,55 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({'status': 'Order cancelled'})
         return Response({'error': 'Only pending orders can be cancelled'}, 
                        status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Place up to OrderBatchSerializer.MAX_ORDERS orders in one request;
+        invalid orders are reported per item and the rest are still placed
+        """
+        serializer = OrderBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        portfolio, created = Portfolio.objects.get_or_create(user=request.user)
+        results = serializer.place(portfolio)
+        placed = sum(result['status'] == 'created' for result in results)
+        return Response({
+            'created': placed,
+            'rejected': len(results) - placed,
+            'results': results,
+        }, status=status.HTTP_201_CREATED if placed else status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['post'])
+    def cancel_all(self, request):
+        """
+        Cancel every pending order, optionally only for ``symbol`` and/or
+        ``order_type``
+        """
+        serializer = OrderCancelAllSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        portfolio = Portfolio.objects.filter(user=request.user).first()
+        cancelled = serializer.cancel(portfolio) if portfolio else 0
+        return Response({'cancelled': cancelled})
 
-class WatchlistViewSet(viewsets.ModelViewSet):
+class WatchlistViewSet(ColumnarMixin, viewsets.ModelViewSet):
     serializer_class = WatchlistSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return Watchlist.objects.filter(user=self.request.user)
+        return Watchlist.objects.filter(user=self.request.user).prefetch_related('stocks')
+    
+    def list(self, request, *args, **kwargs):
+        """
+        Columnar formats get one row per watchlist and stock (stock columns
+        are null for an empty watchlist)
+        """
+        if not is_columnar(request):
+            return super().list(request, *args, **kwargs)
+        watchlists = Watchlist.objects.filter(user=request.user).order_by('id', 'stocks__symbol')
+        fields = ['id', 'name', 'created_at']
+        return Response(Columns.from_values(
+            watchlists, fields + [f'stocks__{name}' for name in STOCK_COLUMNS],
+            names=fields + [f'stock_{name}' for name in STOCK_COLUMNS]))
         
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -174,3 +477,99 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         profile, created = UserProfile.objects.get_or_create(user=request.user)
         serializer = self.get_serializer(profile)
         return Response(serializer.data)
+
+def task_status(task_id):
+    """
+    State of a long-running backtest task, with its progress or result
+    """
+    result = AsyncResult(task_id)
+    data = {'task_id': task_id, 'state': result.state}
+    if result.state == 'PROGRESS' or result.successful():
+        data.update(result.info)
+    elif result.failed():
+        data['error'] = str(result.info)
+    return data
+
+class BacktestViewSet(viewsets.ViewSet):
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def list(self, request):
+        strategies = [
+            {'id': name, 'params': defaults}
+            for name, (func, defaults) in sorted(backtest.STRATEGIES.items())
+        ]
+        return Response({'strategies': strategies, 'timeframes': list(backtest.PERIODS)})
+        
+    def create(self, request):
+        serializer = BacktestRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        
+        stock = get_object_or_404(Stock, symbol=params['symbol'])
+        bars = backtest.load_period(stock, params['timeframe'], params.get('start'), params.get('end'))
+        if len(bars) == 0:
+            return Response({'error': f"No historical data for {stock.symbol}"},
+                           status=status.HTTP_400_BAD_REQUEST)
+        
+        result = backtest.run_backtest(
+            bars,
+            params['strategy'],
+            params['params'],
+            initial_capital=params['initial_capital'],
+            commission=params['commission'],
+            symbol=stock.symbol,
+        )
+        return Response(result)
+    
+    @action(detail=False, methods=['post'])
+    def sweeps(self, request):
+        serializer = SweepRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        task = run_parameter_sweep.delay(**serializer.validated_data)
+        return Response({'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
+        
+    @action(detail=False, methods=['get'], url_path=r'sweeps/(?P<task_id>[^/.]+)')
+    def sweep_status(self, request, task_id=None):
+        return Response(task_status(task_id))
+        
+    @action(detail=False, methods=['post'], url_path=r'sweeps/(?P<task_id>[^/.]+)/cancel')
+    def cancel_sweep(self, request, task_id=None):
+        cache.set(sweep_cancel_key(task_id), True, timeout=24 * 60 * 60)
+        return Response({'status': 'Cancellation requested'})
+    
+    @action(detail=False, methods=['post'])
+    def robustness(self, request):
+        serializer = RobustnessRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        get_object_or_404(Stock, symbol=serializer.validated_data['symbol'])
+        task = run_robustness_analysis.delay(**serializer.validated_data)
+        return Response({'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
+        
+    @action(detail=False, methods=['get'], url_path=r'robustness/(?P<task_id>[^/.]+)')
+    def robustness_status(self, request, task_id=None):
+        return Response(task_status(task_id))
+
+class ScreenerViewSet(viewsets.ViewSet):
+    permission_classes = [permissions.IsAuthenticated]
+    
+    @cached_response(SCREENER)
+    def list(self, request):
+        """
+        Ranked rows of the latest completed screener run (or ``?run=``),
+        filtered and sorted by ScreenerQuerySerializer
+        """
+        query = ScreenerQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        runs = ScreenerRun.objects.filter(status='COMPLETED')
+        if 'run' in query.validated_data:
+            run = get_object_or_404(runs, id=query.validated_data['run'])
+        else:
+            run = runs.order_by('-completed_at').first()
+            if run is None:
+                return Response({'run': None, 'results': []})
+        
+        results = query.filter(ScreenerResult.objects.filter(run=run).select_related('stock'))
+        return Response({
+            'run': ScreenerRunSerializer(run).data,
+            'results': ScreenerResultSerializer(results, many=True).data,
+        })
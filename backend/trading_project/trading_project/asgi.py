@@ -1,6 +1,9 @@
 
 """
 ASGI config for trading_project project.
+
+Serves Django over HTTP and the live tick stream over WebSockets, e.g.
+``uvicorn trading_project.asgi:application``.
 """
 
 import os
@@ -9,4 +12,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trading_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from trading_api.streaming import application as tick_stream, get_config  # noqa: E402
+
+TICK_STREAM_PATH = get_config()['path']
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket' and scope['path'] == TICK_STREAM_PATH:
+        return await tick_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
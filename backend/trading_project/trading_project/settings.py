@@ -3,9 +3,12 @@
 Django settings for trading_project project.
 """
 
+import logging
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -35,6 +38,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost so it times the whole stack; inactive unless enabled below
+    'trading_api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -73,6 +78,37 @@ DATABASES = {
     }
 }
 
+# Run Celery tasks in the calling process (single-process setups and tests)
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', '').lower() in ('1', 'true', 'yes')
+
+# Cache (shared between web and Celery processes). An in-memory cache is per
+# process, so sweep cancel flags and cache invalidation would never reach
+# Celery workers or other web processes: it is only allowed when tasks run
+# eagerly in a single process.
+REDIS_CACHE_URL = os.environ.get('REDIS_CACHE_URL')
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+        }
+    }
+elif CELERY_TASK_ALWAYS_EAGER:
+    logging.getLogger(__name__).warning(
+        "REDIS_CACHE_URL is not set; using a per-process in-memory cache. "
+        "Multi-process deployments (Celery workers, several web processes) must set REDIS_CACHE_URL."
+    )
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    raise ImproperlyConfigured(
+        "Set REDIS_CACHE_URL to a Redis shared by the web and Celery processes, or "
+        "CELERY_TASK_ALWAYS_EAGER=true to run tasks in-process with a per-process cache."
+    )
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -131,3 +167,77 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+
+# Server-side response cache: in-process LRU entries in front of the
+# shared cache, invalidated by ingestion; timeout is only a backstop
+RESPONSE_CACHE = {
+    'local_size': 512,
+    'timeout': 300,
+}
+
+# Columnar bar store (memory-mapped per-symbol OHLCV files)
+BAR_STORE_DIR = BASE_DIR / 'barstore'
+# Rollup levels maintained incrementally from raw bars
+BAR_STORE_ROLLUPS = ['5m', '1h', '1d']
+
+# Market data ingestion (update_stock_prices)
+MARKET_DATA_SOURCE = {
+    'class': 'trading_api.ingestion.FileReplaySource',
+    'options': {'path': str(BASE_DIR / 'market_data')},
+}
+
+# Live tick streaming (ASGI websocket); ingestion publishes to the Redis
+# channel and every ASGI worker relays it to its subscribers
+TICK_STREAM = {
+    'path': '/ws/ticks/',
+    'redis_url': 'redis://localhost:6379/2',
+    'channel': 'ticks',
+    'candle_interval': '1m',
+    'max_symbols': 200,
+}
+
+# Market screener (analyze_market_trends); universes above shard_size are
+# split across Celery workers
+SCREENER = {
+    'bars': 260,
+    'shard_size': 5000,
+    'keep_runs': 5,
+}
+
+# Backtesting
+BACKTEST_SWEEP_MAX_WORKERS = 4
+
+# Option chains: risk-free rate used unless a request passes one, and the
+# trailing window of daily closes for the default (historical) volatility
+OPTION_PRICING = {
+    'rate': 0.065,
+    'volatility_window': 30,
+}
+
+# Portfolio valuation snapshots (snapshot_portfolios); intraday snapshots
+# older than intraday_days are pruned
+PORTFOLIO_SNAPSHOTS = {
+    'intraday_days': 7,
+}
+
+# Bulk user reports (generate_user_reports); users are processed and
+# checkpointed chunk_size at a time, fees are commission x traded value
+REPORTS = {
+    'dir': BASE_DIR / 'reports',
+    'chunk_size': 1000,
+    'commission': 0,
+}
+
+# Request/task instrumentation with a Prometheus /metrics endpoint (local
+# addresses only). Requests slower than slow_request_ms get their stacks
+# sampled; profile_rate of requests also run under cProfile. Both are
+# written to profile_dir.
+INSTRUMENTATION = {
+    'enabled': False,
+    'slow_request_ms': 500,
+    'sample_interval_ms': 5,
+    'profile_rate': 0.0,
+    'profile_dir': BASE_DIR / 'profiles',
+    'keep_profiles': 50,
+    'metrics_ips': ['127.0.0.1', '::1'],
+}
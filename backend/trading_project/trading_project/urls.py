@@ -2,7 +2,10 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from trading_api import instrumentation
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('trading_api.urls')),
+    path('metrics', instrumentation.metrics),
 ]
@@ -59,8 +59,13 @@ export const stockService = {
   getStock: (symbol: string) => apiClient.get(`/stocks/${symbol}/`),
   getTopGainers: () => apiClient.get('/stocks/top_gainers/'),
   getTopLosers: () => apiClient.get('/stocks/top_losers/'),
+  getQuotes: (symbols: string[]) => apiClient.get(`/stocks/quotes/?symbols=${symbols.join(',')}`),
+  searchStocks: (query: string, limit?: number) =>
+    apiClient.get('/stocks/search/', { params: { q: query, limit } }),
   getHistoricalData: (symbol: string, timeframe: string) => 
     apiClient.get(`/stocks/${symbol}/historical_data/?timeframe=${timeframe}`),
+  getHistoricalDataColumns: (symbol: string, timeframe: string) =>
+    apiClient.get(`/stocks/${symbol}/historical_data/?timeframe=${timeframe}&format=columns`),
 };
 
 export const marketService = {
@@ -70,12 +75,19 @@ export const marketService = {
 export const portfolioService = {
   getPortfolio: () => apiClient.get('/portfolio/'),
   getPortfolioSummary: (portfolioId: number) => apiClient.get(`/portfolio/${portfolioId}/summary/`),
+  getPortfolioHistory: (portfolioId: number,
+                        params?: { kind?: string; start?: string; end?: string; cursor?: string; limit?: number }) =>
+    apiClient.get(`/portfolio/${portfolioId}/history/`, { params }),
 };
 
 export const orderService = {
-  getOrders: () => apiClient.get('/orders/'),
+  getOrders: (params?: { status?: string; cursor?: string; limit?: number }) =>
+    apiClient.get('/orders/', { params }),
   createOrder: (orderData: any) => apiClient.post('/orders/', orderData),
   cancelOrder: (orderId: number) => apiClient.post(`/orders/${orderId}/cancel/`),
+  createOrders: (orders: any[]) => apiClient.post('/orders/batch/', { orders }),
+  cancelAllOrders: (filters?: { symbol?: string; order_type?: string }) =>
+    apiClient.post('/orders/cancel_all/', filters || {}),
 };
 
 export const watchlistService = {